@@ -1,13 +1,15 @@
-from fastapi import FastAPI, UploadFile, HTTPException
+from fastapi import FastAPI, UploadFile, HTTPException, Form
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import pandas as pd
-import io
+from typing import List, Dict, Any, Iterator, Optional
 from datetime import datetime
-import xml.etree.ElementTree as ET
 import logging
 import re
 
+from statements import ledger_for_bank, parse_statement
+from fastresponse import xml_download
+from voucherxml import iter_import_envelope, voucher_message
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,171 +26,51 @@ class TransactionUpdate(BaseModel):
     amount: Optional[float] = None
 
 # Function to generate Tally XML for bulk voucher creation
-def generate_tally_xml(json_data: Dict[str, Any], selected_company: str = "Test") -> str:
-    root = ET.Element("ENVELOPE")
-    
-    header = ET.SubElement(root, "HEADER")
-    ET.SubElement(header, "TALLYREQUEST").text = "Import Data"
-
-    body = ET.SubElement(root, "BODY")
-    import_data = ET.SubElement(body, "IMPORTDATA")
-    
-    request_desc = ET.SubElement(import_data, "REQUESTDESC")
-    ET.SubElement(request_desc, "REPORTNAME").text = "Vouchers"
-    static_vars = ET.SubElement(request_desc, "STATICVARIABLES")
-    ET.SubElement(static_vars, "SVCURRENTCOMPANY").text = selected_company
-
-    request_data = ET.SubElement(import_data, "REQUESTDATA")
-    
-    # Bank ledger (assumed to exist in Tally)
-    bank_ledger = "HDFC Bank"
-
-    for transaction in json_data["transactions"]:
-        tally_message = ET.SubElement(request_data, "TALLYMESSAGE")
-        voucher = ET.SubElement(tally_message, "VOUCHER", VCHTYPE="Payment" if transaction["transaction_type"] == "debit" else "Receipt", ACTION="Create", OBJVIEW="Accounting Voucher View")
-        
-        ET.SubElement(voucher, "GUID").text = f"VCH-{transaction['ref_no']}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        ET.SubElement(voucher, "VOUCHERNUMBER").text = f"VCH-{transaction['ref_no']}"
-        ET.SubElement(voucher, "DATE").text = datetime.strptime(transaction["date"], "%Y-%m-%d").strftime("%Y%m%d")
-        ET.SubElement(voucher, "NARRATION").text = transaction["narration"]
-        ET.SubElement(voucher, "VOUCHERTYPENAME").text = "Payment" if transaction["transaction_type"] == "debit" else "Receipt"
-
-        # From ledger entry (Bank)
-        ledger_entry1 = ET.SubElement(voucher, "ALLLEDGERENTRIES.LIST")
-        ET.SubElement(ledger_entry1, "LEDGERNAME").text = bank_ledger
-        ET.SubElement(ledger_entry1, "ISDEEMEDPOSITIVE").text = "Yes" if transaction["transaction_type"] == "debit" else "No"
-        amount1 = -transaction["withdrawal_amount"] if transaction["transaction_type"] == "debit" else transaction["deposit_amount"]
-        ET.SubElement(ledger_entry1, "AMOUNT").text = str(amount1)
+def iter_tally_xml(json_data: Dict[str, Any], selected_company: str = "Test") -> Iterator[bytes]:
+    # Bank ledger of the statement's bank (assumed to exist in Tally); raises
+    # ValueError here, before anything is streamed, if the bank isn't known
+    bank_ledger = ledger_for_bank(json_data.get("bank"))
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+
+    def messages():
+        for transaction in json_data["transactions"]:
+            debit = transaction["transaction_type"] == "debit"
+            voucher_type = "Payment" if debit else "Receipt"
+            # To ledger assumed "Aparna" for debit, "Cash" for credit
+            if debit:
+                entries = [(bank_ledger, True, -transaction["withdrawal_amount"]),
+                           ("Aparna", False, transaction["withdrawal_amount"])]
+            else:
+                entries = [(bank_ledger, False, transaction["deposit_amount"]),
+                           ("Cash", True, -transaction["deposit_amount"])]
+            yield voucher_message(
+                voucher_type,
+                datetime.strptime(transaction["date"], "%Y-%m-%d").strftime("%Y%m%d"),
+                transaction["narration"],
+                entries,
+                voucher_number=f"VCH-{transaction['ref_no']}",
+                guid=f"VCH-{transaction['ref_no']}-{timestamp}",
+            )
 
-        # To ledger entry (assumed "Aparna" for debit, "Cash" for credit)
-        ledger_entry2 = ET.SubElement(voucher, "ALLLEDGERENTRIES.LIST")
-        to_ledger = "Aparna" if transaction["transaction_type"] == "debit" else "Cash"
-        ET.SubElement(ledger_entry2, "LEDGERNAME").text = to_ledger
-        ET.SubElement(ledger_entry2, "ISDEEMEDPOSITIVE").text = "No" if transaction["transaction_type"] == "debit" else "Yes"
-        amount2 = transaction["withdrawal_amount"] if transaction["transaction_type"] == "debit" else -transaction["deposit_amount"]
-        ET.SubElement(ledger_entry2, "AMOUNT").text = str(amount2)
+    return iter_import_envelope(messages(), selected_company)
 
-    # Convert the XML tree to a string
-    xml_str = ET.tostring(root, encoding="unicode", method="xml")
-    return '<?xml version="1.0" encoding="UTF-8"?>\n' + xml_str
+def generate_tally_xml(json_data: Dict[str, Any], selected_company: str = "Test") -> str:
+    return b"".join(iter_tally_xml(json_data, selected_company)).decode("utf-8")
 
 # Endpoint to upload and parse the Excel file
 @app.post("/upload-statement/")
-async def upload_statement(file: UploadFile):
+async def upload_statement(file: UploadFile, bank: Optional[str] = Form(None)):
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Only Excel files (.xlsx, .xls) are allowed")
 
-    # Read the Excel file
+    # Bank layout comes from the `bank` field or is detected from the header row
     try:
-        contents = await file.read()
-        # Use xlrd engine for .xls files
-        df = pd.read_excel(io.BytesIO(contents), sheet_name="Sheet 1", engine="xlrd", header=None)
+        parsed = await run_in_threadpool(parse_statement, file.file, file.filename, bank)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error parsing Excel file: {str(e)}")
-
-    # Debug: Log the entire DataFrame to inspect its structure
-    logger.info("DataFrame shape: %s", df.shape)
-    logger.info("DataFrame:\n%s", df.to_string())
-
-    # Parse the Excel data into JSON
-    try:
-        # Skip account_info parsing
-        account_info = {}
-
-        # Find the transaction header row dynamically
-        transaction_start_row = None
-        for idx, row in df.iterrows():
-            row_values = str(row.values)
-            if "Date" in row_values and "Narration" in row_values:
-                transaction_start_row = idx
-                break
-
-        if transaction_start_row is None:
-            logger.warning("Could not find transaction header row in Excel file")
-            transactions = []
-        else:
-            # Read the DataFrame again, starting from the transaction header row
-            # Set the header row explicitly to ensure correct column names
-            df_transactions = pd.read_excel(
-                io.BytesIO(contents),
-                sheet_name="Sheet 1",
-                skiprows=transaction_start_row,
-                header=0,  # Use the first row after skiprows as the header
-                engine="xlrd"
-            )
-
-            # Debug: Log the transaction DataFrame
-            logger.info("Transaction DataFrame head:\n%s", df_transactions.head().to_string())
-            logger.info("Transaction DataFrame columns: %s", df_transactions.columns.tolist())
-
-            # Parse transactions from the DataFrame
-            transactions = []
-            for idx, row in df_transactions.iterrows():
-                # Stop parsing at "STATEMENT SUMMARY"
-                if pd.isna(row.get('Date')) or "STATEMENT SUMMARY" in str(row.get('Date', '')):
-                    break
-
-                # Parse each transaction row
-                try:
-                    # Clean and parse the data
-                    date_str = str(row['Date']).strip()
-                    if not date_str or date_str.lower() == "nan":
-                        continue  # Skip rows with empty or invalid dates
-
-                    date = pd.to_datetime(date_str, format="%d/%m/%y").strftime("%Y-%m-%d")
-                    narration = str(row['Narration']).strip()
-                    ref_no = str(row['Chq./Ref.No.']).strip()
-                    value_date = pd.to_datetime(str(row['Value Dt']).strip(), format="%d/%m/%y").strftime("%Y-%m-%d")
-
-                    # Clean numeric fields
-                    withdrawal_amt = 0.0
-                    deposit_amt = 0.0
-                    closing_balance = 0.0
-
-                    withdrawal_str = str(row['Withdrawal Amt.']).strip()
-                    if withdrawal_str and withdrawal_str.lower() != "nan":
-                        try:
-                            withdrawal_amt = float(withdrawal_str.replace(',', ''))
-                        except ValueError:
-                            logger.warning(f"Invalid Withdrawal Amt. in row {idx}: {withdrawal_str}")
+        raise HTTPException(status_code=400, detail=f"Error parsing Excel file: {str(e)}")
 
-                    deposit_str = str(row['Deposit Amt.']).strip()
-                    if deposit_str and deposit_str.lower() != "nan":
-                        try:
-                            deposit_amt = float(deposit_str.replace(',', ''))
-                        except ValueError:
-                            logger.warning(f"Invalid Deposit Amt. in row {idx}: {deposit_str}")
-
-                    closing_balance_str = str(row['Closing Balance']).strip()
-                    if closing_balance_str and closing_balance_str.lower() != "nan":
-                        try:
-                            closing_balance = float(closing_balance_str.replace(',', ''))
-                        except ValueError:
-                            logger.warning(f"Invalid Closing Balance in row {idx}: {closing_balance_str}")
-
-                    transaction_type = "debit" if withdrawal_amt > 0 else "credit"
-                    category = "UPI Payment" if "UPI" in narration else "Other"
-
-                    transaction = {
-                        "date": date,
-                        "narration": narration,
-                        "ref_no": ref_no,
-                        "value_date": value_date,
-                        "withdrawal_amount": withdrawal_amt,
-                        "deposit_amount": deposit_amt,
-                        "closing_balance": closing_balance,
-                        "transaction_type": transaction_type,
-                        "category": category
-                    }
-                    transactions.append(transaction)
-                except Exception as e:
-                    logger.error(f"Error parsing transaction row {idx}: {row.to_dict()}, Error: {str(e)}")
-                    continue
-
-        json_data = {"account_info": account_info, "transactions": transactions}
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing Excel data: {str(e)}")
+    logger.info("Parsed %d %s transactions from %s", len(parsed["transactions"]), parsed["bank"], file.filename)
+    json_data = {"account_info": {}, "bank": parsed["bank"], "transactions": parsed["transactions"]}
 
     # Store the JSON in memory (simulating backend storage)
     statement_id = "statement_1"  # In a real app, this would be a unique ID
@@ -244,12 +126,21 @@ async def update_transaction(statement_id: str, update: TransactionUpdate):
 
 # Endpoint to generate Tally XML from the JSON
 @app.get("/statement/{statement_id}/tally-xml")
-async def generate_tally_xml_endpoint(statement_id: str, selected_company: str = "Test"):
+async def generate_tally_xml_endpoint(
+    statement_id: str, selected_company: str = "Test", download: bool = False, gzip: bool = False
+):
     if statement_id not in stored_data:
         raise HTTPException(status_code=404, detail="Statement not found")
 
     json_data = stored_data[statement_id]
-    xml_str = generate_tally_xml(json_data, selected_company)
+    try:
+        chunks = iter_tally_xml(json_data, selected_company)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if download:
+        # Streamed as application/xml (or .xml.gz) while the vouchers are generated
+        return xml_download(chunks, f"{statement_id}.xml", gzip)
+    xml_str = b"".join(chunks).decode("utf-8")
 
     return {"tally_xml": xml_str}
 
@@ -0,0 +1,475 @@
+import argparse
+import datetime
+import decimal
+import gzip
+import io
+import json
+import math
+import random
+import re
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+
+from fastresponse import brotli, compress, dumps
+from statements import PARSERS, hdfc_transactions, iter_statement_chunks, parse_hdfc_statement, parse_statement
+from tallyclient import get_client
+from tallysim import TallySimulator, load_seed_ledgers, start as start_simulator
+from tallyxml import clean_xml, iter_records, sanitize_xml_chunks
+from voucherxml import import_envelope, tally_date, transaction_voucher
+
+CHUNK_SIZE = 64 * 1024
+
+
+def measure(fn, repeat: int = 3):
+    """Run fn `repeat` times; return (result, best wall time, peak traced memory of one run)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def report(name: str, size: int, result, seconds: float, peak: int):
+    print(f"  {name:<28} {seconds * 1000:9.1f} ms  {size / seconds / 1e6:8.1f} MB/s  "
+          f"peak {peak / 1e6:8.1f} MB  -> {result}")
+
+
+# ---------- SANITIZE / PARSE ----------
+
+def build_ledger_dump(copies: int, seed_file: str = "debug_tally_ledgers.xml") -> bytes:
+    """Scale up a real ledger export by repeating its LEDGER records `copies` times."""
+    text = open(seed_file, encoding="utf-8").read()
+    start = text.index("<LEDGER NAME=")
+    end = text.rindex("</LEDGER>") + len("</LEDGER>")
+    head, records, tail = text[:start], text[start:end], text[end:]
+    # Sprinkle in the control characters Tally is known to emit
+    dirty = records.replace("</PARENT>", "&#4;</PARENT>").replace("<NAME>", "<NAME>\x01", 1)
+    body = "\n".join(dirty.replace('NAME="', f'NAME="{i}-') for i in range(copies))
+    return (head + body + tail).encode("utf-8")
+
+
+def _legacy_sanitize_xml(text: str) -> str:
+    # getledgernames.py before the streaming sanitizer
+    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)
+    return text.encode('utf-8').decode('utf-8', errors='replace')
+
+
+def bench_sanitize(args):
+    data = build_ledger_dump(args.copies)
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    print(f"Ledger dump: {len(data) / 1e6:.1f} MB, {len(chunks)} chunks of {CHUNK_SIZE // 1024} KiB")
+
+    # The streaming sanitizer has to match clean_xml on the text requests would
+    # have decoded, odd chunk boundaries and invalid UTF-8 (a Latin-1 é) included
+    latin1 = data.replace(b'NAME="', b'NAME="Caf\xe9 ', 50)
+    for sample in (data, latin1):
+        odd_chunks = [sample[i:i + 4093] for i in range(0, len(sample), 4093)]
+        expected = clean_xml(sample.decode("utf-8", "replace")).encode("utf-8")
+        assert b"".join(sanitize_xml_chunks(iter(odd_chunks))) == expected, "streaming sanitizer differs from clean_xml"
+    assert (sum(1 for _ in iter_records(sanitize_xml_chunks(iter([latin1])), "LEDGER"))
+            == sum(1 for _ in iter_records(sanitize_xml_chunks(iter([data])), "LEDGER")))
+
+    def regex_clean():
+        return len(clean_xml(data.decode("utf-8")))
+
+    def legacy_getledgernames_clean():
+        return len(_legacy_sanitize_xml(clean_xml(data.decode("utf-8"))))
+
+    def streaming_clean():
+        return sum(len(c) for c in sanitize_xml_chunks(iter(chunks)))
+
+    def regex_clean_and_parse():
+        root = ET.fromstring(clean_xml(data.decode("utf-8")))
+        return sum(1 for ledger in root.findall(".//LEDGER") if ledger.findtext(".//NAME"))
+
+    def streaming_clean_and_parse():
+        return sum(1 for ledger in iter_records(sanitize_xml_chunks(iter(chunks)), "LEDGER")
+                   if ledger.findtext(".//NAME"))
+
+    print("\n🧹 Sanitize only")
+    for name, fn in [
+        ("regex clean_xml", regex_clean),
+        ("regex + getledgernames pass", legacy_getledgernames_clean),
+        ("streaming byte sanitizer", streaming_clean),
+    ]:
+        report(name, len(data), *measure(fn, args.repeat))
+
+    print("\n📂 Sanitize + parse ledgers")
+    for name, fn in [
+        ("clean_xml + ET.fromstring", regex_clean_and_parse),
+        ("sanitizer + iter_records", streaming_clean_and_parse),
+    ]:
+        report(name, len(data), *measure(fn, args.repeat))
+
+
+# ---------- STATEMENT PARSING ----------
+
+def build_hdfc_statement(rows: int) -> bytes:
+    """A synthetic HDFC .xlsx export: bank preamble, header, separator, rows, summary."""
+    rng = random.Random(42)
+    sheet = [["HDFC BANK Ltd."], ["Statement of account"], [], []]
+    sheet.append(["Date", "Narration", "Chq./Ref.No.", "Value Dt", "Withdrawal Amt.", "Deposit Amt.", "Closing Balance"])
+    sheet.append(["********"] * 7)
+    balance = 100000.0
+    for i in range(rows):
+        day = f"{1 + i % 28:02d}/{1 + (i // 28) % 12:02d}/24"
+        amount = round(rng.uniform(10, 5000), 2)
+        debit = rng.random() < 0.6
+        balance += -amount if debit else amount
+        narration = f"UPI-MERCHANT{i}-OK" if rng.random() < 0.5 else f"NEFT CR-CUSTOMER {i}"
+        sheet.append([day, narration, f"{i:016d}", day,
+                      amount if debit else None, None if debit else f"{amount:,.2f}", round(balance, 2)])
+    sheet += [[], ["STATEMENT SUMMARY :-"]]
+    buf = io.BytesIO()
+    pd.DataFrame(sheet).to_excel(buf, header=False, index=False, engine="openpyxl")
+    return buf.getvalue()
+
+
+def _legacy_hdfc_rows(df_transactions: pd.DataFrame) -> list:
+    # parse_hdfc_statement's per-row loop before vectorizing
+    def safe_str(val):
+        if val is None or (isinstance(val, float) and math.isnan(val)):
+            return ""
+        return str(val).strip()
+
+    def safe_float(val):
+        try:
+            f = float(str(val).replace(",", ""))
+            return 0.0 if math.isnan(f) else f
+        except Exception:
+            return 0.0
+
+    transactions = []
+    for _, row in df_transactions.iterrows():
+        if pd.isna(row.get('Date')) or "STATEMENT SUMMARY" in str(row.get('Date', '')):
+            break
+        try:
+            date_str = safe_str(row['Date'])
+            if not date_str or date_str.lower() == "nan":
+                continue
+            date = pd.to_datetime(date_str, format="%d/%m/%y").strftime("%Y-%m-%d")
+            narration = safe_str(row['Narration'])
+            ref_no = safe_str(row['Chq./Ref.No.'])
+            value_date = pd.to_datetime(safe_str(row['Value Dt']), format="%d/%m/%y").strftime("%Y-%m-%d")
+            withdrawal_amt = safe_float(row['Withdrawal Amt.'])
+            deposit_amt = safe_float(row['Deposit Amt.'])
+            closing_balance = safe_float(row['Closing Balance'])
+            transactions.append({
+                "date": date, "narration": narration, "ref_no": ref_no, "value_date": value_date,
+                "withdrawal_amount": withdrawal_amt, "deposit_amount": deposit_amt,
+                "closing_balance": closing_balance,
+                "transaction_type": "debit" if withdrawal_amt > 0 else "credit",
+                "category": "UPI Payment" if "UPI" in narration else "Other",
+                "from_ledger": None, "to_ledger": None, "voucher": None, "status": None,
+            })
+        except Exception:
+            continue
+    return transactions
+
+
+def _legacy_parse_hdfc_statement(contents: bytes) -> list:
+    # Two reads: headerless to find the header row, then again with skiprows
+    df = pd.read_excel(io.BytesIO(contents), sheet_name=0, engine="openpyxl", header=None)
+    header_row = next(idx for idx, row in df.iterrows()
+                      if "Date" in [str(v).strip() for v in row.values]
+                      and "Narration" in [str(v).strip() for v in row.values])
+    df_transactions = pd.read_excel(io.BytesIO(contents), sheet_name=0, skiprows=header_row,
+                                    header=0, engine="openpyxl")
+    return _legacy_hdfc_rows(df_transactions)
+
+
+def bench_hdfc(args):
+    data = build_hdfc_statement(args.rows)
+    print(f"HDFC statement: {args.rows} rows, {len(data) / 1e6:.1f} MB .xlsx")
+
+    raw = pd.read_excel(io.BytesIO(data), sheet_name=0, engine="openpyxl", header=None)
+    header_row = int(raw.index[raw.iloc[:, 0].astype(str).str.strip() == "Date"][0])
+    framed = pd.read_excel(io.BytesIO(data), sheet_name=0, engine="openpyxl", skiprows=header_row, header=0)
+
+    legacy = _legacy_hdfc_rows(framed)
+    vectorized = hdfc_transactions(raw)
+    assert legacy == vectorized, "vectorized parser output differs from the row loop"
+
+    print("\n🧮 Transform only (workbook already loaded)")
+    for name, fn in [
+        ("iterrows row loop", lambda: len(_legacy_hdfc_rows(framed))),
+        ("vectorized columns", lambda: len(hdfc_transactions(raw))),
+    ]:
+        report(name, len(data), *measure(fn, args.repeat))
+
+    print("\n📄 End to end (read + transform)")
+    for name, fn in [
+        ("two reads + iterrows", lambda: len(_legacy_parse_hdfc_statement(data))),
+        ("one read + vectorized", lambda: len(parse_hdfc_statement(data, "statement.xlsx")["transactions"])),
+    ]:
+        report(name, len(data), *measure(fn, args.repeat))
+
+
+def bench_stream(args):
+    data = build_hdfc_statement(args.rows)
+    print(f"HDFC statement: {args.rows} rows, {len(data) / 1e6:.1f} MB .xlsx, chunks of {args.chunk_rows}")
+
+    loaded = parse_hdfc_statement(data, "statement.xlsx")["transactions"]
+    streamed = [t for chunk in iter_statement_chunks(io.BytesIO(data), "statement.xlsx", "HDFC", args.chunk_rows)[1]
+                for t in chunk]
+    assert loaded == streamed, "streaming reader output differs from read_excel"
+
+    def consume_loaded():
+        # What the upload did before: whole file -> DataFrame -> list of every transaction
+        return len(parse_hdfc_statement(data, "statement.xlsx")["transactions"])
+
+    def consume_streamed():
+        # What the upload does now: one chunk alive at a time on its way to the inserts
+        _, chunks = iter_statement_chunks(io.BytesIO(data), "statement.xlsx", "HDFC", args.chunk_rows)
+        return sum(len(chunk) for chunk in chunks)
+
+    print("\n🌊 Whole workbook vs streaming reader")
+    for name, fn in [
+        ("read_excel + full list", consume_loaded),
+        ("read-only stream, chunked", consume_streamed),
+    ]:
+        report(name, len(data), *measure(fn, args.repeat))
+
+
+def build_statement(parser, rows: int) -> bytes:
+    """A synthetic .xlsx statement in any registered parser's layout."""
+    rng = random.Random(7)
+    fields = list(parser.columns)
+    sheet = [[f"{parser.bank} statement of account"], ["Account No: XXXXXXXX1234"], []]
+    sheet.append(["S No."] + [parser.columns[f] for f in fields])
+    balance = 250000.0
+    start = pd.Timestamp("2023-04-01")
+    for i in range(rows):
+        day = (start + pd.Timedelta(days=i // 40)).strftime(parser.date_format)
+        amount = round(rng.uniform(10, 5000), 2)
+        debit = rng.random() < 0.6
+        balance += -amount if debit else amount
+        values = {
+            "date": day, "value_date": day, "ref_no": f"{rng.randrange(10**11):012d}",
+            "narration": f"UPI/{i}/PAYMENT" if rng.random() < 0.5 else f"NEFT-{i}-CUSTOMER",
+            "withdrawal_amount": amount if debit else 0.0, "deposit_amount": 0.0 if debit else amount,
+            "closing_balance": f"{balance:,.2f}",
+        }
+        sheet.append([i + 1] + [values[f] for f in fields])
+    sheet += [[], [None, parser.end_markers[0] if parser.end_markers else ""]]
+    buf = io.BytesIO()
+    pd.DataFrame(sheet).to_excel(buf, header=False, index=False, engine="openpyxl")
+    return buf.getvalue()
+
+
+def bench_parsers(args):
+    print(f"Synthetic statements: {args.rows} rows each")
+    for bank, parser in PARSERS.items():
+        data = build_statement(parser, args.rows)
+        print(f"\n🏦 {bank} ({len(data) / 1e6:.1f} MB .xlsx)")
+        for name, hint in [("bank field", bank), ("header detection", None)]:
+            def run(hint=hint):
+                parsed = parse_statement(io.BytesIO(data), "statement.xlsx", hint)
+                assert parsed["bank"] == bank and len(parsed["transactions"]) == args.rows
+                return len(parsed["transactions"])
+            report(name, len(data), *measure(run, args.repeat))
+
+
+# ---------- JSON RESPONSES ----------
+
+def build_transaction_rows(rows: int) -> list:
+    """Rows shaped like SELECT * FROM transactions: Decimal amounts, date and timestamp columns."""
+    rng = random.Random(42)
+    created = datetime.datetime(2024, 4, 1, 10, 30, 15, 123456)
+    out = []
+    for i in range(rows):
+        day = datetime.date(2024, 4, 1) + datetime.timedelta(days=i % 365)
+        withdrawal = decimal.Decimal(rng.randint(0, 500000)) / 100 if i % 3 else decimal.Decimal("0.00")
+        out.append({
+            "id": f"{i:08d}-7c1e-4f0a-9d3b-5e2a6c8b1f4d",
+            "statement_id": "3f2b9c1e-8a7d-4e6f-b5c4-1d2e3f4a5b6c",
+            "company_id": "a1b2c3d4-e5f6-4a7b-8c9d-0e1f2a3b4c5d",
+            "date": day,
+            "narration": f"UPI-MERCHANT {rng.randint(1000, 9999)}-{rng.randint(10**11, 10**12)}@okaxis-PAYMENT",
+            "ref_no": str(rng.randint(10**11, 10**12)),
+            "value_date": day,
+            "withdrawal_amount": withdrawal,
+            "deposit_amount": decimal.Decimal(rng.randint(0, 500000)) / 100 if not withdrawal else decimal.Decimal("0.00"),
+            "closing_balance": decimal.Decimal(rng.randint(0, 10**9)) / 100,
+            "transaction_type": "debit" if withdrawal else "credit",
+            "category": "UPI Payment",
+            "from_ledger": "HDFC Bank" if withdrawal else None,
+            "to_ledger": None if withdrawal else "HDFC Bank",
+            "voucher": "Payment" if withdrawal else "Receipt",
+            "status": "Pending",
+            "remark": None,
+            "created_at": created,
+        })
+    return out
+
+
+def bench_json(args):
+    rows = build_transaction_rows(args.rows)
+    print(f"Transactions: {args.rows} rows")
+
+    default_body = json.dumps(jsonable_encoder(rows), ensure_ascii=False, separators=(",", ":")).encode()
+    fast_body = dumps(rows)
+    assert json.loads(default_body) == json.loads(fast_body), "orjson output differs from FastAPI's encoder"
+
+    print("\n🧾 Encode")
+    for name, fn in [
+        ("jsonable_encoder + json", lambda: len(json.dumps(
+            jsonable_encoder(rows), ensure_ascii=False, separators=(",", ":")).encode())),
+        ("orjson", lambda: len(dumps(rows))),
+    ]:
+        report(name, len(fast_body), *measure(fn, args.repeat))
+
+    print("\n📦 Bytes on the wire")
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    print(f"  {'identity':<28} {len(fast_body):>10} bytes")
+    for encoding in encodings:
+        (size, seconds, _) = measure(lambda: len(compress(fast_body, encoding)), args.repeat)
+        print(f"  {encoding:<28} {size:>10} bytes  {len(fast_body) / size:5.1f}x  {seconds * 1000:7.1f} ms")
+    assert gzip.decompress(compress(fast_body, "gzip")) == fast_body
+
+
+# ---------- VOUCHER XML ----------
+
+def _legacy_et_vouchers(transactions: list, selected_company: str) -> str:
+    """The ElementTree envelope tally.py used to build for DB transactions."""
+    root = ET.Element("ENVELOPE")
+    ET.SubElement(ET.SubElement(root, "HEADER"), "TALLYREQUEST").text = "Import Data"
+    importdata = ET.SubElement(ET.SubElement(root, "BODY"), "IMPORTDATA")
+    requestdesc = ET.SubElement(importdata, "REQUESTDESC")
+    ET.SubElement(requestdesc, "REPORTNAME").text = "Vouchers"
+    ET.SubElement(ET.SubElement(requestdesc, "STATICVARIABLES"), "SVCURRENTCOMPANY").text = selected_company
+    requestdata = ET.SubElement(importdata, "REQUESTDATA")
+    for tx in transactions:
+        voucher_type = (tx.get("voucher") or "Payment").capitalize()
+        if tx["withdrawal_amount"] > 0:
+            amount = float(tx["withdrawal_amount"])
+            legs = [(tx["from_ledger"], "Yes", -amount), (tx["to_ledger"], "No", amount)]
+        else:
+            amount = float(tx["deposit_amount"])
+            legs = [(tx["from_ledger"], "No", amount), (tx["to_ledger"], "Yes", -amount)]
+        voucher = ET.SubElement(ET.SubElement(requestdata, "TALLYMESSAGE"), "VOUCHER",
+                                VCHTYPE=voucher_type, ACTION="Create", OBJVIEW="Accounting Voucher View")
+        ET.SubElement(voucher, "VOUCHERNUMBER").text = tx["ref_no"]
+        ET.SubElement(voucher, "DATE").text = tally_date(tx["date"])
+        ET.SubElement(voucher, "NARRATION").text = tx["narration"]
+        ET.SubElement(voucher, "VOUCHERTYPENAME").text = voucher_type
+        for ledger, deemed_positive, leg_amount in legs:
+            entry = ET.SubElement(voucher, "ALLLEDGERENTRIES.LIST")
+            ET.SubElement(entry, "LEDGERNAME").text = ledger
+            ET.SubElement(entry, "ISDEEMEDPOSITIVE").text = deemed_positive
+            ET.SubElement(entry, "AMOUNT").text = str(leg_amount)
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode")
+
+
+def bench_vouchers(args):
+    rows = build_transaction_rows(args.rows)
+    for i, tx in enumerate(rows):
+        tx["from_ledger"], tx["to_ledger"] = "HDFC Bank", f"Vendor {i % 50} & Sons"
+    print(f"Vouchers: {args.rows}")
+
+    # Same vouchers either way (the template also carries GUID/REMOTEID)
+    legacy = ET.fromstring(_legacy_et_vouchers(rows[:100], "Acme").encode())
+    template = ET.fromstring(import_envelope((transaction_voucher(tx) for tx in rows[:100]), "Acme"))
+    for a, b in zip(legacy.iter("VOUCHER"), template.iter("VOUCHER")):
+        for tag in ("VOUCHERNUMBER", "DATE", "NARRATION", "VOUCHERTYPENAME"):
+            assert a.findtext(tag) == b.findtext(tag), tag
+        assert [e.text for e in a.iter("LEDGERNAME")] == [e.text for e in b.iter("LEDGERNAME")]
+        assert [e.text for e in a.iter("AMOUNT")] == [e.text for e in b.iter("AMOUNT")]
+
+    for name, fn in [
+        ("ElementTree + tostring", lambda: len(_legacy_et_vouchers(rows, "Acme").encode("utf-8"))),
+        ("templates -> bytes", lambda: len(import_envelope((transaction_voucher(tx) for tx in rows), "Acme"))),
+    ]:
+        size, seconds, peak = measure(fn, args.repeat)
+        print(f"  {name:<28} {seconds * 1000:9.1f} ms  {args.rows / seconds:9.0f} vouchers/s  "
+              f"peak {peak / 1e6:8.1f} MB  -> {size} bytes")
+
+
+def bench_tally(args):
+    rows = build_transaction_rows(args.rows)
+    for tx in rows:
+        tx["from_ledger"], tx["to_ledger"] = "HDFC Bank", "Cash"
+    simulator = TallySimulator(
+        seed_ledgers=load_seed_ledgers("debug_tally_ledgers.xml"),
+        latency=args.latency_ms / 1000,
+        record_time=args.record_ms / 1000,
+        random_seed=1,
+        quiet=True,
+    )
+    server = start_simulator(simulator)
+    client = get_client("http://%s:%d" % server.server_address)
+    print(f"Vouchers: {args.rows}, Tally simulator at {args.latency_ms} ms/request + {args.record_ms} ms/voucher")
+
+    # Every round after the first alters the vouchers the first one created (same REMOTEIDs)
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        saved = 0
+        for i in range(0, len(rows), batch_size):
+            body = client.post(import_envelope(transaction_voucher(tx) for tx in rows[i:i + batch_size]),
+                               lane="bulk").content
+            saved += sum(int(n) for n in re.findall(rb"<(?:CREATED|ALTERED)>(\d+)<", body))
+        seconds = time.perf_counter() - start
+        requests = math.ceil(len(rows) / batch_size)
+        print(f"  batch {batch_size:<22} {seconds * 1000:9.1f} ms  {args.rows / seconds:9.0f} vouchers/s  "
+              f"{requests:6d} requests -> {saved} saved")
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the Tally integration hot paths")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("sanitize", help="Regex clean_xml vs streaming byte sanitizer on a scaled ledger dump")
+    p.add_argument("--copies", type=int, default=2000, help="How many times to repeat the seed ledgers")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_sanitize)
+
+    p = sub.add_parser("hdfc", help="Row-loop vs vectorized HDFC statement parsing")
+    p.add_argument("--rows", type=int, default=5000, help="Transactions in the generated statement")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_hdfc)
+
+    p = sub.add_parser("stream", help="Peak memory of whole-workbook vs streaming statement reading")
+    p.add_argument("--rows", type=int, default=50000, help="Transactions in the generated statement")
+    p.add_argument("--chunk-rows", type=int, default=2000)
+    p.add_argument("--repeat", type=int, default=1)
+    p.set_defaults(func=bench_stream)
+
+    p = sub.add_parser("parsers", help="Every registered bank parser on a synthetic statement")
+    p.add_argument("--rows", type=int, default=10000, help="Transactions per generated statement")
+    p.add_argument("--repeat", type=int, default=1)
+    p.set_defaults(func=bench_parsers)
+
+    p = sub.add_parser("json", help="FastAPI's default JSON encoding vs orjson, and gzip/brotli sizes")
+    p.add_argument("--rows", type=int, default=10000, help="Transactions in the response")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_json)
+
+    p = sub.add_parser("vouchers", help="ElementTree vs template voucher XML serialization")
+    p.add_argument("--rows", type=int, default=20000, help="Vouchers in the envelope")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_vouchers)
+
+    p = sub.add_parser("tally", help="Import batch sizes against the local Tally simulator")
+    p.add_argument("--rows", type=int, default=5000, help="Vouchers pushed per batch size")
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 500, 5000])
+    p.add_argument("--latency-ms", type=float, default=20, help="Simulated Tally time per request")
+    p.add_argument("--record-ms", type=float, default=0.2, help="Simulated Tally time per voucher")
+    p.set_defaults(func=bench_tally)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
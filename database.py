@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Connection pool settings, shared by the sync and the async engine (each gets its own pool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Reconnect connections older than this; hosted Postgres and proxies drop idle ones
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# asyncpg prepared statement cache; set to 0 behind a transaction-mode pgbouncer
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+
+def pool_options() -> dict:
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def async_engine_options(database_url: str) -> tuple:
+    """
+    (url, connect_args) for create_async_engine: the same database through
+    asyncpg. asyncpg takes sslmode as its `ssl` argument, not in the URL.
+    """
+    url = make_url(database_url)
+    query = dict(url.query)
+    connect_args = {"statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    sslmode = query.pop("sslmode", None)
+    if sslmode:
+        connect_args["ssl"] = sslmode
+    url = url.set(drivername="postgresql+asyncpg", query=query)
+    return url, connect_args
+
+
+class PoolStats:
+    """
+    Checkout counts and connection wait times for one engine's pool.
+    Wait time is measured by the session dependencies around getting the
+    request's connection, so it includes any new connection's connect time.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "connect", self._on_connect)
+
+    def _on_checkout(self, *args):
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_connect(self, *args):
+        with self._lock:
+            self.connects += 1
+
+    def record_wait(self, started: float):
+        """Record a connection wait that began at time.perf_counter() value `started`."""
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self.waits += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "pool_size": self.pool.size(),
+                "checked_out": self.pool.checkedout(),
+                "idle": self.pool.checkedin(),
+                "overflow": self.pool.overflow(),
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "avg_wait_ms": round(self.wait_total / self.waits * 1000, 3) if self.waits else 0.0,
+                "max_wait_ms": round(self.wait_max * 1000, 3),
+            }
@@ -0,0 +1,222 @@
+import datetime
+import decimal
+import os
+import uuid
+import zlib
+from collections.abc import Mapping
+from typing import Iterable, Iterator, Optional
+
+import orjson
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Responses smaller than this are sent as they are; compressing them costs more than it saves
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+# Bodies bigger than this are compressed off the event loop
+COMPRESSION_THREAD_SIZE = 256 * 1024
+# A streamed response is flushed to the client once this much input has been
+# compressed since the last flush (and at the end), not after every chunk
+COMPRESSION_FLUSH_SIZE = int(os.getenv("COMPRESSION_FLUSH_SIZE", str(64 * 1024)))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/xml", "application/javascript", "text/")
+
+
+# ---------- JSON ----------
+
+def _default(obj):
+    # Types orjson doesn't know, encoded the way FastAPI's jsonable_encoder does
+    if isinstance(obj, decimal.Decimal):
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, Mapping):  # SQLAlchemy RowMapping
+        return dict(obj)
+    if isinstance(obj, uuid.UUID):  # asyncpg's own UUID subclass, which orjson doesn't take
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """orjson with the extra types our query results carry (Decimal, RowMapping, ...)."""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered by orjson. Return it directly from an endpoint so
+    FastAPI's jsonable_encoder pass over every row is skipped as well.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+# ---------- COMPRESSION ----------
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick "br" or "gzip" from an Accept-Encoding header; None for identity."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip()] = q
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    for coding in candidates:
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    # Event streams must reach the client event by event
+    if content_type.startswith("text/event-stream"):
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES) or "+json" in content_type or "+xml" in content_type
+
+
+class Compressor:
+    """One response body's gzip or brotli stream."""
+
+    def __init__(self, encoding: str, flush_size: int = COMPRESSION_FLUSH_SIZE):
+        self.encoding = encoding
+        self.flush_size = flush_size
+        self.unflushed = 0
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._gz = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        # Every flush_size bytes of input, flush out what the data compressed
+        # to so far, so a streamed download reaches the client as it is generated
+        self.unflushed += len(data)
+        flush = self.unflushed >= self.flush_size
+        if flush:
+            self.unflushed = 0
+        if self.encoding == "br":
+            out = self._br.process(data)
+            return out + self._br.flush() if flush else out
+        out = self._gz.compress(data)
+        return out + self._gz.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._br.process(data) + self._br.finish()
+        return self._gz.compress(data) + self._gz.flush()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    return Compressor(encoding).finish(data)
+
+
+class CompressionMiddleware:
+    """
+    gzip/brotli for JSON, XML and text responses of at least `minimum_size`
+    bytes, negotiated per request from Accept-Encoding (brotli preferred).
+    Streaming responses are compressed chunk by chunk.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if passthrough or message["type"] not in ("http.response.start", "http.response.body"):
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start = message  # held back until we know the body
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                if not compressible(headers) or (not more_body and len(body) < self.minimum_size):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = Compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    if len(body) >= COMPRESSION_THREAD_SIZE:
+                        body = await run_in_threadpool(compressor.finish, body)
+                    else:
+                        body = compressor.finish(body)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(start)
+
+            if more_body:
+                body = compressor.compress(body) if body else b""
+                if body:
+                    await send({"type": "http.response.body", "body": body, "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": compressor.finish(body)})
+
+        await self.app(scope, receive, send_compressed)
+
+
+# ---------- DOWNLOADS ----------
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = COMPRESSION_GZIP_LEVEL) -> Iterator[bytes]:
+    """Compress a byte stream into a .gz file stream as it is produced."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def xml_download(chunks: Iterable[bytes], filename: str, gzip: bool = False) -> StreamingResponse:
+    """
+    Stream generated XML as a file download; bytes go out as they are produced.
+    With gzip the file itself is compressed (filename.gz), for offline imports.
+    A sync iterable is run in the threadpool by StreamingResponse.
+    """
+    media_type = "application/xml"
+    if gzip:
+        chunks, media_type, filename = gzip_chunks(chunks), "application/gzip", filename + ".gz"
+    return StreamingResponse(
+        chunks, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
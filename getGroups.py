@@ -1,13 +1,11 @@
 import requests
 
-# Tally server details
-TALLY_URL = "http://localhost:9000"
+from tallyclient import TALLY_URL, post_xml
 
 def send_to_tally(xml: str) -> str:
     """Send XML request to Tally and return the response."""
-    headers = {"Content-Type": "application/xml"}
     try:
-        response = requests.post(TALLY_URL, data=xml.encode('utf-8'), headers=headers)
+        response = post_xml(xml)
         response.raise_for_status()
         print("\n[DEBUG] Raw Response Bytes:\n", response.content)
         print("\n[DEBUG] Raw Tally Response:\n", response.content.decode('utf-8', errors='replace'))
@@ -1,13 +1,12 @@
 import requests
 
-# Tally server details
-TALLY_URL = "http://localhost:9000"
+from tallyclient import TALLY_URL, post_xml
+from tallyxml import iter_tally_records
 
 def send_to_tally(xml: str) -> str:
     """Send XML request to Tally and return the response."""
-    headers = {"Content-Type": "application/xml"}
     try:
-        response = requests.post(TALLY_URL, data=xml.encode('utf-8'), headers=headers)
+        response = post_xml(xml)
         response.raise_for_status()
         print("\n[DEBUG] Raw Response Bytes:\n", response.content)
         print("\n[DEBUG] Raw Tally Response:\n", response.content.decode('utf-8', errors='replace'))
@@ -16,9 +15,9 @@ def send_to_tally(xml: str) -> str:
         print(f"❌ Failed to connect to Tally: {str(e)}")
         return ""
 
-def fetch_all_vouchers(company_name: str, start_date: str, end_date: str):
-    """Fetch the raw Tally response for all vouchers within a date range."""
-    xml = f"""
+def generate_all_vouchers_xml(company_name: str, start_date: str, end_date: str) -> str:
+    """Build the export request for all vouchers within a date range."""
+    return f"""
     <ENVELOPE>
       <HEADER>
         <VERSION>1</VERSION>
@@ -53,17 +52,49 @@ def fetch_all_vouchers(company_name: str, start_date: str, end_date: str):
       </BODY>
     </ENVELOPE>
     """
+
+def fetch_all_vouchers(company_name: str, start_date: str, end_date: str):
+    """Fetch the raw Tally response for all vouchers within a date range."""
+    xml = generate_all_vouchers_xml(company_name, start_date, end_date)
     print("\n[DEBUG] XML Sent to Tally:\n", xml)
     response = send_to_tally(xml)
     return response
 
+def iter_vouchers(company_name: str, start_date: str, end_date: str):
+    """Stream vouchers within a date range one at a time, without holding the whole export in memory."""
+    xml = generate_all_vouchers_xml(company_name, start_date, end_date)
+    for voucher in iter_tally_records(xml, "VOUCHER", clean=True):
+        if not len(voucher):
+            continue  # <CMPINFO> reuses the VOUCHER tag for its object count
+        yield {
+            "date": voucher.findtext("DATE"),
+            "voucher_type": voucher.findtext("VOUCHERTYPENAME"),
+            "voucher_number": voucher.findtext("VOUCHERNUMBER"),
+            "party_ledger": voucher.findtext("PARTYLEDGERNAME"),
+            "amount": voucher.findtext("AMOUNT"),
+            "master_id": voucher.findtext("MASTERID"),
+            "narration": voucher.findtext("NARRATION"),
+            "ledger_entries": [
+                {"ledger": entry.findtext("LEDGERNAME"), "amount": entry.findtext("AMOUNT")}
+                for entry in voucher.iter("ALLLEDGERENTRIES.LIST")
+            ],
+        }
+
 def main():
     """Main function to fetch and display the raw Tally response for all vouchers."""
     company_name = "Test"  # Replace with your company name
     start_date = "20240401"  # April 1, 2024 (YYYYMMDD format)
     end_date = "20250630"    # June 30, 2025 (YYYYMMDD format)
     print(f"Fetching all vouchers for company '{company_name}' from {start_date} to {end_date} at {TALLY_URL}")
-    fetch_all_vouchers(company_name, start_date, end_date)
+    count = 0
+    try:
+        for voucher in iter_vouchers(company_name, start_date, end_date):
+            count += 1
+            print(f"  {voucher['date']} {voucher['voucher_type']} {voucher['voucher_number']} "
+                  f"{voucher['party_ledger']} {voucher['amount']}")
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Failed to connect to Tally: {str(e)}")
+    print(f"\n📄 {count} vouchers fetched")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
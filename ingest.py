@@ -0,0 +1,257 @@
+import asyncio
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+from sqlalchemy import create_engine, text
+from starlette.responses import JSONResponse
+from sqlalchemy.orm import Session
+
+from statements import iter_statement_transactions
+
+# Statement parsing is CPU-bound pandas work; it runs in worker processes so
+# concurrent uploads use several cores and the event loop stays free.
+STATEMENT_WORKERS = int(os.getenv("STATEMENT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Uploads accepted at once (running + waiting for a worker) before answering "busy"
+STATEMENT_QUEUE_LIMIT = int(os.getenv("STATEMENT_QUEUE_LIMIT", str(STATEMENT_WORKERS * 2)))
+
+
+class StatementParseError(ValueError):
+    """The upload isn't a statement we can read (maps to a 400)."""
+
+
+class StatementPoolBusy(Exception):
+    """Every worker is busy and the queue is full (maps to a 503)."""
+
+
+STATEMENT_INSERT_CHUNK_SIZE = int(os.getenv("STATEMENT_INSERT_CHUNK_SIZE", "1000"))
+
+INSERT_TRANSACTION_SQL = text("""
+    INSERT INTO transactions (
+        id, statement_id, company_id, date, narration, ref_no, value_date, withdrawal_amount, deposit_amount,
+        closing_balance, transaction_type, category, from_ledger, to_ledger, voucher, status, created_at
+    ) VALUES (
+        :id, :statement_id, :company_id, :date, :narration, :ref_no, :value_date, :withdrawal_amount, :deposit_amount,
+        :closing_balance, :transaction_type, :category, :from_ledger, :to_ledger, :voucher, :status, :created_at
+    )
+""")
+
+def store_statement(db: Session, company_id: str, company_name: str, bank: str, transactions):
+    """
+    Insert a bank statement and its transactions in one transaction.
+    `transactions` may be any iterable (or generator) of parsed rows; they are
+    written STATEMENT_INSERT_CHUNK_SIZE at a time with executemany.
+    """
+    started = time.perf_counter()
+    statement_id = str(uuid.uuid4())
+    created_at = datetime.utcnow()
+
+    # Insert statement metadata
+    db.execute(
+        text("""
+        INSERT INTO bank_statements (id, company_id, company_name, bank_name, created_at)
+        VALUES (:id, :company_id, :company_name, :bank_name, :created_at)
+        """),
+        {
+            "id": statement_id,
+            "company_id": company_id,
+            "company_name": company_name,
+            "bank_name": bank,
+            "created_at": created_at,
+        }
+    )
+
+    # Insert transactions chunk by chunk; SQLAlchemy batches each executemany
+    # into multi-row INSERTs
+    insert_count = 0
+    rows = iter(transactions)
+    while True:
+        chunk = [
+            {
+                "id": str(uuid.uuid4()),
+                "statement_id": statement_id,
+                "company_id": company_id,
+                "date": txn["date"],
+                "narration": txn["narration"],
+                "ref_no": txn["ref_no"],
+                "value_date": txn["value_date"],
+                "withdrawal_amount": txn["withdrawal_amount"],
+                "deposit_amount": txn["deposit_amount"],
+                "closing_balance": txn["closing_balance"],
+                "transaction_type": txn["transaction_type"],
+                "category": txn["category"],
+                "from_ledger": txn.get("from_ledger"),
+                "to_ledger": txn.get("to_ledger"),
+                "voucher": txn.get("voucher"),
+                "status": txn.get("status"),
+                "created_at": created_at,
+            }
+            for txn in itertools.islice(rows, STATEMENT_INSERT_CHUNK_SIZE)
+        ]
+        if not chunk:
+            break
+        db.execute(INSERT_TRANSACTION_SQL, chunk)
+        insert_count += len(chunk)
+
+    db.commit()
+    elapsed = time.perf_counter() - started
+    print(f"✅ Stored statement {statement_id} ({company_name}, {bank}): {insert_count} transactions "
+          f"in {elapsed:.2f}s ({insert_count / elapsed if elapsed else 0:.0f} rows/s)")
+    return statement_id, insert_count
+
+
+def open_statement_stream(source, filename: str, bank: str = None):
+    """
+    Start streaming transactions out of a statement, using the parser for
+    `bank` or whichever bank the header matches. Header problems raise here,
+    before anything is written; returns None if there are no transactions.
+    """
+    parser, transactions = iter_statement_transactions(source, filename, bank)
+    print(f"ℹ️ Parsing {filename} as a {parser.bank} statement")
+    first = next(transactions, None)
+    if first is None:
+        return None
+    return itertools.chain([first], transactions)
+
+
+# ---------- WORKER PROCESS ----------
+
+_worker_engine = None
+
+
+def _init_worker(database_url: str):
+    # Each worker process gets its own small engine; connections never cross processes
+    global _worker_engine
+    _worker_engine = create_engine(database_url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+
+
+def ingest_statement_file(path: str, filename: str, bank: str, company_id: str, company_name: str) -> dict:
+    """Worker entry point: parse the spooled upload at `path` and insert it."""
+    with open(path, "rb") as source:
+        try:
+            transactions = open_statement_stream(source, filename, bank)
+        except Exception as e:
+            raise StatementParseError(str(e))
+        if transactions is None:
+            raise StatementParseError("No transactions found in statement.")
+        with Session(_worker_engine) as db:
+            statement_id, insert_count = store_statement(db, company_id, company_name, bank, transactions)
+    return {"statement_id": statement_id, "inserted_transactions": insert_count}
+
+
+# ---------- POOL ----------
+
+class StatementPool:
+    """A ProcessPoolExecutor with a cap on how many uploads may be queued."""
+
+    def __init__(self, database_url: str, workers: int = STATEMENT_WORKERS, queue_limit: int = STATEMENT_QUEUE_LIMIT):
+        self.database_url = database_url
+        self.workers = max(1, workers)
+        self.queue_limit = max(self.workers, queue_limit)
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that already runs threads and DB pools isn't safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.database_url,),
+                )
+            return self._executor
+
+    def full(self) -> bool:
+        return self.pending >= self.queue_limit
+
+    def reserve(self):
+        """Claim a queue slot up front, before the upload is copied anywhere."""
+        with self._lock:
+            if self.pending >= self.queue_limit:
+                raise StatementPoolBusy(f"{self.pending} statements are already being processed")
+            self.pending += 1
+
+    def release(self):
+        with self._lock:
+            self.pending -= 1
+
+    async def ingest(self, upload, filename: str, bank: str, company_id: str, company_name: str) -> dict:
+        """
+        Ingest an uploaded file object in a worker process. The caller must
+        have called reserve(); the slot is released once the worker is done
+        with the file, even if the request is cancelled before that.
+        """
+        future = await asyncio.to_thread(self._submit, upload, filename, bank, company_id, company_name)
+        return await asyncio.wrap_future(future)
+
+    def _submit(self, upload, filename: str, bank: str, company_id: str, company_name: str) -> Future:
+        # Hand the worker a path: spool the upload to disk without loading it
+        path = None
+        try:
+            path = _spool_to_disk(upload, filename)
+            future = self._get_executor().submit(
+                ingest_statement_file, path, filename, bank, company_id, company_name
+            )
+        except BaseException:
+            self._finish(path)
+            raise
+        # Runs when the worker finishes or the queued call is cancelled, never
+        # while the worker may still be reading the file
+        future.add_done_callback(lambda _: self._finish(path))
+        return future
+
+    def _finish(self, path: str = None):
+        self.release()
+        if path:
+            os.unlink(path)
+
+    def snapshot(self) -> dict:
+        return {"workers": self.workers, "queue_limit": self.queue_limit, "pending": self.pending}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class StatementUploadGate:
+    """
+    ASGI middleware that answers 503 to uploads on `path` while the pool is
+    full, before the multipart body is received. The endpoint's reserve()
+    is still the real claim; this only avoids reading files that would be
+    refused anyway.
+    """
+
+    def __init__(self, app, pool: StatementPool, path: str):
+        self.app = app
+        self.pool = pool
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == self.path and self.pool.full():
+            print(f"⏳ Rejecting statement upload before reading it: {self.pool.pending} already being processed")
+            response = JSONResponse(
+                {"detail": "Statement processing is busy, please retry shortly"},
+                status_code=503,
+                headers={"Retry-After": "5"},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+def _spool_to_disk(upload, filename: str) -> str:
+    upload.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as out:
+        shutil.copyfileobj(upload, out, 1024 * 1024)
+        return out.name
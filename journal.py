@@ -3,14 +3,12 @@ import xml.etree.ElementTree as ET
 import argparse
 from datetime import datetime
 
-# Tally server URL (adjust if your Tally server runs on a different port or host)
-TALLY_URL = "http://localhost:9000"
+from tallyclient import post_xml
 
 # Function to send XML request to Tally and get response
 def send_tally_request(xml_data):
-    headers = {'Content-Type': 'application/xml'}
     try:
-        response = requests.post(TALLY_URL, data=xml_data, headers=headers)
+        response = post_xml(xml_data)
         response.raise_for_status()
         return response.text
     except requests.exceptions.RequestException as e:
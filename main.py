@@ -7,9 +7,12 @@ import requests
 import xml.etree.ElementTree as ET
 from datetime import datetime  # Add this import
 
-app = FastAPI()
+from tallyclient import post_xml
+from tallyxml import iter_tally_records
+from tallycache import MasterDataCache
+from voucherxml import import_envelope, voucher_message
 
-TALLY_URL = "http://localhost:9000"  # Update if different
+app = FastAPI()
 
 
 # ---------- MODELS ----------
@@ -30,7 +33,12 @@ class VoucherCreate(BaseModel):
 
 
 # ---------- XML HELPERS ----------
-def generate_ledger_xml(ledger: LedgerCreate) -> str:
+def generate_ledger_xml(ledger: LedgerCreate, selected_company: Optional[str] = None) -> str:
+    # Without a company Tally imports into whichever company is active
+    static_vars = (
+        f"<STATICVARIABLES><SVCURRENTCOMPANY>{selected_company}</SVCURRENTCOMPANY></STATICVARIABLES>"
+        if selected_company else ""
+    )
     return f"""
     <ENVELOPE>
       <HEADER>
@@ -40,6 +48,7 @@ def generate_ledger_xml(ledger: LedgerCreate) -> str:
         <IMPORTDATA>
           <REQUESTDESC>
             <REPORTNAME>All Masters</REPORTNAME>
+            {static_vars}
           </REQUESTDESC>
           <REQUESTDATA>
             <TALLYMESSAGE>
@@ -61,44 +70,15 @@ def generate_voucher_xml(voucher: VoucherCreate, selected_company: str) -> str:
     """Generate XML for voucher creation with company context and unique identifiers."""
     voucher_number = f"VCH-{datetime.now().strftime('%Y%m%d%H%M%S')}"  # Unique voucher number
     guid = str(uuid.uuid4())  # Unique GUID for the voucher
-    return f"""
-    <ENVELOPE>
-      <HEADER>
-        <TALLYREQUEST>Import Data</TALLYREQUEST>
-      </HEADER>
-      <BODY>
-        <IMPORTDATA>
-          <REQUESTDESC>
-            <REPORTNAME>Vouchers</REPORTNAME>
-            <STATICVARIABLES>
-              <SVCURRENTCOMPANY>{selected_company}</SVCURRENTCOMPANY>
-            </STATICVARIABLES>
-          </REQUESTDESC>
-          <REQUESTDATA>
-            <TALLYMESSAGE>
-              <VOUCHER VCHTYPE="{voucher.voucher_type.capitalize()}" ACTION="Create" OBJVIEW="Accounting Voucher View">
-                <GUID>{guid}</GUID>
-                <VOUCHERNUMBER>{voucher_number}</VOUCHERNUMBER>
-                <DATE>{voucher.date.strftime('%Y%m%d')}</DATE>
-                <NARRATION>{voucher.narration or ""}</NARRATION>
-                <VOUCHERTYPENAME>{voucher.voucher_type.capitalize()}</VOUCHERTYPENAME>
-                <ALLLEDGERENTRIES.LIST>
-                  <LEDGERNAME>{voucher.from_ledger}</LEDGERNAME>
-                  <ISDEEMEDPOSITIVE>Yes</ISDEEMEDPOSITIVE>
-                  <AMOUNT>-{voucher.amount}</AMOUNT>
-                </ALLLEDGERENTRIES.LIST>
-                <ALLLEDGERENTRIES.LIST>
-                  <LEDGERNAME>{voucher.to_ledger}</LEDGERNAME>
-                  <ISDEEMEDPOSITIVE>No</ISDEEMEDPOSITIVE>
-                  <AMOUNT>{voucher.amount}</AMOUNT>
-                </ALLLEDGERENTRIES.LIST>
-              </VOUCHER>
-            </TALLYMESSAGE>
-          </REQUESTDATA>
-        </IMPORTDATA>
-      </BODY>
-    </ENVELOPE>
-    """
+    message = voucher_message(
+        voucher.voucher_type.capitalize(),
+        voucher.date.strftime('%Y%m%d'),
+        voucher.narration,
+        [(voucher.from_ledger, True, f"-{voucher.amount}"), (voucher.to_ledger, False, voucher.amount)],
+        voucher_number=voucher_number,
+        guid=guid,
+    )
+    return import_envelope([message], selected_company).decode("utf-8")
 
 def fetch_voucher_types(selected_company: str) -> list:
     """Fetch available voucher types from Tally."""
@@ -128,17 +108,16 @@ def fetch_voucher_types(selected_company: str) -> list:
       </BODY>
     </ENVELOPE>
     """
-    result = send_to_tally(xml)
-    print("\n[DEBUG] Voucher Types Response:\n", result)
     voucher_types = []
     try:
-        root = ET.fromstring(result)
-        for vtype in root.findall(".//VOUCHERTYPE"):
+        for vtype in stream_from_tally(xml, "VOUCHERTYPE", clean=True):
             name = vtype.find(".//NAME")
             if name is not None and name.text:
                 voucher_types.append(name.text)
-    except Exception as e:
+    except ET.ParseError as e:
+        # Raise rather than return a partial list, so it never gets cached
         print("❌ Could not parse voucher types:", str(e))
+        raise HTTPException(status_code=502, detail=f"Could not parse voucher types from Tally: {e}")
     return voucher_types
 
 def generate_fetch_ledger_xml(name: str) -> str:
@@ -196,18 +175,17 @@ def get_all_ledgers(selected_company: str):
       </BODY>
     </ENVELOPE>
     """
-    result = send_to_tally(xml)
-    print("\n[DEBUG] Tally Response:\n", result)
     ledgers = []
     try:
-        root = ET.fromstring(result)
-        # Find all LEDGER elements and extract NAME from LANGUAGENAME.LIST/NAME.LIST
-        for ledger in root.findall(".//LEDGER"):
+        # Stream LEDGER elements and extract NAME from LANGUAGENAME.LIST/NAME.LIST
+        for ledger in stream_from_tally(xml, "LEDGER", clean=True):
             name = ledger.find(".//LANGUAGENAME.LIST/NAME.LIST/NAME")
             if name is not None and name.text:
                 ledgers.append(name.text)
-    except Exception as e:
+    except ET.ParseError as e:
+        # Raise rather than return a partial list, so it never gets cached
         print("❌ Could not parse ledgers:", str(e))
+        raise HTTPException(status_code=502, detail=f"Could not parse ledgers from Tally: {e}")
     return ledgers
 
 def generate_fetch_vouchers_xml(voucher_type: str, from_date: str, to_date: str) -> str:
@@ -240,7 +218,7 @@ def generate_fetch_vouchers_xml(voucher_type: str, from_date: str, to_date: str)
 def send_to_tally(xml: str) -> str:
     print("\n[DEBUG] XML Sent to Tally:\n", xml)  # Log XML sent
     try:
-        response = requests.post(TALLY_URL, data=xml.encode("utf-8"))
+        response = post_xml(xml)
         response.raise_for_status()
         print("\n[DEBUG] Tally Raw Response:\n", response.text)  # Log raw response
         return response.text
@@ -249,14 +227,38 @@ def send_to_tally(xml: str) -> str:
         raise HTTPException(status_code=500, detail=f"Tally Error: {str(e)}")
 
 
+def stream_from_tally(xml: str, tag: str, clean: bool = False):
+    """Yield `tag` records from a Tally export while the response is still streaming in."""
+    print("\n[DEBUG] XML Sent to Tally:\n", xml)
+    try:
+        yield from iter_tally_records(xml, tag, clean=clean)
+    except requests.RequestException as e:
+        print("\n[DEBUG] Tally Request Failed:", str(e))
+        raise HTTPException(status_code=500, detail=f"Tally Error: {str(e)}")
+
+
 # ---------- ROUTES ----------
 
+# ---------- MASTER DATA CACHE ----------
+# Ledger names and voucher types per company, so validating a voucher is a
+# set lookup instead of full master exports on every request.
+master_cache = MasterDataCache(
+    load_ledgers=get_all_ledgers,
+    load_voucher_types=fetch_voucher_types,
+)
+
+
 @app.post("/bank/ledger")
-def create_ledger(ledger: LedgerCreate):
-    xml = generate_ledger_xml(ledger)
+def create_ledger(ledger: LedgerCreate, selected_company: Optional[str] = None):
+    xml = generate_ledger_xml(ledger, selected_company)
     result = send_to_tally(xml)
     if "<LINEERROR>" in result:
         raise HTTPException(status_code=400, detail="Tally Error while creating ledger")
+    if selected_company:
+        master_cache.add_ledger(selected_company, ledger.name)
+    else:
+        # Went to whichever company is active in Tally; we can't tell which
+        master_cache.invalidate()
     return {"message": "Ledger created successfully"}
 
 
@@ -268,17 +270,13 @@ def get_ledger(name: str):
 
 def check_ledger_exists(ledger_name: str, selected_company: str) -> bool:
     """Check if a ledger exists in Tally for the given company."""
-    ledgers = get_all_ledgers(selected_company)
-    print(f"\n[DEBUG] Ledgers found for company '{selected_company}': {ledgers}")
-    return ledger_name in ledgers
+    return master_cache.has_ledger(selected_company, ledger_name)
 
 @app.post("/bank/voucher")
 def create_voucher(voucher: VoucherCreate, selected_company: str = "Test"):
     """Create a voucher in Tally with enhanced validation."""
     # Validate voucher type
-    voucher_types = fetch_voucher_types(selected_company)
-    print(f"\n[DEBUG] Available Voucher Types: {voucher_types}")
-    if voucher.voucher_type.capitalize() not in voucher_types:
+    if not master_cache.has_voucher_type(selected_company, voucher.voucher_type.capitalize()):
         raise HTTPException(status_code=400, detail=f"Voucher type '{voucher.voucher_type}' does not exist in Tally")
 
     # Validate ledger existence
@@ -367,17 +365,14 @@ def fetch_companies():
 </ENVELOPE>
     """
     print("\n🔍 Connecting to Tally...")
-    response = send_to_tally(xml)
-    print("\n[DEBUG] Tally XML Response:\n", response)   # <--- ADD THIS LINE
     companies = []
     try:
-        root = ET.fromstring(response)
-        for company in root.findall(".//COMPANY"):
+        for company in stream_from_tally(xml, "COMPANY"):
             for child in company:
                 if child.tag == "NAME":
                     if child.text:
                         companies.append(child.text)
-    except Exception as e:
+    except ET.ParseError as e:
         print("❌ Could not parse company list:", str(e))
     return companies
 
@@ -419,7 +414,7 @@ def cli_mode():
             opening = float(input("Opening balance (default 0): ") or 0)
             is_debit = input("Is Debit? (yes/no): ").strip().lower() == "yes"
             ledger = LedgerCreate(name=name, group=group, opening_balance=opening, is_debit=is_debit)
-            print(create_ledger(ledger))
+            print(create_ledger(ledger, selected_company))
 
         elif choice == "2":
             name = input("Ledger name to fetch: ")
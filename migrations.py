@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import uuid
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+# Any constant works; it just has to be the same for every process running migrations
+MIGRATION_LOCK_KEY = 72519001
+
+# (version, name, statements). Applied in order, each version in one transaction.
+# Tables are created IF NOT EXISTS so databases that were set up by hand are adopted as they are.
+MIGRATIONS = [
+    (1, "base schema", [
+        """
+        CREATE TABLE IF NOT EXISTS tenants (
+            id UUID PRIMARY KEY,
+            name TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS companies (
+            id UUID PRIMARY KEY,
+            tenant_id UUID NOT NULL REFERENCES tenants(id),
+            name TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bank_statements (
+            id UUID PRIMARY KEY,
+            company_id UUID NOT NULL,
+            company_name TEXT,
+            bank_name TEXT,
+            parsed_json JSONB,
+            created_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id UUID PRIMARY KEY,
+            statement_id UUID NOT NULL REFERENCES bank_statements(id) ON DELETE CASCADE,
+            company_id UUID,
+            date DATE,
+            narration TEXT,
+            ref_no TEXT,
+            value_date DATE,
+            withdrawal_amount NUMERIC(18, 2) DEFAULT 0,
+            deposit_amount NUMERIC(18, 2) DEFAULT 0,
+            closing_balance NUMERIC(18, 2),
+            transaction_type TEXT,
+            category TEXT,
+            from_ledger TEXT,
+            to_ledger TEXT,
+            voucher TEXT,
+            status TEXT,
+            remark TEXT,
+            created_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ledger_groups (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            tenant_id UUID NOT NULL,
+            name TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ledgers (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            tenant_id UUID NOT NULL,
+            company_id UUID NOT NULL,
+            name TEXT NOT NULL,
+            group_id UUID REFERENCES ledger_groups(id) ON DELETE SET NULL
+        )
+        """,
+        # The ON CONFLICT targets of upsert_ledgers
+        "CREATE UNIQUE INDEX IF NOT EXISTS ledger_groups_tenant_name_key ON ledger_groups (tenant_id, name)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ledgers_tenant_company_name_key ON ledgers (tenant_id, company_id, name)",
+    ]),
+    (2, "ledger sync state and push jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS company_sync_state (
+            tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+            company_id UUID NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+            ledger_alter_id BIGINT NOT NULL DEFAULT 0,
+            master_alter_id BIGINT,
+            last_full_sync TIMESTAMPTZ,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (tenant_id, company_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS push_jobs (
+            id UUID PRIMARY KEY,
+            statement_id UUID NOT NULL REFERENCES bank_statements(id) ON DELETE CASCADE,
+            selected_company TEXT NOT NULL,
+            batch_size INT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INT NOT NULL DEFAULT 0,
+            succeeded INT NOT NULL DEFAULT 0,
+            failed INT NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ,
+            heartbeat_at TIMESTAMPTZ
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS push_job_items (
+            job_id UUID NOT NULL REFERENCES push_jobs(id) ON DELETE CASCADE,
+            seq INT NOT NULL,
+            transaction_id UUID NOT NULL REFERENCES transactions(id) ON DELETE CASCADE,
+            batch INT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            updated_at TIMESTAMPTZ,
+            PRIMARY KEY (job_id, seq)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS push_jobs_status_idx ON push_jobs (status, created_at)",
+        # Deleting a statement cascades through these foreign keys
+        "CREATE INDEX IF NOT EXISTS push_jobs_statement_idx ON push_jobs (statement_id)",
+        "CREATE INDEX IF NOT EXISTS push_job_items_transaction_idx ON push_job_items (transaction_id)",
+    ]),
+    (3, "hot path indexes", [
+        # Statement listing, keyset pages on (date, id), count(*) and push job creation
+        # (which only needs id and status) are all served by one index. NULL dates
+        # are keyed as 'infinity' so the keyset comparison covers them too; date is
+        # included so the expression doesn't rule out index-only scans.
+        "CREATE INDEX IF NOT EXISTS transactions_statement_date_id_idx "
+        "ON transactions (statement_id, COALESCE(date, CAST('infinity' AS date)), id) INCLUDE (date, status)",
+        # /ledgers/by-company reads only these columns: index-only scan
+        "CREATE INDEX IF NOT EXISTS ledgers_company_idx ON ledgers (company_id) INCLUDE (id, name, group_id)",
+        "CREATE INDEX IF NOT EXISTS companies_tenant_idx ON companies (tenant_id)",
+        "CREATE INDEX IF NOT EXISTS bank_statements_company_idx ON bank_statements (company_id, created_at)",
+        # The push worker's next-batch lookup skips finished items
+        "CREATE INDEX IF NOT EXISTS push_job_items_pending_idx ON push_job_items (job_id, seq) WHERE status = 'pending'",
+    ]),
+    (4, "push job unknown count", [
+        # Items Tally may or may not have created, kept apart from failed
+        "ALTER TABLE push_jobs ADD COLUMN IF NOT EXISTS unknown INT NOT NULL DEFAULT 0",
+    ]),
+]
+
+
+def applied_versions(conn) -> List[int]:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """))
+    return [row[0] for row in conn.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+
+
+def upgrade(engine, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to `target` (default: all); returns the versions applied."""
+    applied_now = []
+    with engine.connect() as conn:
+        # Several app processes start at once; only one migrates, the rest wait and find nothing to do
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        conn.commit()
+        try:
+            with conn.begin():
+                applied = set(applied_versions(conn))
+            for version, name, statements in MIGRATIONS:
+                if version in applied or (target is not None and version > target):
+                    continue
+                with conn.begin():
+                    for statement in statements:
+                        conn.execute(text(statement))
+                    conn.execute(
+                        text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                        {"version": version, "name": name}
+                    )
+                applied_now.append(version)
+                print(f"🗄️ Applied migration {version}: {name}")
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            conn.commit()
+    return applied_now
+
+
+def status(engine) -> list:
+    with engine.begin() as conn:
+        applied = set(applied_versions(conn))
+    return [{"version": v, "name": name, "applied": v in applied} for v, name, _ in MIGRATIONS]
+
+
+# ---------- EXPLAIN CHECK ----------
+
+# (name, query, params, index the plan should use)
+HOT_QUERIES = [
+    ("transactions by statement",
+     "SELECT * FROM transactions WHERE statement_id = :sid",
+     {"sid": uuid.uuid4()}, "transactions_statement_date_id_idx"),
+    ("transactions keyset page",
+     "SELECT * FROM transactions WHERE statement_id = :sid "
+     "AND (COALESCE(date, CAST('infinity' AS date)), id) > (CAST(:after_date AS date), CAST(:after_id AS uuid)) "
+     "ORDER BY COALESCE(date, CAST('infinity' AS date)), id LIMIT 201",
+     {"sid": uuid.uuid4(), "after_date": "2024-04-01", "after_id": uuid.uuid4()},
+     "transactions_statement_date_id_idx"),
+    ("push job items to create",
+     "SELECT id FROM transactions WHERE statement_id = :sid AND status IS DISTINCT FROM 'Pushed' "
+     "ORDER BY COALESCE(date, CAST('infinity' AS date)), id",
+     {"sid": uuid.uuid4()}, "transactions_statement_date_id_idx"),
+    ("push job batch transactions",
+     "SELECT * FROM transactions WHERE id = ANY(CAST(:ids AS uuid[]))",
+     {"ids": [uuid.uuid4(), uuid.uuid4()]}, "transactions_pkey"),
+    ("ledgers by company",
+     "SELECT id, name, group_id FROM ledgers WHERE company_id = :cid",
+     {"cid": uuid.uuid4()}, "ledgers_company_idx"),
+    ("ledger upsert conflict target",
+     "SELECT id FROM ledgers WHERE tenant_id = :tid AND company_id = :cid AND name = :name",
+     {"tid": uuid.uuid4(), "cid": uuid.uuid4(), "name": "HDFC Bank"}, "ledgers_tenant_company_name_key"),
+    ("ledger group upsert conflict target",
+     "SELECT id FROM ledger_groups WHERE tenant_id = :tid AND name = :name",
+     {"tid": uuid.uuid4(), "name": "Bank Accounts"}, "ledger_groups_tenant_name_key"),
+]
+
+
+def _plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def check(engine) -> bool:
+    """
+    EXPLAIN every hot query and report whether it uses its index. Sequential
+    scans are disabled for the check, so a small table still shows which
+    index would be picked; a Seq Scan that remains means the index is missing.
+    """
+    ok = True
+    with engine.connect() as conn:
+        for name, query, params, index in HOT_QUERIES:
+            with conn.begin():
+                conn.execute(text("SET LOCAL enable_seqscan = off"))
+                raw = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params).scalar()
+            plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+            nodes = list(_plan_nodes(plan))
+            used = {n["Index Name"] for n in nodes if "Index Name" in n}
+            seq_scans = [n["Relation Name"] for n in nodes if n["Node Type"] == "Seq Scan"]
+            passed = index in used and not seq_scans
+            ok &= passed
+            detail = ", ".join(f"{n['Node Type']}" + (f" using {n['Index Name']}" if "Index Name" in n else "")
+                               for n in nodes)
+            print(f"{'✅' if passed else '❌'} {name}: {detail}")
+    return ok
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("upgrade", help="Apply pending migrations")
+    p.add_argument("--target", type=int, help="Stop after this version")
+    sub.add_parser("status", help="List migrations and whether they are applied")
+    sub.add_parser("check", help="EXPLAIN the hot queries and verify they use their indexes")
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise Exception("DATABASE_URL not found! Is your .env loaded?")
+    engine = create_engine(database_url)
+
+    if args.command == "upgrade":
+        applied = upgrade(engine, args.target)
+        print(f"Applied {len(applied)} migration(s)" if applied else "Schema is up to date")
+    elif args.command == "status":
+        for m in status(engine):
+            print(f"{m['version']:>4}  {'applied' if m['applied'] else 'pending':<8} {m['name']}")
+    elif args.command == "check":
+        raise SystemExit(0 if check(engine) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import os
+import threading
+import traceback
+import uuid
+from typing import Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# A running job whose worker hasn't checked in for this long is taken over
+PUSH_JOB_STALE_SECONDS = int(os.getenv("PUSH_JOB_STALE_SECONDS", "120"))
+# How often an idle worker looks for new or abandoned jobs
+PUSH_JOB_POLL_SECONDS = float(os.getenv("PUSH_JOB_POLL_SECONDS", "2"))
+
+# Job status: queued -> running -> done | failed
+# Item status: pending -> Success | Failed | Unknown (as reported by map_import_results)
+# Tables: push_jobs and push_job_items, created by migrations.py
+
+# Push state kept on the transaction itself, in transactions.status. Pushed rows
+# are skipped by later pushes; failed and unknown ones are sent again, which is
+# safe because a transaction always maps to the same voucher GUID.
+PUSHED_STATUS = "Pushed"
+PUSH_FAILED_STATUS = "Push Failed"
+
+
+class TallyUnavailable(Exception):
+    """Raised by push_batch when the batch never reached Tally; its items stay pending."""
+
+
+def record_push_state(db: Session, outcomes: list):
+    """Persist push results on transactions; `outcomes` is [(transaction_id, status), ...]."""
+    params = [
+        {"id": str(tx_id), "status": PUSHED_STATUS if status == "Success" else PUSH_FAILED_STATUS}
+        for tx_id, status in outcomes
+        # Unknown: Tally may or may not have created it; leave the row for the next push to settle
+        if status in ("Success", "Failed")
+    ]
+    if params:
+        db.execute(text("UPDATE transactions SET status = :status WHERE id = :id"), params)
+
+
+def create_push_job(db: Session, statement_id: str, selected_company: str, batch_size: int) -> Optional[dict]:
+    """
+    Persist a job with one pending item per not-yet-pushed transaction of the
+    statement; None if there is nothing left to push.
+    """
+    job_id = str(uuid.uuid4())
+    db.execute(
+        text("""
+            INSERT INTO push_jobs (id, statement_id, selected_company, batch_size)
+            VALUES (:id, :statement_id, :selected_company, :batch_size)
+        """),
+        {"id": job_id, "statement_id": statement_id, "selected_company": selected_company,
+         "batch_size": max(1, batch_size)}
+    )
+    total = db.execute(
+        text("""
+            INSERT INTO push_job_items (job_id, seq, transaction_id)
+            SELECT :job_id, row_number() OVER (ORDER BY COALESCE(date, CAST('infinity' AS date)), id), id
+            FROM transactions
+            WHERE statement_id = :statement_id AND status IS DISTINCT FROM :pushed
+        """),
+        {"job_id": job_id, "statement_id": statement_id, "pushed": PUSHED_STATUS}
+    ).rowcount
+    if not total:
+        db.rollback()
+        return None
+    db.execute(text("UPDATE push_jobs SET total = :total WHERE id = :id"), {"total": total, "id": job_id})
+    db.commit()
+    return {"job_id": job_id, "status": "queued", "total": total}
+
+
+def get_push_job(db: Session, job_id: str) -> Optional[dict]:
+    row = db.execute(
+        text("""
+            SELECT id, statement_id, selected_company, status, total, succeeded, failed, unknown, error,
+                   created_at, started_at, finished_at
+            FROM push_jobs WHERE id = :id
+        """),
+        {"id": job_id}
+    ).mappings().first()
+    if row is None:
+        return None
+    job = dict(row)
+    job["pending"] = job["total"] - job["succeeded"] - job["failed"] - job["unknown"]
+    return job
+
+
+def get_push_job_items(db: Session, job_id: str, after_seq: int = 0, limit: int = 1000) -> list:
+    """Finished items of a job past `after_seq`, in order (items finish in seq order)."""
+    rows = db.execute(
+        text("""
+            SELECT seq, transaction_id, batch, status, error, updated_at
+            FROM push_job_items
+            WHERE job_id = :job_id AND seq > :after_seq AND status <> 'pending'
+            ORDER BY seq
+            LIMIT :limit
+        """),
+        {"job_id": job_id, "after_seq": after_seq, "limit": limit}
+    ).mappings().all()
+    return [dict(r) for r in rows]
+
+
+class PushJobWorker:
+    """
+    Background thread that claims queued push jobs and works through their
+    pending items batch by batch, recording each batch's results before the
+    next one is sent. The heartbeat is kept fresh while a batch is with
+    Tally; jobs left running by a dead worker are resumed once it goes
+    stale, so a restart picks up where it stopped.
+
+    The Tally side is passed in by the app:
+      fetch_transactions(db, statement_id, transaction_ids) -> {transaction_id: row}
+      push_batch(transactions, selected_company) -> [(status, error), ...]
+    push_batch raises TallyUnavailable when Tally can't be reached; the job
+    then keeps its pending items and retries with backoff until Tally is back.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        fetch_transactions: Callable,
+        push_batch: Callable,
+        poll_seconds: float = PUSH_JOB_POLL_SECONDS,
+        stale_seconds: int = PUSH_JOB_STALE_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.fetch_transactions = fetch_transactions
+        self.push_batch = push_batch
+        self.poll_seconds = poll_seconds
+        self.stale_seconds = stale_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="push-job-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self):
+        """A job was just queued; don't wait for the next poll."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"⚠️ Push job worker could not claim a job: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                continue
+            self._process(job)
+
+    def _claim(self) -> Optional[dict]:
+        # SKIP LOCKED lets several app processes run a worker without double-claiming
+        with self.session_factory() as db:
+            row = db.execute(
+                text("""
+                    UPDATE push_jobs
+                    SET status = 'running', started_at = COALESCE(started_at, now()), heartbeat_at = now()
+                    WHERE id = (
+                        SELECT id FROM push_jobs
+                        WHERE status = 'queued'
+                           OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => :stale))
+                        ORDER BY created_at
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, statement_id, selected_company, batch_size
+                """),
+                {"stale": self.stale_seconds}
+            ).mappings().first()
+            db.commit()
+            return dict(row) if row else None
+
+    def _process(self, job: dict):
+        job_id = job["id"]
+        print(f"🚚 Push job {job_id}: pushing statement {job['statement_id']} to {job['selected_company']}")
+        try:
+            backoff = self.poll_seconds
+            while not self._stop.is_set():
+                try:
+                    if not self._push_next_batch(job):
+                        break
+                    backoff = self.poll_seconds
+                except TallyUnavailable as e:
+                    # Keep the job claimed while waiting; the wait never outlasts the stale window
+                    print(f"⏳ Push job {job_id}: Tally unavailable ({e}), retrying in {backoff:.0f}s")
+                    self._touch_heartbeat(job_id)
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, max(1.0, self.stale_seconds / 3))
+            else:
+                return  # shutting down; the job stays running and is resumed later
+            with self.session_factory() as db:
+                db.execute(
+                    text("UPDATE push_jobs SET status = 'done', finished_at = now() WHERE id = :id"),
+                    {"id": job_id}
+                )
+                db.commit()
+            print(f"✅ Push job {job_id} finished")
+        except Exception as e:
+            traceback.print_exc()
+            with self.session_factory() as db:
+                db.execute(
+                    text("UPDATE push_jobs SET status = 'failed', error = :error, finished_at = now() WHERE id = :id"),
+                    {"id": job_id, "error": str(e)}
+                )
+                db.commit()
+
+    def _push_next_batch(self, job: dict) -> bool:
+        """Push the next batch of pending items; False once nothing is pending."""
+        # Read the batch and give the connection back before talking to Tally,
+        # so no pooled connection sits idle in a transaction while it imports
+        with self.session_factory() as db:
+            items = db.execute(
+                text("""
+                    SELECT seq, transaction_id FROM push_job_items
+                    WHERE job_id = :job_id AND status = 'pending'
+                    ORDER BY seq LIMIT :limit
+                """),
+                {"job_id": job["id"], "limit": job["batch_size"]}
+            ).fetchall()
+            if not items:
+                return False
+            rows = self.fetch_transactions(db, job["statement_id"], [tid for _, tid in items])
+            db.commit()
+
+        found = [(seq, rows[tid]) for seq, tid in items if tid in rows]
+        results = {seq: ("Failed", "Transaction no longer exists") for seq, tid in items if tid not in rows}
+        if found:
+            # A large batch can take Tally longer than stale_seconds, so keep
+            # the heartbeat fresh from another thread while it is in flight
+            in_flight = threading.Event()
+            beat = threading.Thread(
+                target=self._heartbeat, args=(job["id"], in_flight), name="push-job-heartbeat", daemon=True
+            )
+            beat.start()
+            try:
+                pushed = self.push_batch([tx for _, tx in found], job["selected_company"])
+            finally:
+                in_flight.set()
+                beat.join()
+            results.update({seq: result for (seq, _), result in zip(found, pushed)})
+
+        batch_no = (items[0][0] - 1) // job["batch_size"] + 1
+        tx_ids = dict(items)
+        counts = {"Success": 0, "Failed": 0, "Unknown": 0}
+        for status, _ in results.values():
+            counts[status] += 1
+        with self.session_factory() as db:
+            db.execute(
+                text("""
+                    UPDATE push_job_items SET status = :status, error = :error, batch = :batch, updated_at = now()
+                    WHERE job_id = :job_id AND seq = :seq
+                """),
+                [{"job_id": job["id"], "seq": seq, "status": status, "error": error, "batch": batch_no}
+                 for seq, (status, error) in results.items()]
+            )
+            record_push_state(db, [(tx_ids[seq], status) for seq, (status, _) in results.items()])
+            # Unknown is counted apart: Tally may well have created those vouchers
+            db.execute(
+                text("""
+                    UPDATE push_jobs
+                    SET succeeded = succeeded + :succeeded, failed = failed + :failed,
+                        unknown = unknown + :unknown, heartbeat_at = now()
+                    WHERE id = :id
+                """),
+                {"id": job["id"], "succeeded": counts["Success"], "failed": counts["Failed"],
+                 "unknown": counts["Unknown"]}
+            )
+            db.commit()
+        return True
+
+    def _heartbeat(self, job_id, done: threading.Event):
+        """Touch the job's heartbeat every third of stale_seconds until `done` is set."""
+        interval = max(1.0, self.stale_seconds / 3)
+        while not done.wait(interval):
+            self._touch_heartbeat(job_id)
+
+    def _touch_heartbeat(self, job_id):
+        try:
+            with self.session_factory() as db:
+                db.execute(text("UPDATE push_jobs SET heartbeat_at = now() WHERE id = :id"), {"id": job_id})
+                db.commit()
+        except Exception as e:
+            print(f"⚠️ Push job {job_id}: heartbeat update failed: {e}")
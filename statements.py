@@ -0,0 +1,325 @@
+import io
+import os
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# Rows transformed per vectorized step when streaming a statement
+STATEMENT_CHUNK_ROWS = int(os.getenv("STATEMENT_CHUNK_ROWS", "2000"))
+
+TRANSACTION_KEYS = [
+    "date", "narration", "ref_no", "value_date", "withdrawal_amount", "deposit_amount",
+    "closing_balance", "transaction_type", "category", "from_ledger", "to_ledger", "voucher", "status",
+]
+
+
+def excel_engine(filename: str) -> str:
+    # Always use engine="xlrd" for .xls and openpyxl for .xlsx
+    return "xlrd" if filename.endswith(".xls") else "openpyxl"
+
+
+def str_column(col: pd.Series) -> pd.Series:
+    """Vectorized safe_str: NaN/None -> "", everything else str() and stripped."""
+    return col.astype(object).where(col.notna(), "").astype(str).str.strip()
+
+
+def float_column(col: pd.Series) -> pd.Series:
+    """Vectorized safe_float: strip thousands separators, anything unparseable -> 0.0."""
+    if pd.api.types.is_numeric_dtype(col):
+        return col.astype(float).fillna(0.0)
+    text = col.astype(str).str.replace(",", "", regex=False).str.strip()
+    return pd.to_numeric(text, errors="coerce").fillna(0.0).astype(float)
+
+
+def to_records(columns: dict, length: int) -> list:
+    """Column arrays -> list of transaction dicts with plain Python values."""
+    values = [columns[key].tolist() if key in columns else [None] * length for key in TRANSACTION_KEYS]
+    return [dict(zip(TRANSACTION_KEYS, row)) for row in zip(*values)]
+
+
+# ---------- PARSER REGISTRY ----------
+
+class StatementParser:
+    """
+    One bank's statement layout: which header cells map to which transaction
+    fields, how dates are written and which row ends the transaction list.
+    The header cells double as the bank's signature for auto-detection.
+    `ledger` is the Tally bank ledger the statement's vouchers post against.
+    """
+
+    def __init__(
+        self,
+        bank: str,
+        columns: Dict[str, str],
+        date_format: str,
+        aliases: Tuple[str, ...] = (),
+        end_markers: Tuple[str, ...] = (),
+        ledger: Optional[str] = None,
+    ):
+        self.bank = bank
+        self.ledger = ledger or f"{bank} Bank"
+        self.columns = columns  # transaction field -> header cell
+        self.date_format = date_format
+        self.aliases = tuple(a.lower() for a in (bank,) + aliases)
+        self.end_markers = end_markers
+        self.signature = frozenset(columns.values())
+
+    def __repr__(self):
+        return f"StatementParser({self.bank!r})"
+
+    def transform(self, body: pd.DataFrame) -> tuple:
+        """
+        Transform rows below the header (columns already named) into transaction
+        dicts. Returns (transactions, ended); ended is True once the blank date or
+        end-marker row that closes the transaction list has been seen.
+        """
+        # Duplicate header names: the first one wins, as with pandas' own header parsing
+        body = body.loc[:, ~body.columns.duplicated()]
+        col = {field: body[header] for field, header in self.columns.items()}
+
+        # Transactions end at the first blank date or a summary/legend row
+        raw_date = col["date"]
+        stop = raw_date.isna()
+        for marker in self.end_markers:
+            stop |= raw_date.astype(str).str.contains(marker, regex=False)
+        ended = bool(stop.any())
+        if ended:
+            cut = int(stop.to_numpy().argmax())
+            col = {field: series.iloc[:cut] for field, series in col.items()}
+
+        # Rows whose dates don't parse (separators, sub-headers) are skipped
+        dates = pd.to_datetime(str_column(col["date"]), format=self.date_format, errors="coerce")
+        value_dates = pd.to_datetime(str_column(col["value_date"]), format=self.date_format, errors="coerce")
+        keep = (dates.notna() & value_dates.notna()).to_numpy()
+
+        narration = str_column(col["narration"])[keep]
+        withdrawal = float_column(col["withdrawal_amount"])[keep]
+        columns = {
+            "date": dates[keep].dt.strftime("%Y-%m-%d"),
+            "narration": narration,
+            "ref_no": str_column(col["ref_no"])[keep],
+            "value_date": value_dates[keep].dt.strftime("%Y-%m-%d"),
+            "withdrawal_amount": withdrawal,
+            "deposit_amount": float_column(col["deposit_amount"])[keep],
+            "closing_balance": float_column(col["closing_balance"])[keep],
+            "transaction_type": np.where(withdrawal > 0, "debit", "credit"),
+            "category": np.where(narration.str.contains("UPI", regex=False), "UPI Payment", "Other"),
+        }
+        return to_records(columns, int(keep.sum())), ended
+
+
+PARSERS: Dict[str, StatementParser] = {}
+
+
+def register_parser(parser: StatementParser) -> StatementParser:
+    PARSERS[parser.bank] = parser
+    detect_parser.cache_clear()
+    return parser
+
+
+@lru_cache(maxsize=256)
+def detect_parser(cells: Tuple[str, ...], preferred: Optional[str] = None) -> Optional[StatementParser]:
+    """Which registered parser's signature a row's cells carry (None if it isn't a header)."""
+    candidates = list(PARSERS.values())
+    if preferred in PARSERS:
+        candidates.insert(0, PARSERS[preferred])
+    present = set(cells)
+    for parser in candidates:
+        if parser.signature <= present:
+            return parser
+    return None
+
+
+HDFC = register_parser(StatementParser(
+    bank="HDFC",
+    columns={
+        "date": "Date",
+        "narration": "Narration",
+        "ref_no": "Chq./Ref.No.",
+        "value_date": "Value Dt",
+        "withdrawal_amount": "Withdrawal Amt.",
+        "deposit_amount": "Deposit Amt.",
+        "closing_balance": "Closing Balance",
+    },
+    date_format="%d/%m/%y",
+    aliases=("HDFC Bank",),
+    end_markers=("STATEMENT SUMMARY",),
+    ledger="HDFC Bank",
+))
+
+ICICI = register_parser(StatementParser(
+    bank="ICICI",
+    columns={
+        "date": "Transaction Date",
+        "narration": "Transaction Remarks",
+        "ref_no": "Cheque Number",
+        "value_date": "Value Date",
+        "withdrawal_amount": "Withdrawal Amount (INR )",
+        "deposit_amount": "Deposit Amount (INR )",
+        "closing_balance": "Balance (INR )",
+    },
+    date_format="%d/%m/%Y",
+    aliases=("ICICI Bank",),
+    end_markers=("Legends Used",),
+    ledger="ICICI Bank",
+))
+
+
+def get_parser(bank: Optional[str]) -> Optional[StatementParser]:
+    """Parser for a bank name as typed in the upload form ("HDFC", "hdfc bank", ...)."""
+    if not bank:
+        return None
+    name = bank.strip().lower()
+    for parser in PARSERS.values():
+        if name in parser.aliases:
+            return parser
+    return None
+
+
+def ledger_for_bank(bank: Optional[str]) -> str:
+    """Tally bank ledger for a parsed statement's bank; ValueError if the bank isn't registered."""
+    parser = get_parser(bank)
+    if parser is None:
+        raise ValueError(f"Unknown statement bank {bank!r}; can't tell which bank ledger to post against")
+    return parser.ledger
+
+
+def header_cells(row) -> Tuple[str, ...]:
+    return tuple("" if v is None or (isinstance(v, float) and np.isnan(v)) else str(v).strip() for v in row)
+
+
+def _resolve(cells: Tuple[str, ...], bank: Optional[str]) -> Optional[StatementParser]:
+    hinted = get_parser(bank)
+    parser = detect_parser(cells, hinted.bank if hinted else None)
+    if parser is not None and hinted is not None and parser is not hinted:
+        print(f"⚠️ Statement was uploaded as {bank!r} but its header matches {parser.bank}; using {parser.bank}")
+    return parser
+
+
+def frame_transactions(raw: pd.DataFrame, bank: Optional[str] = None) -> tuple:
+    """Headerless sheet DataFrame -> (parser, transaction dicts)."""
+    # Header detection walks only the rows above the header; the rest is per column
+    for position, row in enumerate(raw.itertuples(index=False, name=None)):
+        cells = header_cells(row)
+        parser = _resolve(cells, bank)
+        if parser is not None:
+            body = raw.iloc[position + 1:].copy()
+            body.columns = list(cells)
+            return parser, parser.transform(body)[0]
+    raise Exception("Could not find transaction header in Excel file.")
+
+
+def hdfc_transactions(raw: pd.DataFrame) -> list:
+    """Turn a headerless HDFC sheet into transaction dicts, one column at a time."""
+    return frame_transactions(raw, HDFC.bank)[1]
+
+
+def parse_hdfc_statement(contents: Union[bytes, io.IOBase], filename: str) -> dict:
+    """Parse an HDFC .xls/.xlsx statement; the workbook is read exactly once."""
+    source = io.BytesIO(contents) if isinstance(contents, (bytes, bytearray)) else contents
+    raw = pd.read_excel(source, sheet_name=0, engine=excel_engine(filename), header=None)
+    return {"transactions": hdfc_transactions(raw)}
+
+
+# ---------- STREAMING ----------
+
+def _cell(value):
+    # Match what pandas.read_excel hands the row loop: blanks are missing and
+    # whole-number floats come back as ints (so refs don't turn into "123.0")
+    if value is None or value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def iter_sheet_rows(source: Union[bytes, io.IOBase], filename: str) -> Iterator[list]:
+    """
+    Yield the first sheet's rows as lists of cell values without loading the
+    whole sheet: openpyxl in read-only mode for .xlsx, xlrd on-demand for .xls.
+    """
+    if excel_engine(filename) == "xlrd":
+        import xlrd
+        # .xls is a compound document; xlrd needs its bytes, but only loads the sheet we ask for
+        data = source if isinstance(source, (bytes, bytearray)) else source.read()
+        book = xlrd.open_workbook(file_contents=data, on_demand=True)
+        try:
+            sheet = book.sheet_by_index(0)
+            for i in range(sheet.nrows):
+                yield [_cell(v) for v in sheet.row_values(i)]
+        finally:
+            book.release_resources()
+        return
+
+    from openpyxl import load_workbook
+    source = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    book = load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = book.worksheets[0]
+        # Bank exports often carry a wrong <dimension>; read until the real end
+        sheet.reset_dimensions()
+        for row in sheet.iter_rows(values_only=True):
+            yield [_cell(v) for v in row]
+    finally:
+        book.close()
+
+
+def iter_statement_chunks(
+    source: Union[bytes, io.IOBase],
+    filename: str,
+    bank: Optional[str] = None,
+    chunk_rows: int = STATEMENT_CHUNK_ROWS,
+) -> Tuple[StatementParser, Iterator[list]]:
+    """
+    Find the header and the bank's parser, then stream the statement as lists
+    of at most `chunk_rows` transactions. The header scan happens here, so an
+    unrecognised file raises before any transaction is consumed.
+    """
+    rows = iter_sheet_rows(source, filename)
+    for row in rows:
+        cells = header_cells(row)
+        parser = _resolve(cells, bank)
+        if parser is not None:
+            return parser, _chunks(parser, list(cells), rows, chunk_rows)
+    raise Exception("Could not find transaction header in Excel file.")
+
+
+def _chunks(parser: StatementParser, header: list, rows: Iterator[list], chunk_rows: int) -> Iterator[list]:
+    width = len(header)
+    buffer = []
+
+    def transform():
+        body = pd.DataFrame(buffer, columns=header, dtype=object)
+        buffer.clear()
+        return parser.transform(body)
+
+    for row in rows:
+        buffer.append((row + [None] * width)[:width])
+        if len(buffer) >= chunk_rows:
+            transactions, ended = transform()
+            if transactions:
+                yield transactions
+            if ended:
+                return
+    if buffer:
+        transactions, _ = transform()
+        if transactions:
+            yield transactions
+
+
+def iter_statement_transactions(
+    source: Union[bytes, io.IOBase],
+    filename: str,
+    bank: Optional[str] = None,
+) -> Tuple[StatementParser, Iterator[dict]]:
+    """Like iter_statement_chunks, one transaction at a time; memory stays one chunk deep."""
+    parser, chunks = iter_statement_chunks(source, filename, bank)
+    return parser, (txn for chunk in chunks for txn in chunk)
+
+
+def parse_statement(source: Union[bytes, io.IOBase], filename: str, bank: Optional[str] = None) -> dict:
+    """Parse a whole statement of any registered bank into {"bank", "transactions"}."""
+    parser, transactions = iter_statement_transactions(source, filename, bank)
+    return {"bank": parser.bank, "transactions": list(transactions)}
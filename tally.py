@@ -1,17 +1,21 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form, Body
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form, Body, Query
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
-import pandas as pd
-from typing import List, Dict, Any
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from typing import List, Dict, Any, Optional
 import os
 import xml.etree.ElementTree as ET
+import asyncio
+import httpx
 import requests
 from dotenv import load_dotenv
 load_dotenv()
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 import json
-import html
+import base64
+import itertools
+import time
 
 from typing import List
 
@@ -21,13 +25,26 @@ import logging
 from sqlalchemy import text
 import xlrd
 import math
-import re
 
 
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from pydantic import BaseModel
 
+from tallyclient import XmlBody, aclose_clients, client_stats, post_xml, post_xml_async
+from tallyxml import iter_tally_records
+from tallycache import fetch_master_alter_id
+from voucherxml import fields_message, import_envelope, iter_import_envelope, transaction_voucher
+from fastresponse import CompressionMiddleware, FastJSONResponse, xml_download
+from database import PoolStats, async_engine_options, pool_options
+from migrations import upgrade as upgrade_schema
+from ingest import StatementParseError, StatementPool, StatementPoolBusy, StatementUploadGate
+from pushjobs import (
+    PUSHED_STATUS, PushJobWorker, TallyUnavailable, create_push_job, get_push_job, get_push_job_items,
+    record_push_state,
+)
+
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,12 +53,22 @@ logger = logging.getLogger(__name__)
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise Exception("DATABASE_URL not found! Is your .env loaded?")
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **pool_options())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# async def endpoints use this one so they don't tie up a threadpool worker per query
+_async_url, _async_connect_args = async_engine_options(DATABASE_URL)
+async_engine = create_async_engine(_async_url, connect_args=_async_connect_args, **pool_options())
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+pool_stats = PoolStats(engine.pool)
+async_pool_stats = PoolStats(async_engine.sync_engine.pool)
 Base = declarative_base()
 
+statement_pool = StatementPool(DATABASE_URL)
+
 app = FastAPI()
 
+# Innermost, so a busy answer still gets CORS headers
+app.add_middleware(StatementUploadGate, pool=statement_pool, path="/statements/upload")
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],  # or ["*"] for testing
@@ -49,21 +76,54 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+@app.on_event("shutdown")
+async def close_tally_clients():
+    await aclose_clients()
+
+@app.on_event("shutdown")
+def shutdown_statement_pool():
+    statement_pool.shutdown()
+
+# Set to false where migrations are run separately (python migrations.py upgrade)
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+@app.on_event("startup")
+def migrate_schema():
+    if DB_MIGRATE_ON_STARTUP:
+        upgrade_schema(engine)
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    await async_engine.dispose()
 
-TALLY_URL = "http://localhost:9000"
 def get_db():
     db = SessionLocal()
     try:
+        started = time.perf_counter()
+        db.connection()
+        pool_stats.record_wait(started)
         yield db
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        await db.connection()
+        async_pool_stats.record_wait(started)
+        yield db
+
 
 
 
+TALLY_PUSH_BATCH_SIZE = int(os.getenv("TALLY_PUSH_BATCH_SIZE", "50"))
+
 class PushToTallyRequest(BaseModel):
     statement_id: str           # Unique key to fetch transactions from your DB
     selected_company: str = "Test"   # Optionally allow frontend to select Tally company
+    batch_size: int = TALLY_PUSH_BATCH_SIZE   # Vouchers packed into one Import Data envelope
 
 class CompanyCreate(BaseModel):
     tenant_id: str
@@ -71,15 +131,6 @@ class CompanyCreate(BaseModel):
     description: str = None  # Optional
 
 
-def clean_xml(xml: str) -> str:
-    # Remove numeric character refs for control characters (decimal 0–31 except TAB/CR/LF)
-    # e.g. &#4;, &#0;, etc
-    xml = re.sub(r'&#([0-8]|1[0-9]|2[0-9]|3[01]);', '', xml)
-    # Remove invalid literal unicode chars as before
-    xml = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F\uFFFE\uFFFF]', '', xml)
-    return xml
-
-
 
 GET_COMPANY_XML = """<ENVELOPE>
   <HEADER>
@@ -145,13 +196,9 @@ def create_tenant(name: str, db: Session = Depends(get_db)):
 
 @app.get("/companies")
 def get_companies():
-    headers = {"Content-Type": "application/xml"}
     try:
-        resp = requests.post(TALLY_URL, data=GET_COMPANY_XML, headers=headers, timeout=10)
-        resp.raise_for_status()
         company_names = []
-        tree = ET.fromstring(resp.text)
-        for comp in tree.findall(".//COMPANY"):
+        for comp in iter_tally_records(GET_COMPANY_XML, "COMPANY", timeout=10):
             name = comp.find("NAME")
             if name is not None:
                 company_names.append(name.text)
@@ -161,29 +208,68 @@ def get_companies():
 
 
 
+BULK_UPDATE_FIELDS = ["from_ledger", "to_ledger", "voucher", "status", "narration", "remark", "withdrawal_amount", "deposit_amount"]
+
+def apply_bulk_update_group(db: Session, fields: tuple, rows: list) -> set:
+    """
+    Apply every update that sets exactly `fields` with one UPDATE ... FROM a
+    temp table of new values. Returns the ids that matched a transaction.
+    """
+    columns = ", ".join(fields)
+    # Same field set -> same SQL text, so statements are reused across requests
+    db.execute(text(f"CREATE TEMP TABLE bulk_tx_updates ON COMMIT DROP AS SELECT id, {columns} FROM transactions WITH NO DATA"))
+    db.execute(
+        text(f"INSERT INTO bulk_tx_updates (id, {columns}) VALUES (:id, {', '.join(':' + f for f in fields)})"),
+        rows
+    )
+    updated = db.execute(text(f"""
+        UPDATE transactions AS t
+        SET {", ".join(f"{f} = u.{f}" for f in fields)}
+        FROM bulk_tx_updates AS u
+        WHERE t.id = u.id
+        RETURNING t.id
+    """)).scalars().all()
+    db.execute(text("DROP TABLE bulk_tx_updates"))
+    return {str(i) for i in updated}
+
 @app.patch("/transactions/bulk")
 def bulk_update_transactions(
     updates: List[dict] = Body(...), 
     db: Session = Depends(get_db)
 ):
-    updated = 0
-    for upd in updates:
-        txn_id = upd.pop("id", None)
+    # Results line up with the input. A later edit of the same row replaces an
+    # earlier one, so only each id's last edit is applied.
+    results = [None] * len(updates)
+    last_edit = {}
+    for pos, upd in enumerate(updates):
+        txn_id = upd.get("id")
+        if not txn_id:
+            results[pos] = {"id": None, "status": "skipped", "error": "Missing id"}
+            continue
+        last_edit[str(txn_id)] = pos
+
+    groups = {}
+    for pos, upd in enumerate(updates):
+        txn_id = upd.get("id")
         if not txn_id:
-            continue  # Or: raise HTTPException(400, "Missing id in one update")
-        allowed_fields = [  "from_ledger", "to_ledger", "voucher", "status", "narration", "remark",  "withdrawal_amount", "deposit_amount"]
-        fields = {k: v for k, v in upd.items() if k in allowed_fields}
+            continue
+        if last_edit[str(txn_id)] != pos:
+            results[pos] = {"id": txn_id, "status": "skipped", "error": "Superseded by a later edit of the same id"}
+            continue
+        fields = {k: v for k, v in upd.items() if k in BULK_UPDATE_FIELDS}
         if not fields:
+            results[pos] = {"id": txn_id, "status": "skipped", "error": "No valid fields to update"}
             continue
-        set_clause = ", ".join([f"{k} = :{k}" for k in fields])
-        fields["id"] = txn_id
-        db.execute(
-            text(f"UPDATE transactions SET {set_clause} WHERE id = :id"),
-            fields
-        )
-        updated += 1
+        groups.setdefault(tuple(sorted(fields)), []).append((pos, {"id": txn_id, **fields}))
+
+    # All groups commit together or not at all
+    for fields, rows in groups.items():
+        matched = apply_bulk_update_group(db, fields, [row for _, row in rows])
+        for pos, row in rows:
+            results[pos] = {"id": row["id"], "status": "updated" if str(row["id"]) in matched else "not_found"}
     db.commit()
-    return {"success": True, "updated": updated}
+    updated = sum(1 for r in results if r["status"] == "updated")
+    return {"success": True, "updated": updated, "results": results}
     
 
 # -- UTILS --
@@ -202,210 +288,127 @@ def safe_float(val):
         return 0.0
 
 # ---------- 3. Modular Excel Upload & Parse to JSON ----------
-def parse_hdfc_statement(contents: bytes, filename: str) -> dict:
-    import io
-    import pandas as pd
-    import math
-
-    def safe_str(val):
-        if val is None or (isinstance(val, float) and math.isnan(val)):
-            return ""
-        return str(val).strip()
-
-    def safe_float(val):
-        try:
-            f = float(str(val).replace(",", ""))
-            if math.isnan(f):
-                return 0.0
-            return f
-        except Exception:
-            return 0.0
-
-    # Always use engine="xlrd" for .xls and openpyxl for .xlsx
-    if filename.endswith(".xls"):
-        engine = "xlrd"
-    else:
-        engine = "openpyxl"
-
-    # Step 1: Load with NO HEADER, find the real header row
-    df = pd.read_excel(io.BytesIO(contents), sheet_name=0, engine=engine, header=None)
-    header_row = None
-    for idx, row in df.iterrows():
-        vals = [safe_str(v) for v in row.values]
-        if "Date" in vals and "Narration" in vals:
-            header_row = idx
-            break
-    if header_row is None:
-        raise Exception("Could not find transaction header in Excel file.")
-
-    # Step 2: Reload using the actual header row
-    df_transactions = pd.read_excel(
-        io.BytesIO(contents),
-        sheet_name=0,
-        skiprows=header_row,
-        header=0,
-        engine=engine
-    )
-
-    # Step 3: Parse transactions as before
-    transactions = []
-    for _, row in df_transactions.iterrows():
-        if pd.isna(row.get('Date')) or "STATEMENT SUMMARY" in str(row.get('Date', '')):
-            break
-        try:
-            date_str = safe_str(row['Date'])
-            if not date_str or date_str.lower() == "nan":
-                continue
-            date = pd.to_datetime(date_str, format="%d/%m/%y").strftime("%Y-%m-%d")
-            narration = safe_str(row['Narration'])
-            ref_no = safe_str(row['Chq./Ref.No.'])
-            value_date = pd.to_datetime(safe_str(row['Value Dt']), format="%d/%m/%y").strftime("%Y-%m-%d")
-            withdrawal_amt = safe_float(row['Withdrawal Amt.'])
-            deposit_amt = safe_float(row['Deposit Amt.'])
-            closing_balance = safe_float(row['Closing Balance'])
-            transaction_type = "debit" if withdrawal_amt > 0 else "credit"
-            category = "UPI Payment" if "UPI" in narration else "Other"
-            transactions.append({
-                "date": date,
-                "narration": narration,
-                "ref_no": ref_no,
-                "value_date": value_date,
-                "withdrawal_amount": withdrawal_amt,
-                "deposit_amount": deposit_amt,
-                "closing_balance": closing_balance,
-                "transaction_type": transaction_type,
-                "category": category,
-                "from_ledger" : None,
-                 "to_ledger" : None,
-                   "voucher" : None,
-                    "status" : None,
-            })
-        except Exception:
-            continue
-    return {"transactions": transactions}
-
-
-
 @app.post("/statements/upload")
 async def upload_bank_statement(
     company_id: str = Form(...),
     company_name: str = Form(...),
     bank: str = Form(...),
     file: UploadFile = File(...), 
-    db: Session = Depends(get_db),
 ):
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Only Excel files allowed")
-    contents = await file.read()
     try:
-        parsed_json = parse_hdfc_statement(contents, file.filename)
-    except Exception as e:
-        print(f"❌ Failed to parse statement: {e}")
-        raise HTTPException(status_code=400, detail=str(e))
-
-    transactions = parsed_json.get("transactions", [])
-    if not transactions:
-        print("⚠️ No transactions found in the uploaded file.")
-        raise HTTPException(status_code=400, detail="No transactions found in statement.")
-
-    statement_id = str(uuid.uuid4())
-    print(f"ℹ️ Inserting bank statement: {statement_id}, company: {company_name}, bank: {bank}")
-
-    # Insert statement metadata
-    db.execute(
-        text("""
-        INSERT INTO bank_statements (id, company_id, company_name, bank_name, created_at)
-        VALUES (:id, :company_id, :company_name, :bank_name, :created_at)
-        """),
-        {
-            "id": statement_id,
-            "company_id": company_id,
-            "company_name": company_name,
-            "bank_name": bank,
-            "created_at": datetime.utcnow(),
-        }
-    )
-    print("✅ Inserted bank_statement metadata.")
-
-    # Insert each transaction as a row in transactions table
-    insert_count = 0
-    for txn in transactions:
-        txn_id = str(uuid.uuid4())
-        print(f"  ➜ Inserting txn {txn_id} | date={txn.get('date')}, narration={txn.get('narration')}, amount={txn.get('withdrawal_amount', 0) or txn.get('deposit_amount', 0)}")
-        db.execute(
-            text("""
-            INSERT INTO transactions (
-                id, statement_id, company_id, date, narration, ref_no, value_date, withdrawal_amount, deposit_amount,
-                closing_balance, transaction_type, category, from_ledger, to_ledger, voucher, status, created_at
-            ) VALUES (
-                :id, :statement_id, :company_id, :date, :narration, :ref_no, :value_date, :withdrawal_amount, :deposit_amount,
-                :closing_balance, :transaction_type, :category, :from_ledger, :to_ledger, :voucher, :status, :created_at
-            )
-            """),
-            {
-                "id": txn_id,
-                "statement_id": statement_id,
-                 "company_id": company_id,
-                "date": txn["date"],
-                "narration": txn["narration"],
-                "ref_no": txn["ref_no"],
-                "value_date": txn["value_date"],
-                "withdrawal_amount": txn["withdrawal_amount"],
-                "deposit_amount": txn["deposit_amount"],
-                "closing_balance": txn["closing_balance"],
-                "transaction_type": txn["transaction_type"],
-                "category": txn["category"],
-                "from_ledger": txn.get("from_ledger"),
-                "to_ledger": txn.get("to_ledger"),
-                "voucher": txn.get("voucher"),
-                "status": txn.get("status"),
-                "created_at": datetime.utcnow(),
-            }
+        statement_pool.reserve()
+    except StatementPoolBusy as e:
+        print(f"⏳ Rejecting upload of {file.filename}: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Statement processing is busy, please retry shortly",
+            headers={"Retry-After": "5"},
         )
-        insert_count += 1
 
-    db.commit()
-    print(f"✅ {insert_count} transactions inserted for statement {statement_id}.")
+    # Parsing and inserting happen in a worker process; rows stream from the
+    # spooled file into the inserts chunk by chunk
+    try:
+        result = await statement_pool.ingest(file.file, file.filename, bank, company_id, company_name)
+    except StatementParseError as e:
+        print(f"❌ Failed to parse statement: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {
-        "statement_id": statement_id,
-        "inserted_transactions": insert_count,
+        **result,
         "message": "Statement uploaded and transactions stored"
     }
 
 
 
 
-@app.post("/statements/{statement_id}/push-to-tally")
-def push_statement_to_tally(statement_id: str, db: Session = Depends(get_db)):
-    # 1. Fetch transactions for the given statement_id
-    rows = db.execute(
-        text("SELECT * FROM transactions WHERE statement_id = :sid"),
-        {"sid": statement_id}
-    ).fetchall()
-    if not rows:
+
+
+# Rows fetched per round trip when vouchers are generated straight from the DB cursor
+VOUCHER_STREAM_ROWS = int(os.getenv("VOUCHER_STREAM_ROWS", "500"))
+
+def stream_statement_transactions(db: Session, statement_id: str):
+    """
+    Transactions of a statement that haven't been pushed yet, produced row by
+    row from a server-side cursor as the caller consumes them.
+    """
+    return db.execute(
+        text(f"""
+            SELECT * FROM transactions
+            WHERE statement_id = :sid AND status IS DISTINCT FROM :pushed
+            ORDER BY {TRANSACTION_ORDER_KEY}, id
+        """).execution_options(yield_per=VOUCHER_STREAM_ROWS),
+        {"sid": statement_id, "pushed": PUSHED_STATUS}
+    ).mappings()
+
+def statement_push_counts(db: Session, statement_id: str) -> dict:
+    """Total and already-pushed transactions of a statement; 404 if it has none."""
+    counts = db.execute(
+        text("""
+            SELECT count(*) AS total, count(*) FILTER (WHERE status = :pushed) AS pushed
+            FROM transactions WHERE statement_id = :sid
+        """),
+        {"sid": statement_id, "pushed": PUSHED_STATUS}
+    ).mappings().one()
+    if not counts["total"]:
         raise HTTPException(status_code=404, detail="No transactions found for this statement.")
+    return counts
 
-    # 2. Generate XML
-    envelope = ET.Element("ENVELOPE")
-    body = ET.SubElement(envelope, "BODY")
-    importdata = ET.SubElement(body, "IMPORTDATA")
-    requestdesc = ET.SubElement(importdata, "REQUESTDESC")
-    ET.SubElement(requestdesc, "REPORTNAME").text = "Vouchers"
-    requestdata = ET.SubElement(importdata, "REQUESTDATA")
-    for row in rows:
-        tallymsg = ET.SubElement(requestdata, "TALLYMESSAGE")
-        voucher = ET.SubElement(tallymsg, "VOUCHER")
-        # Use column names; adjust these as per your schema
-        for col, val in row._mapping.items():
-            if col not in ("id", "statement_id"):  # skip technical cols
-                ET.SubElement(voucher, col.upper()).text = str(val) if val is not None else ""
-
-    xml_str = ET.tostring(envelope, encoding="utf-8").decode()
-
-    # 3. Push to Tally
-    resp = requests.post("http://localhost:9000", data=xml_str, headers={"Content-Type": "application/xml"})
-    return {"status": resp.status_code, "tally_response": resp.text}
+
+@app.post("/statements/{statement_id}/push-to-tally")
+def push_statement_to_tally(
+    statement_id: str,
+    batch_size: int = Query(TALLY_PUSH_BATCH_SIZE, ge=1),
+    db: Session = Depends(get_db),
+):
+    counts = statement_push_counts(db, statement_id)
+
+    # Vouchers come off the cursor batch_size at a time, one envelope per batch,
+    # so memory stays bounded and each batch holds the Tally slot only for its
+    # own import: interactive reads are served between batches
+    rows = stream_statement_transactions(db, statement_id)
+    batches = []
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        outcomes, sent, vouchers = [], [], []
+        for tx in batch:
+            try:
+                vouchers.append(transaction_voucher(tx))
+                sent.append(tx)
+            except Exception as e:
+                outcomes.append((tx["id"], "Failed", f"XML generation error: {str(e)}"))
+        result = {"batch": len(batches) + 1}
+        if sent:
+            try:
+                resp = post_xml(iter_import_envelope(vouchers), lane="bulk")
+            except requests.RequestException as e:
+                # Batches already recorded stay recorded; this one is sent again next time
+                raise HTTPException(status_code=500, detail=f"Tally connection failed: {str(e)}")
+            result.update(status=resp.status_code, tally_response=resp.text)
+            mapped = map_import_results(sent, resp.text)
+            outcomes += [(tx["id"], status, error) for tx, (status, error) in zip(sent, mapped)]
+        # Recorded per batch on its own session; committing `db` would close the cursor
+        with SessionLocal() as state_db:
+            record_push_state(state_db, [(tx_id, status) for tx_id, status, _ in outcomes])
+            state_db.commit()
+        for status in ("Success", "Failed", "Unknown"):
+            result[status.lower()] = sum(1 for _, s, _ in outcomes if s == status)
+        result["errors"] = sorted({error for _, _, error in outcomes if error})
+        batches.append(result)
+
+    pushed = sum(b["success"] for b in batches)
+    attempted = sum(b["success"] + b["failed"] + b["unknown"] for b in batches)
+    failed = [b["status"] for b in batches if b.get("status", 200) != 200]
+    return {
+        "status": failed[0] if failed else 200,
+        "message": f"Pushed {pushed} of {attempted} transactions." if attempted
+                   else "Nothing left to push; every transaction was already pushed.",
+        "skipped_already_pushed": counts["pushed"],
+        "batches": batches,
+    }
 
 @app.get("/statements/{statement_id}")
 def get_statement(statement_id: str, db: Session = Depends(get_db)):
@@ -416,15 +419,95 @@ def get_statement(statement_id: str, db: Session = Depends(get_db)):
     return result[0]
 
 
-@app.get("/transactions")
-def get_transactions(statement_id: str, db: Session = Depends(get_db)):
-    # This returns an iterable of dictionaries
-    result = db.execute(
-        text("SELECT * FROM transactions WHERE statement_id=:sid"),
-        {"sid": statement_id}
-    )
-    rows = result.mappings().all()
-    return rows
+TRANSACTION_COLUMNS = [
+    "id", "statement_id", "company_id", "date", "narration", "ref_no", "value_date", "withdrawal_amount",
+    "deposit_amount", "closing_balance", "transaction_type", "category", "from_ledger", "to_ledger",
+    "voucher", "status", "remark", "created_at",
+]
+
+# Statement order. Rows without a date sort last; transactions_statement_date_id_idx
+# indexes this exact expression, so keyset pages over NULL dates stay index scans.
+TRANSACTION_ORDER_KEY = "COALESCE(date, CAST('infinity' AS date))"
+
+def encode_cursor(row) -> str:
+    after_date = None if row["date"] is None else str(row["date"])
+    return base64.urlsafe_b64encode(json.dumps([after_date, str(row["id"])]).encode()).decode()
+
+def decode_cursor(cursor: str) -> list:
+    """The cursor's (date, id) as order key values; a NULL date becomes 'infinity'."""
+    try:
+        after_date, after_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return [
+            "infinity" if after_date is None else date.fromisoformat(after_date).isoformat(),
+            str(uuid.UUID(after_id)),
+        ]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/transactions", response_class=FastJSONResponse)
+def get_transactions(
+    statement_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    include_total: bool = False,
+    db: Session = Depends(get_db),
+):
+    """
+    Without `limit` (and `cursor`) this returns the whole statement as a plain
+    list, as before. With them it returns one page ordered by (date, id), rows
+    without a date last:
+    {"items": [...], "next_cursor": ..., "total": ...}. `fields` is a comma
+    separated column list to return instead of every column.
+    """
+    if fields:
+        columns = [c.strip() for c in fields.split(",") if c.strip()]
+        unknown = [c for c in columns if c not in TRANSACTION_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        select = ", ".join(dict.fromkeys(columns))
+    else:
+        columns = None
+        select = "*"
+
+    if limit is None and cursor is None:
+        # This returns an iterable of dictionaries
+        result = db.execute(
+            text(f"SELECT {select} FROM transactions WHERE statement_id=:sid"),
+            {"sid": statement_id}
+        )
+        return FastJSONResponse(result.mappings().all())
+
+    # Keyset pagination: the cursor is the (date, id) of the last row served
+    limit = limit or 200
+    if columns is not None:
+        select = ", ".join(dict.fromkeys(columns + ["date", "id"]))
+    params = {"sid": statement_id, "limit": limit + 1}
+    after = ""
+    if cursor:
+        params["after_date"], params["after_id"] = decode_cursor(cursor)
+        after = f"AND ({TRANSACTION_ORDER_KEY}, id) > (CAST(:after_date AS date), CAST(:after_id AS uuid))"
+    rows = db.execute(
+        text(f"""
+            SELECT {select} FROM transactions
+            WHERE statement_id = :sid {after}
+            ORDER BY {TRANSACTION_ORDER_KEY}, id
+            LIMIT :limit
+        """),
+        params
+    ).mappings().all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    page = {
+        "items": [{c: row[c] for c in columns} for row in rows] if columns is not None else rows,
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+    }
+    if include_total:
+        page["total"] = db.execute(
+            text("SELECT count(*) FROM transactions WHERE statement_id = :sid"), {"sid": statement_id}
+        ).scalar()
+    return FastJSONResponse(page)
 
 
 @app.patch("/transactions/{txn_id}")
@@ -442,68 +525,56 @@ def update_transaction(txn_id: str, data: dict = Body(...), db: Session = Depend
     db.commit()
     return {"success": True}
 
-@app.get("/ledgers")
+@app.get("/ledgers", response_class=FastJSONResponse)
 def get_ledgers(db: Session = Depends(get_db)):
     result = db.execute(text("SELECT name FROM ledgers")).fetchall()
-    return [r[0] for r in result]
-
-def print_xml_debug(xml_str, err=None):
-    # Always write the raw XML to a file for inspection
-    with open("debug_tally_ledgers.xml", "w", encoding="utf-8", errors="replace") as f:
-        f.write(xml_str)
-    print("✅ [DEBUG] Wrote Tally XML response to debug_tally_ledgers.xml")
-    if err and hasattr(err, 'position'):
-        line, col = err.position
-        lines = xml_str.splitlines()
-        context = ""
-        if 0 < line <= len(lines):
-            context = lines[line - 1]
-            print(f"⚠️ Problem line {line}:\n{context}")
-            if 0 < col <= len(context):
-                print(f"⚠️ Character at column {col}: {repr(context[col-1])}")
-            else:
-                print("⚠️ Column out of range.")
-        else:
-            print("⚠️ Line out of range.")
-
-def parse_ledgers(xml_response: str):
+    return FastJSONResponse([r[0] for r in result])
+
+def fetch_ledgers_from_tally(xml: str):
+    """Stream an All Ledgers export from Tally into a list of {name, parent, alter_id} dicts."""
     ledgers = []
     try:
-        xml_response = clean_xml(xml_response)
-        # Debug: log what we're parsing
-        print_xml_debug(xml_response)
-        root = ET.fromstring(xml_response)
-        for ledger in root.findall('.//LEDGER'):
+        for ledger in iter_tally_records(xml, "LEDGER", clean=True):
             name = ledger.findtext('.//NAME')
             parent = ledger.findtext('.//PARENT')
+            alter_id = (ledger.findtext('.//ALTERID') or "").strip()
             if name:
-                ledgers.append({"name": name, "parent": parent})
+                ledgers.append({"name": name, "parent": parent,
+                                "alter_id": int(alter_id) if alter_id.isdigit() else None})
+    except requests.RequestException as e:
+        raise HTTPException(status_code=500, detail=f"Tally connection failed: {str(e)}")
     except ET.ParseError as e:
-        print_xml_debug(xml_response, e)
-        raise HTTPException(status_code=500, detail=f"Parse error: {str(e)}")
-    except Exception as e:
-        print_xml_debug(xml_response)
+        line, col = e.position
+        print(f"⚠️ Could not parse Tally ledgers at line {line}, column {col}: {e}")
         raise HTTPException(status_code=500, detail=f"Parse error: {str(e)}")
     return ledgers
 
 def send_to_tally(xml: str) -> str:
-    headers = {"Content-Type": "application/xml"}
     try:
-        response = requests.post(TALLY_URL, data=xml.encode("utf-8"), headers=headers, timeout=10)
+        response = post_xml(xml, timeout=10)
         response.raise_for_status()
         return response.text
     except requests.RequestException as e:
         raise HTTPException(status_code=500, detail=f"Tally connection failed: {str(e)}")
-    
-@app.post("/sync-ledgers/{tenant_id}/{company_id}/{company_name}")
-def sync_ledgers(
-    tenant_id: str,
-    company_id: str,
-    company_name: str,
-    db: Session = Depends(get_db),
-):
-    # 1. Fetch ledgers from Tally for the given company_name
-    xml = f"""
+
+async def send_to_tally_async(xml: XmlBody, lane: str = "interactive") -> str:
+    try:
+        response = await post_xml_async(xml, lane=lane)
+        response.raise_for_status()
+        return response.text
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Tally connection failed: {str(e)}")
+
+LEDGER_FULL_SYNC_INTERVAL = float(os.getenv("LEDGER_FULL_SYNC_INTERVAL", str(24 * 3600)))
+
+def generate_ledger_export_xml(company_name: str, since_alter_id: int = None) -> str:
+    """All Ledgers export; with since_alter_id only ledgers altered after that AlterID."""
+    altered_filter = ""
+    altered_formula = ""
+    if since_alter_id is not None:
+        altered_filter = "<FILTERS>AlteredSince</FILTERS>"
+        altered_formula = f'<SYSTEM TYPE="Formulae" NAME="AlteredSince">$AlterID > {int(since_alter_id)}</SYSTEM>'
+    return f"""
     <ENVELOPE>
       <HEADER>
         <VERSION>1</VERSION>
@@ -523,7 +594,10 @@ def sync_ledgers(
                 <TYPE>Ledger</TYPE>
                 <NATIVEMETHOD>NAME</NATIVEMETHOD>
                 <NATIVEMETHOD>PARENT</NATIVEMETHOD>
+                <NATIVEMETHOD>ALTERID</NATIVEMETHOD>
+                {altered_filter}
               </COLLECTION>
+              {altered_formula}
             </TDLMESSAGE>
           </TDL>
         </DESC>
@@ -531,46 +605,129 @@ def sync_ledgers(
     </ENVELOPE>
     """
 
-    # 2. Call Tally and parse ledgers
-    tally_response = send_to_tally(xml)
-    ledgers = parse_ledgers(tally_response)
-
-    # 3. Upsert (insert or update) groups (ledger_groups)
-    group_name_to_id = {}
+def upsert_ledgers(db: Session, tenant_id: str, company_id: str, ledgers: List[dict]) -> dict:
+    """
+    Upsert ledger_groups and ledgers for a batch of {name, parent} dicts in two
+    statements, however many ledgers there are. Returns {group name: group id}.
+    """
+    # ON CONFLICT can't touch the same row twice in one statement, so dedupe first
+    parents_by_name = {}
     for ledger in ledgers:
+        name = ledger["name"].strip()
         parent = ledger.get("parent", "").strip() if ledger.get("parent") else None
-        if parent and parent not in group_name_to_id:
-            result = db.execute(
-                text("""
-                    INSERT INTO ledger_groups (tenant_id, name)
-                    VALUES (:tenant_id, :name)
-                    ON CONFLICT (tenant_id, name) DO UPDATE SET name = EXCLUDED.name
-                    RETURNING id
-                """),
-                {"tenant_id": tenant_id, "name": parent}
-            )
-            group_id = result.fetchone()[0]
-            group_name_to_id[parent] = group_id
+        if name:
+            parents_by_name[name] = parent or None
+    if not parents_by_name:
+        return {}
 
-    db.commit()
+    group_names = sorted({p for p in parents_by_name.values() if p})
+    group_name_to_id = {}
+    if group_names:
+        rows = db.execute(
+            text("""
+                INSERT INTO ledger_groups (tenant_id, name)
+                SELECT :tenant_id, g.name FROM unnest(CAST(:names AS text[])) AS g(name)
+                ON CONFLICT (tenant_id, name) DO UPDATE SET name = EXCLUDED.name
+                RETURNING id, name
+            """),
+            {"tenant_id": tenant_id, "names": group_names}
+        ).fetchall()
+        group_name_to_id = {name: group_id for group_id, name in rows}
 
-    # 4. Upsert ledgers, linking to both company and group
-    for ledger in ledgers:
-        name = ledger["name"].strip()
-        parent = ledger.get("parent", "").strip() if ledger.get("parent") else None
-        group_id = group_name_to_id.get(parent)
-        db.execute(
+    # Link each ledger to its group by name on the database side
+    db.execute(
+        text("""
+            INSERT INTO ledgers (tenant_id, company_id, name, group_id)
+            SELECT :tenant_id, :company_id, l.name, g.id
+            FROM unnest(CAST(:names AS text[]), CAST(:parents AS text[])) AS l(name, parent)
+            LEFT JOIN ledger_groups g ON g.tenant_id = :tenant_id AND g.name = l.parent
+            ON CONFLICT (tenant_id, company_id, name) DO UPDATE
+            SET group_id = EXCLUDED.group_id
+        """),
+        {"tenant_id": tenant_id, "company_id": company_id,
+         "names": list(parents_by_name), "parents": list(parents_by_name.values())}
+    )
+    return group_name_to_id
+
+@app.post("/sync-ledgers/{tenant_id}/{company_id}/{company_name}")
+def sync_ledgers(
+    tenant_id: str,
+    company_id: str,
+    company_name: str,
+    full: bool = False,
+    db: Session = Depends(get_db),
+):
+    # 1. Work out what changed since the last sync
+    state = db.execute(
+        text("""
+            SELECT ledger_alter_id, master_alter_id, last_full_sync
+            FROM company_sync_state
+            WHERE tenant_id = :tenant_id AND company_id = :company_id
+        """),
+        {"tenant_id": tenant_id, "company_id": company_id}
+    ).mappings().first()
+
+    # Deleted ledgers never show up in an AlterID delta, so reconcile in full now and then
+    full_due = (
+        state is None
+        or state["last_full_sync"] is None
+        or (datetime.now(state["last_full_sync"].tzinfo) - state["last_full_sync"]).total_seconds()
+            >= LEDGER_FULL_SYNC_INTERVAL
+    )
+    full = full or full_due
+
+    # ALTMSTID moves on any master change; if it hasn't, there is nothing to fetch
+    master_alter_id = fetch_master_alter_id(company_name)
+    if (not full and master_alter_id is not None
+            and master_alter_id == state["master_alter_id"]):
+        return {"ok": True, "ledgers_synced": 0, "mode": "unchanged", "alter_id": state["ledger_alter_id"]}
+
+    since = None if full else state["ledger_alter_id"]
+
+    # 2. Fetch (changed) ledgers from Tally for the given company_name
+    ledgers = fetch_ledgers_from_tally(generate_ledger_export_xml(company_name, since))
+
+    # 3. Upsert groups and ledgers, one statement each
+    upsert_ledgers(db, tenant_id, company_id, ledgers)
+
+    # 4. On a full sync, drop ledgers that no longer exist in Tally
+    # (an empty export means something went wrong, not that every ledger is gone)
+    deleted = 0
+    if full and ledgers:
+        deleted = db.execute(
             text("""
-                INSERT INTO ledgers (tenant_id, company_id, name, group_id)
-                VALUES (:tenant_id, :company_id, :name, :group_id)
-                ON CONFLICT (tenant_id, company_id, name) DO UPDATE
-                SET group_id = EXCLUDED.group_id
+                DELETE FROM ledgers
+                WHERE tenant_id = :tenant_id AND company_id = :company_id
+                  AND NOT (name = ANY(:names))
             """),
-            {"tenant_id": tenant_id, "company_id": company_id, "name": name, "group_id": group_id}
-        )
+            {"tenant_id": tenant_id, "company_id": company_id,
+             "names": [ledger["name"].strip() for ledger in ledgers]}
+        ).rowcount
+
+    # 5. Advance the watermark in the same transaction as the data it covers
+    alter_id = max(
+        [ledger["alter_id"] for ledger in ledgers if ledger.get("alter_id") is not None]
+        + [0 if full or state is None else state["ledger_alter_id"]]
+    )
+    db.execute(
+        text("""
+            INSERT INTO company_sync_state (tenant_id, company_id, ledger_alter_id, master_alter_id, last_full_sync)
+            VALUES (:tenant_id, :company_id, :ledger_alter_id, :master_alter_id, CASE WHEN :full THEN now() END)
+            ON CONFLICT (tenant_id, company_id) DO UPDATE SET
+                ledger_alter_id = EXCLUDED.ledger_alter_id,
+                master_alter_id = EXCLUDED.master_alter_id,
+                last_full_sync = COALESCE(EXCLUDED.last_full_sync, company_sync_state.last_full_sync),
+                updated_at = now()
+        """),
+        {"tenant_id": tenant_id, "company_id": company_id, "ledger_alter_id": alter_id,
+         "master_alter_id": master_alter_id, "full": full}
+    )
 
     db.commit()
-    return {"ok": True, "ledgers_synced": len(ledgers)}
+    print(f"🔄 Ledger sync for {company_name}: {'full' if full else 'incremental'}, "
+          f"{len(ledgers)} upserted, {deleted} deleted, watermark {alter_id}")
+    return {"ok": True, "ledgers_synced": len(ledgers), "mode": "full" if full else "incremental",
+            "deleted": deleted, "alter_id": alter_id}
 
 
 
@@ -578,28 +735,22 @@ def sync_ledgers(
 
 
 @app.post("/convert-json-to-tallyxml")
-def convert_json_to_tallyxml(payload: dict):
-    envelope = ET.Element("ENVELOPE")
-    body = ET.SubElement(envelope, "BODY")
-    importdata = ET.SubElement(body, "IMPORTDATA")
-    requestdesc = ET.SubElement(importdata, "REQUESTDESC")
-    ET.SubElement(requestdesc, "REPORTNAME").text = "Vouchers"
-    requestdata = ET.SubElement(importdata, "REQUESTDATA")
-    for txn in payload["transactions"]:
-        tallymsg = ET.SubElement(requestdata, "TALLYMESSAGE")
-        voucher = ET.SubElement(tallymsg, "VOUCHER")
-        for k, v in txn.items():
-            ET.SubElement(voucher, k.upper()).text = str(v)
-    xml_str = ET.tostring(envelope, encoding="utf-8").decode()
-    return {"tally_xml": xml_str}
+def convert_json_to_tallyxml(payload: dict, download: bool = False, gzip: bool = False):
+    """
+    {"tally_xml": ...} by default. With download=true the XML itself is streamed
+    as an application/xml attachment while it is generated (gzip=true: .xml.gz).
+    """
+    messages = (fields_message(txn) for txn in payload["transactions"])
+    if download:
+        return xml_download(iter_import_envelope(messages), "vouchers.xml", gzip)
+    return {"tally_xml": import_envelope(messages).decode("utf-8")}
 
 @app.post("/push-to-tally")
 def push_to_tally(payload: dict):
-    tally_url = "http://localhost:9000"  # Replace with your Tally server endpoint
     xml_data = payload.get("tally_xml")
     if not xml_data:
         raise HTTPException(status_code=400, detail="Missing Tally XML")
-    resp = requests.post(tally_url, data=xml_data, headers={"Content-Type": "application/xml"})
+    resp = post_xml(xml_data, lane="bulk")
     return {"status": resp.status_code, "response": resp.text}
 
 
@@ -607,274 +758,289 @@ def push_to_tally(payload: dict):
 
 
 #frontend apis 
-def get_date_xml(val):
+def generate_tally_xml_from_db_transactions(
+    transactions: list,
+    selected_company: str = "Test"
+) -> bytes:
     """
-    Accepts string (YYYY-MM-DD), datetime.date, or datetime.datetime.
-    Returns date in Tally format (YYYYMMDD). Falls back to today.
+    - transactions: List of dicts, each a transaction row (from your database)
+    - selected_company: Name of the active company in Tally
+    Returns: UTF-8 XML ready for Tally import
     """
-    from datetime import datetime, date
-    if val is None:
-        return datetime.now().strftime("%Y%m%d")
-    # If already date object
-    if isinstance(val, (datetime, date)):
-        return val.strftime("%Y%m%d")
-    # If string
-    try:
-        return datetime.strptime(str(val), "%Y-%m-%d").strftime("%Y%m%d")
-    except Exception:
-        # Try parsing other string formats if needed
+    return import_envelope((transaction_voucher(tx) for tx in transactions), selected_company)
+
+
+def generate_voucher_xml_from_tx(tx: dict, selected_company: str) -> bytes:
+    return import_envelope([transaction_voucher(tx)], selected_company)
+
+
+def parse_import_response(tally_response: str) -> dict:
+    """Read the CREATED/ALTERED/ERRORS counters and LINEERROR messages of an import response."""
+    root = ET.fromstring(tally_response)
+    counts = {}
+    for tag in ("CREATED", "ALTERED", "ERRORS", "EXCEPTIONS"):
+        value = root.findtext(f".//{tag}")
         try:
-            return pd.to_datetime(str(val)).strftime("%Y%m%d")
-        except Exception:
-            return datetime.now().strftime("%Y%m%d")
+            counts[tag.lower()] = int(value) if value else 0
+        except ValueError:
+            counts[tag.lower()] = 0
+    counts["line_errors"] = [e.text.strip() for e in root.iter("LINEERROR") if e.text and e.text.strip()]
+    return counts
 
 
-def escape_xml(text: str) -> str:
-    if text is None:
-        return ""
-    return html.escape(str(text), quote=False)
+def _error_mentions_tx(error: str, tx: dict) -> bool:
+    # Tally quotes the offending master or voucher number, e.g. "Ledger 'Foo' does not exist!"
+    for name in (tx.get("from_ledger"), tx.get("to_ledger"), tx.get("ref_no")):
+        if name and (f"'{name}'" in error or f'"{name}"' in error):
+            return True
+    return False
 
 
-def generate_tally_xml_from_db_transactions(
-    transactions: list,
-    selected_company: str = "Test"
-) -> str:
+def map_import_results(batch: list, tally_response: str) -> list:
     """
-    - transactions: List of dicts, each a transaction row (from your database)
-    - selected_company: Name of the active company in Tally
-    Returns: XML string ready for Tally import
+    Map one multi-voucher import response back to the transactions of the batch.
+    Returns a list of (status, error) tuples in batch order.
     """
-    import xml.etree.ElementTree as ET
-    from datetime import datetime
-
-    root = ET.Element("ENVELOPE")
-    header = ET.SubElement(root, "HEADER")
-    ET.SubElement(header, "TALLYREQUEST").text = "Import Data"
-    body = ET.SubElement(root, "BODY")
-    importdata = ET.SubElement(body, "IMPORTDATA")
-    requestdesc = ET.SubElement(importdata, "REQUESTDESC")
-    ET.SubElement(requestdesc, "REPORTNAME").text = "Vouchers"
-    static_vars = ET.SubElement(requestdesc, "STATICVARIABLES")
-    ET.SubElement(static_vars, "SVCURRENTCOMPANY").text = selected_company
-    requestdata = ET.SubElement(importdata, "REQUESTDATA")
-
-    for tx in transactions:
-        # Safety: handle missing/None values
-        voucher_type = tx.get("voucher", "Payment")
-    
-        date_xml = get_date_xml(tx.get("date") or tx.get("value_date"))
-
-        narration = escape_xml(tx.get("narration", ""))
-        from_ledger = tx.get("from_ledger", "")
-        to_ledger = tx.get("to_ledger", "")
-        # Determine amount and Dr/Cr based on transaction_type or amounts
-        if tx.get("withdrawal_amount", 0) > 0:
-            amount = tx["withdrawal_amount"]
-            is_deemed_positive1 = "Yes"
-            is_deemed_positive2 = "No"
-            amount1 = -amount
-            amount2 = amount
-        else:
-            amount = tx.get("deposit_amount", 0)
-            is_deemed_positive1 = "No"
-            is_deemed_positive2 = "Yes"
-            amount1 = amount
-            amount2 = -amount
-
-        # XML structure per transaction
-        tally_msg = ET.SubElement(requestdata, "TALLYMESSAGE")
-        voucher = ET.SubElement(
-            tally_msg, "VOUCHER",
-            VCHTYPE=voucher_type,
-            ACTION="Create",
-            OBJVIEW="Accounting Voucher View"
-        )
-        # Minimal required fields
-        ET.SubElement(voucher, "DATE").text = date_xml
-        ET.SubElement(voucher, "NARRATION").text = narration
-        ET.SubElement(voucher, "VOUCHERTYPENAME").text = voucher_type
-        ET.SubElement(voucher, "VOUCHERNUMBER").text = tx.get("ref_no", "")
-        # From Ledger
-        ledger_entry1 = ET.SubElement(voucher, "ALLLEDGERENTRIES.LIST")
-        ET.SubElement(ledger_entry1, "LEDGERNAME").text = from_ledger
-        ET.SubElement(ledger_entry1, "ISDEEMEDPOSITIVE").text = is_deemed_positive1
-        ET.SubElement(ledger_entry1, "AMOUNT").text = str(amount1)
-        # To Ledger
-        ledger_entry2 = ET.SubElement(voucher, "ALLLEDGERENTRIES.LIST")
-        ET.SubElement(ledger_entry2, "LEDGERNAME").text = to_ledger
-        ET.SubElement(ledger_entry2, "ISDEEMEDPOSITIVE").text = is_deemed_positive2
-        ET.SubElement(ledger_entry2, "AMOUNT").text = str(amount2)
-
-    xml_str = ET.tostring(root, encoding="unicode", method="xml")
-    return '<?xml version="1.0" encoding="UTF-8"?>\n' + xml_str
-
-
-
-
-def generate_voucher_xml_from_tx(tx: dict, selected_company: str) -> str:
-    # Parse date (ensure fallback if None)
-    date_xml = get_date_xml(tx.get("date") or tx.get("value_date"))
-
-
-    voucher_type = (tx.get("voucher") or "Payment").capitalize()
-    narration = tx.get("narration", "")
-    from_ledger = tx.get("from_ledger", "")
-    to_ledger = tx.get("to_ledger", "")
-    ref_no = tx.get("ref_no", "")
-    
-    # Amount logic
-    if tx.get("withdrawal_amount", 0) > 0:
-        amount = float(tx["withdrawal_amount"])
-        is_deemed_positive1 = "Yes"
-        is_deemed_positive2 = "No"
-        amount1 = -amount
-        amount2 = amount
+    try:
+        parsed = parse_import_response(tally_response)
+    except ET.ParseError:
+        return [("Failed", "Invalid response from Tally")] * len(batch)
+
+    ok = parsed["created"] + parsed["altered"]
+    line_errors = parsed["line_errors"]
+    if not line_errors and not parsed["errors"] and ok >= len(batch):
+        return [("Success", None)] * len(batch)
+    if ok == 0 or len(batch) == 1:
+        error = "; ".join(line_errors) or "Voucher not created"
+        return [("Failed", error)] * len(batch)
+
+    # Partial success: attribute each LINEERROR to the vouchers it names
+    results = [None] * len(batch)
+    for error in line_errors:
+        for idx, tx in enumerate(batch):
+            if results[idx] is None and _error_mentions_tx(error, tx):
+                results[idx] = ("Failed", error)
+    failed = sum(1 for r in results if r is not None)
+    if failed == len(batch) - ok:
+        rest = ("Success", None)
     else:
-        amount = float(tx.get("deposit_amount", 0))
-        is_deemed_positive1 = "No"
-        is_deemed_positive2 = "Yes"
-        amount1 = amount
-        amount2 = -amount
+        rest = ("Unknown", f"Tally created {ok} of {len(batch)} vouchers in this batch; could not match its errors to vouchers")
+    return [r if r is not None else rest for r in results]
 
-    voucher_number = ref_no or f"VCH-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-    guid = str(uuid.uuid4())
 
-    xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<ENVELOPE>
-  <HEADER>
-    <TALLYREQUEST>Import Data</TALLYREQUEST>
-  </HEADER>
-  <BODY>
-    <IMPORTDATA>
-      <REQUESTDESC>
-        <REPORTNAME>Vouchers</REPORTNAME>
-        <STATICVARIABLES>
-          <SVCURRENTCOMPANY>{selected_company}</SVCURRENTCOMPANY>
-        </STATICVARIABLES>
-      </REQUESTDESC>
-      <REQUESTDATA>
-        <TALLYMESSAGE>
-          <VOUCHER VCHTYPE="{voucher_type}" ACTION="Create" OBJVIEW="Accounting Voucher View">
-            <GUID>{guid}</GUID>
-            <VOUCHERNUMBER>{voucher_number}</VOUCHERNUMBER>
-            <DATE>{date_xml}</DATE>
-            <NARRATION>{narration}</NARRATION>
-            <VOUCHERTYPENAME>{voucher_type}</VOUCHERTYPENAME>
-            <ALLLEDGERENTRIES.LIST>
-              <LEDGERNAME>{from_ledger}</LEDGERNAME>
-              <ISDEEMEDPOSITIVE>{is_deemed_positive1}</ISDEEMEDPOSITIVE>
-              <AMOUNT>{amount1}</AMOUNT>
-            </ALLLEDGERENTRIES.LIST>
-            <ALLLEDGERENTRIES.LIST>
-              <LEDGERNAME>{to_ledger}</LEDGERNAME>
-              <ISDEEMEDPOSITIVE>{is_deemed_positive2}</ISDEEMEDPOSITIVE>
-              <AMOUNT>{amount2}</AMOUNT>
-            </ALLLEDGERENTRIES.LIST>
-          </VOUCHER>
-        </TALLYMESSAGE>
-      </REQUESTDATA>
-    </IMPORTDATA>
-  </BODY>
-</ENVELOPE>
-"""
-    return xml
+async def fetch_statement_transactions(db: AsyncSession, statement_id: str):
+    result = await db.execute(
+        text("SELECT * FROM transactions WHERE statement_id = :sid"),
+        {"sid": statement_id}
+    )
+    return result.mappings().all()
+
 
+async def save_push_state(db: AsyncSession, outcomes: list):
+    await db.run_sync(record_push_state, outcomes)
+    await db.commit()
 
-@app.post("/api/push-db-transactions-to-tally")
+
+@app.post("/api/push-db-transactions-to-tally", response_class=FastJSONResponse)
 async def push_db_transactions_to_tally(
     body: PushToTallyRequest = Body(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    result = db.execute(
-        text("SELECT * FROM transactions WHERE statement_id = :sid"),
-        {"sid": body.statement_id}
-    )
-    transactions = result.mappings().all()
+    transactions = await fetch_statement_transactions(db, body.statement_id)
     if not transactions:
         raise HTTPException(status_code=404, detail="No transactions found for this statement_id.")
 
+    # Vouchers created by an earlier push are not sent again
+    skipped = sum(1 for tx in transactions if tx.get("status") == PUSHED_STATUS)
+    transactions = [tx for tx in transactions if tx.get("status") != PUSHED_STATUS]
+
     responses = []
-    batch_size = 1
+    batch_size = max(1, body.batch_size)
     for i in range(0, len(transactions), batch_size):
-        batch = transactions[i:i + batch_size]
-        tx = batch[0]
-        try:
-            xml_str = generate_voucher_xml_from_tx(tx, body.selected_company)
-            # Debug: Save XML and transaction details to a file for inspection
-            with open(f"tally_debug_batch_{i//batch_size+1}.xml", "w", encoding="utf-8") as f:
-                f.write(xml_str)
-            print(f"\n=== [DEBUG] Batch {i//batch_size+1} XML ===\n{xml_str}\n")
-            print(f"--- [DEBUG] Transaction Data: ---\n{json.dumps(tx, indent=2, default=str)}\n")
-        except Exception as e:
-            responses.append({
-                "batch": i // batch_size + 1,
-                "status": "Failed",
-                "error": f"XML generation error: {str(e)}",
-                "transaction": tx
-            })
+        batch_no = i // batch_size + 1
+        batch = []
+        voucher_messages = []
+        for tx in transactions[i:i + batch_size]:
+            try:
+                voucher_messages.append(transaction_voucher(tx))
+                batch.append(tx)
+            except Exception as e:
+                responses.append({
+                    "batch": batch_no,
+                    "status": "Failed",
+                    "error": f"XML generation error: {str(e)}",
+                    "transaction": tx
+                })
+        if not batch:
             continue
 
         try:
-            tally_response = send_to_tally(xml_str)
-            try:
-                root = ET.fromstring(tally_response)
-                if "<LINEERROR>" in tally_response:
-                    error = root.find(".//LINEERROR")
-                    error_detail = error.text if error is not None else "Unknown error"
-                    responses.append({
-                        "batch": i // batch_size + 1,
-                        "status": "Failed",
-                        "error": error_detail,
-                        "tally_response": tally_response,
-                        "transaction": tx
-                    })
-                else:
-                    created = root.find(".//CREATED")
-                    if created is not None and int(created.text) > 0:
-                        responses.append({
-                            "batch": i // batch_size + 1,
-                            "status": "Success",
-                            "tally_response": tally_response,
-                            "transaction": tx
-                        })
-                    else:
-                        responses.append({
-                            "batch": i // batch_size + 1,
-                            "status": "Failed",
-                            "error": "Voucher not created",
-                            "tally_response": tally_response,
-                            "transaction": tx
-                        })
-            except ET.ParseError:
+            tally_response = await send_to_tally_async(
+                iter_import_envelope(voucher_messages, body.selected_company), lane="bulk"
+            )
+        except HTTPException as e:
+            for tx in batch:
                 responses.append({
-                    "batch": i // batch_size + 1,
+                    "batch": batch_no,
                     "status": "Failed",
-                    "error": "Invalid response from Tally",
-                    "tally_response": tally_response,
+                    "error": str(e.detail),
                     "transaction": tx
                 })
-        except HTTPException as e:
-            responses.append({
-                "batch": i // batch_size + 1,
-                "status": "Failed",
-                "error": str(e.detail),
+            continue
+
+        outcomes = map_import_results(batch, tally_response)
+        await save_push_state(db, [(tx["id"], status) for tx, (status, _) in zip(batch, outcomes)])
+        for tx, (status, error) in zip(batch, outcomes):
+            result = {
+                "batch": batch_no,
+                "status": status,
+                "tally_response": tally_response,
                 "transaction": tx
-            })
+            }
+            if error:
+                result["error"] = error
+            responses.append(result)
 
-    return {
+    return FastJSONResponse({
         "message": f"Pushed {sum(1 for r in responses if r['status'] == 'Success')} of {len(responses)} transactions.",
+        "skipped_already_pushed": skipped,
         "results": responses
-    }
+    })
+
+
+# ---------- BACKGROUND PUSH JOBS ----------
+
+def fetch_push_transactions(db: Session, statement_id, transaction_ids: list) -> dict:
+    # Bound as uuid[] so each id is a primary key lookup; the statement is
+    # checked on the fetched rows so the planner can't prefer the statement index
+    result = db.execute(
+        text("SELECT * FROM transactions WHERE id = ANY(CAST(:ids AS uuid[]))"),
+        {"ids": [uuid.UUID(str(tid)) for tid in transaction_ids]}
+    )
+    return {row["id"]: row for row in result.mappings() if str(row["statement_id"]) == str(statement_id)}
 
 
-@app.get("/ledgers/by-company/{company_id}")
+def push_voucher_batch(transactions: list, selected_company: str) -> list:
+    """Push transactions as one multi-voucher import; returns (status, error) per transaction."""
+    results = [None] * len(transactions)
+    batch, voucher_messages, positions = [], [], []
+    for idx, tx in enumerate(transactions):
+        try:
+            voucher_messages.append(transaction_voucher(tx))
+            batch.append(tx)
+            positions.append(idx)
+        except Exception as e:
+            results[idx] = ("Failed", f"XML generation error: {str(e)}")
+    if batch:
+        xml_bytes = import_envelope(voucher_messages, selected_company)
+        try:
+            response = post_xml(xml_bytes, lane="bulk")
+            response.raise_for_status()
+            mapped = map_import_results(batch, response.text)
+        except requests.ConnectionError as e:
+            # Includes connect timeouts. Re-sending is safe (stable voucher GUIDs),
+            # so the items stay pending until Tally is reachable again
+            raise TallyUnavailable(f"Tally connection failed: {str(e)}")
+        except requests.Timeout as e:
+            # Tally may still have imported the batch after we stopped waiting
+            mapped = [("Unknown", f"Tally did not answer in time: {str(e)}")] * len(batch)
+        except requests.RequestException as e:
+            mapped = [("Failed", f"Tally request failed: {str(e)}")] * len(batch)
+        for idx, result in zip(positions, mapped):
+            results[idx] = result
+    return results
+
+
+push_worker = PushJobWorker(SessionLocal, fetch_push_transactions, push_voucher_batch)
+
+@app.on_event("startup")
+def start_push_worker():
+    # Also resumes jobs a previous process left unfinished
+    push_worker.start()
+
+@app.on_event("shutdown")
+def stop_push_worker():
+    push_worker.stop()
+
+
+@app.post("/api/push-jobs")
+def create_push_job_endpoint(body: PushToTallyRequest = Body(...), db: Session = Depends(get_db)):
+    """Queue a statement push; returns the job id straight away."""
+    counts = statement_push_counts(db, body.statement_id)
+    job = create_push_job(db, body.statement_id, body.selected_company, body.batch_size)
+    if job is None:
+        return {
+            "job_id": None,
+            "status": "nothing_to_push",
+            "total": 0,
+            "message": "Nothing left to push; every transaction was already pushed.",
+            "skipped_already_pushed": counts["pushed"],
+        }
+    push_worker.notify()
+    return {**job, "skipped_already_pushed": counts["pushed"]}
+
+
+@app.get("/api/push-jobs/{job_id}", response_class=FastJSONResponse)
+def get_push_job_endpoint(job_id: uuid.UUID, after_seq: int = 0, db: Session = Depends(get_db)):
+    """Job progress plus the per-transaction results finished after `after_seq`."""
+    job = get_push_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Push job not found")
+    job["items"] = get_push_job_items(db, job_id, after_seq)
+    return FastJSONResponse(job)
+
+
+@app.get("/api/push-jobs/{job_id}/events")
+async def stream_push_job(job_id: uuid.UUID):
+    """Server-sent events: one `item` event per finished transaction, `progress` per change, then `end`."""
+    async def poll(after_seq):
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(lambda s: (get_push_job(s, job_id), get_push_job_items(s, job_id, after_seq)))
+
+    job, _ = await poll(0)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Push job not found")
+
+    def sse(event: str, data) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    async def events():
+        after_seq = 0
+        last = None
+        while True:
+            job, items = await poll(after_seq)
+            for item in items:
+                yield sse("item", item)
+                after_seq = item["seq"]
+            progress = {k: job[k] for k in ("status", "total", "succeeded", "failed", "unknown", "pending")}
+            if progress != last:
+                yield sse("progress", progress)
+                last = progress
+            if job["status"] in ("done", "failed") and not items:
+                yield sse("end", job)
+                return
+            if not items:
+                await asyncio.sleep(1)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/ledgers/by-company/{company_id}", response_class=FastJSONResponse)
 def get_ledgers_by_company(company_id: str, db: Session = Depends(get_db)):
     result = db.execute(
         text("SELECT id, name, group_id FROM ledgers WHERE company_id=:cid"),
         {"cid": company_id}
     )
     ledgers = [{"id": row[0], "name": row[1], "group_id": row[2]} for row in result]
-    return ledgers
+    return FastJSONResponse(ledgers)
+
+@app.get("/tally/stats")
+def tally_stats():
+    return client_stats()
+
+@app.get("/db/stats")
+def db_stats():
+    return {"sync": pool_stats.snapshot(), "async": async_pool_stats.snapshot()}
 
 @app.get("/")
 def health_check():
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+import requests
+import xml.etree.ElementTree as ET
+
+from tallyxml import iter_tally_records
+
+# How long cached masters are trusted before Tally is asked whether they changed
+TALLY_MASTER_CACHE_TTL = float(os.getenv("TALLY_MASTER_CACHE_TTL", "300"))
+
+
+def generate_alter_id_xml(company_name: str) -> str:
+    """Export just the current company's last master alteration id (a cheap probe)."""
+    return f"""
+    <ENVELOPE>
+      <HEADER>
+        <VERSION>1</VERSION>
+        <TALLYREQUEST>Export</TALLYREQUEST>
+        <TYPE>Collection</TYPE>
+        <ID>Company AlterIDs</ID>
+      </HEADER>
+      <BODY>
+        <DESC>
+          <STATICVARIABLES>
+            <SVEXPORTFORMAT>$$SysName:XML</SVEXPORTFORMAT>
+            <SVCURRENTCOMPANY>{company_name}</SVCURRENTCOMPANY>
+          </STATICVARIABLES>
+          <TDL>
+            <TDLMESSAGE>
+              <COLLECTION NAME="Company AlterIDs" ISINITIALIZE="Yes">
+                <TYPE>Company</TYPE>
+                <FILTERS>CurrentCompanyOnly</FILTERS>
+                <NATIVEMETHOD>NAME</NATIVEMETHOD>
+                <NATIVEMETHOD>ALTMSTID</NATIVEMETHOD>
+              </COLLECTION>
+              <SYSTEM TYPE="Formulae" NAME="CurrentCompanyOnly">$Name = ##SVCurrentCompany</SYSTEM>
+            </TDLMESSAGE>
+          </TDL>
+        </DESC>
+      </BODY>
+    </ENVELOPE>
+    """
+
+
+def fetch_master_alter_id(company_name: str) -> Optional[int]:
+    """
+    Return the company's ALTMSTID, which Tally bumps whenever any master
+    (ledger, group, voucher type, ...) is created, altered or deleted.
+    Returns None if Tally can't be asked, so callers fall back to reloading.
+    """
+    try:
+        for company in iter_tally_records(generate_alter_id_xml(company_name), "COMPANY"):
+            value = company.findtext("ALTMSTID")
+            if value and value.strip().isdigit():
+                return int(value.strip())
+    except (requests.RequestException, ET.ParseError):
+        pass
+    return None
+
+
+class CompanyMasters:
+    def __init__(self, ledgers: Iterable[str], voucher_types: Iterable[str], alter_id: Optional[int]):
+        self.ledgers = set(ledgers)
+        self.voucher_types = set(voucher_types)
+        self.alter_id = alter_id
+        self.checked_at = time.monotonic()
+
+
+class MasterDataCache:
+    """In-process cache of ledger names and voucher types per Tally company.
+
+    Entries are trusted for `ttl` seconds. After that one cheap ALTMSTID
+    probe decides whether the cached masters are still current or have to
+    be reloaded from Tally. Loaders raise on failure; only complete loads
+    are cached. Ledgers we create ourselves are written through.
+    """
+
+    def __init__(
+        self,
+        load_ledgers: Callable[[str], Iterable[str]],
+        load_voucher_types: Callable[[str], Iterable[str]],
+        fetch_alter_id: Callable[[str], Optional[int]] = fetch_master_alter_id,
+        ttl: float = TALLY_MASTER_CACHE_TTL,
+    ):
+        self.load_ledgers = load_ledgers
+        self.load_voucher_types = load_voucher_types
+        self.fetch_alter_id = fetch_alter_id
+        self.ttl = ttl
+        self._entries: Dict[str, CompanyMasters] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock_for(self, company: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(company, threading.Lock())
+
+    def get(self, company: str) -> CompanyMasters:
+        entry = self._entries.get(company)
+        if entry is not None and time.monotonic() - entry.checked_at < self.ttl:
+            return entry
+        # One thread per company refreshes; the others wait and reuse its result
+        with self._lock_for(company):
+            entry = self._entries.get(company)
+            if entry is not None and time.monotonic() - entry.checked_at < self.ttl:
+                return entry
+            alter_id = self.fetch_alter_id(company)
+            if entry is not None and alter_id is not None and alter_id == entry.alter_id:
+                entry.checked_at = time.monotonic()
+                return entry
+            # A loader that fails raises, so a failed or partial load is never stored
+            entry = CompanyMasters(self.load_ledgers(company), self.load_voucher_types(company), alter_id)
+            self._entries[company] = entry
+            return entry
+
+    def has_ledger(self, company: str, ledger_name: str) -> bool:
+        return ledger_name in self.get(company).ledgers
+
+    def has_voucher_type(self, company: str, voucher_type: str) -> bool:
+        return voucher_type in self.get(company).voucher_types
+
+    def add_ledger(self, company: str, ledger_name: str):
+        """Write-through for a ledger we just created in Tally."""
+        entry = self._entries.get(company)
+        if entry is None:
+            return
+        # Our own write bumps ALTMSTID by one. Any other jump means something
+        # else was altered too (vouchers share the sequence), so reload.
+        alter_id = self.fetch_alter_id(company)
+        if entry.alter_id is None or alter_id != entry.alter_id + 1:
+            self.invalidate(company)
+            return
+        entry.ledgers.add(ledger_name)
+        entry.alter_id = alter_id
+
+    def invalidate(self, company: Optional[str] = None):
+        if company is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(company, None)
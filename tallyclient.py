@@ -0,0 +1,309 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from tallyscheduler import get_scheduler
+
+# Tally server details (override with env vars when Tally runs elsewhere)
+TALLY_URL = os.getenv("TALLY_URL", "http://localhost:9000")
+TALLY_CONNECT_TIMEOUT = float(os.getenv("TALLY_CONNECT_TIMEOUT", "5"))
+TALLY_READ_TIMEOUT = float(os.getenv("TALLY_READ_TIMEOUT", "60"))
+TALLY_POOL_SIZE = int(os.getenv("TALLY_POOL_SIZE", "4"))
+TALLY_STREAM_CHUNK_SIZE = 64 * 1024
+# Envelopes given as byte chunks are sent with chunked transfer encoding, so the
+# whole request never sits in memory; set to false for a Tally that insists on
+# Content-Length (the chunks are then joined before sending)
+TALLY_CHUNKED_UPLOADS = os.getenv("TALLY_CHUNKED_UPLOADS", "true").lower() in ("1", "true", "yes")
+TALLY_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+Timeout = Union[float, Tuple[float, float]]
+# An envelope as text, bytes, or an iterable of byte chunks produced while it is sent
+XmlBody = Union[str, bytes, Iterable[bytes]]
+
+
+class UploadBody:
+    """
+    Request body pulled from an iterable of byte chunks as it is sent. Small
+    chunks (one voucher each) are regrouped into TALLY_UPLOAD_CHUNK_SIZE writes.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], size: int = TALLY_UPLOAD_CHUNK_SIZE):
+        self.chunks = chunks
+        self.size = size
+        self.sent = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        buffer = bytearray()
+        for chunk in self.chunks:
+            buffer += chunk
+            if len(buffer) >= self.size:
+                self.sent += len(buffer)
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            self.sent += len(buffer)
+            yield bytes(buffer)
+
+    async def aiter(self):
+        """Async iteration for httpx; the chunks may come from a DB cursor, so each is pulled off the event loop."""
+        iterator = iter(self)
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+
+
+def request_body(xml: XmlBody) -> Union[bytes, UploadBody]:
+    if isinstance(xml, str):
+        return xml.encode("utf-8")
+    if isinstance(xml, (bytes, bytearray)):
+        return xml
+    if not TALLY_CHUNKED_UPLOADS:
+        return b"".join(xml)
+    return UploadBody(xml)
+
+
+def _sent(data: Union[bytes, UploadBody]) -> int:
+    return data.sent if isinstance(data, UploadBody) else len(data)
+
+
+class TallyStats:
+    """Request, byte and latency counters for one Tally endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, sent: int, received: int, latency: float):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def record_error(self, sent: int, latency: float):
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+            self.bytes_sent += sent
+            self.total_latency += latency
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "total_latency_s": round(self.total_latency, 4),
+                "avg_latency_ms": round(self.total_latency * 1000 / self.requests, 2) if self.requests else 0.0,
+                "max_latency_ms": round(self.max_latency * 1000, 2),
+            }
+
+
+class TallyClient:
+    """Keep-alive HTTP client for a single Tally XML server.
+
+    Every caller going to the same URL shares one requests.Session, so TCP
+    connections to Tally are reused instead of being opened per request.
+    Requests are admitted through the URL's TallyScheduler; pass
+    lane="bulk" for imports so interactive reads are served first.
+    """
+
+    def __init__(
+        self,
+        url: str = TALLY_URL,
+        timeout: Timeout = (TALLY_CONNECT_TIMEOUT, TALLY_READ_TIMEOUT),
+        pool_size: int = TALLY_POOL_SIZE,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.stats = TallyStats()
+        self.scheduler = get_scheduler(url)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/xml"})
+
+    def post(
+        self, xml: XmlBody, timeout: Optional[Timeout] = None, lane: str = "interactive"
+    ) -> requests.Response:
+        """POST an XML envelope to Tally and return the raw response."""
+        data = request_body(xml)
+        with self.scheduler.slot(lane):
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.url, data=data, timeout=timeout or self.timeout)
+                content = response.content
+            except requests.RequestException:
+                self.stats.record_error(_sent(data), time.perf_counter() - start)
+                raise
+        self.stats.record(_sent(data), len(content), time.perf_counter() - start)
+        return response
+
+    @contextmanager
+    def stream(
+        self, xml: XmlBody, timeout: Optional[Timeout] = None, lane: str = "interactive"
+    ) -> Iterator[Iterator[bytes]]:
+        """POST an XML envelope and yield the response body as it arrives.
+
+        The scheduler slot is held until the block exits, since Tally is
+        busy until it has finished writing the response.
+        """
+        data = request_body(xml)
+        with self.scheduler.slot(lane):
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.url, data=data, timeout=timeout or self.timeout, stream=True)
+                response.raise_for_status()
+            except requests.RequestException:
+                self.stats.record_error(_sent(data), time.perf_counter() - start)
+                raise
+            received = 0
+
+            def chunks():
+                nonlocal received
+                for chunk in response.iter_content(TALLY_STREAM_CHUNK_SIZE):
+                    received += len(chunk)
+                    yield chunk
+
+            try:
+                yield chunks()
+            finally:
+                response.close()
+                self.stats.record(_sent(data), received, time.perf_counter() - start)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncTallyClient:
+    """asyncio counterpart of TallyClient for use inside async endpoints.
+
+    Shares the stats object of the sync client for the same URL so the
+    counters cover both transports.
+    """
+
+    def __init__(
+        self,
+        url: str = TALLY_URL,
+        timeout: Timeout = (TALLY_CONNECT_TIMEOUT, TALLY_READ_TIMEOUT),
+        pool_size: int = TALLY_POOL_SIZE,
+        stats: Optional[TallyStats] = None,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.stats = stats or TallyStats()
+        self.scheduler = get_scheduler(url)
+        self.client = httpx.AsyncClient(
+            headers={"Content-Type": "application/xml"},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=_httpx_timeout(timeout),
+        )
+
+    async def post(
+        self, xml: XmlBody, timeout: Optional[Timeout] = None, lane: str = "interactive"
+    ) -> httpx.Response:
+        """POST an XML envelope to Tally without blocking the event loop."""
+        data = request_body(xml)
+        async with self.scheduler.aslot(lane):
+            start = time.perf_counter()
+            try:
+                response = await self.client.post(
+                    self.url,
+                    content=data.aiter() if isinstance(data, UploadBody) else data,
+                    timeout=_httpx_timeout(timeout or self.timeout),
+                )
+            except httpx.HTTPError:
+                self.stats.record_error(_sent(data), time.perf_counter() - start)
+                raise
+        self.stats.record(_sent(data), len(response.content), time.perf_counter() - start)
+        return response
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def _httpx_timeout(timeout: Timeout) -> httpx.Timeout:
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+_clients: Dict[str, TallyClient] = {}
+_async_clients: Dict[str, AsyncTallyClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url: Optional[str] = None) -> TallyClient:
+    """Return the shared client for a Tally URL, creating it on first use."""
+    url = url or TALLY_URL
+    client = _clients.get(url)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(url)
+            if client is None:
+                client = TallyClient(url)
+                _clients[url] = client
+    return client
+
+
+def post_xml(
+    xml: XmlBody,
+    url: Optional[str] = None,
+    timeout: Optional[Timeout] = None,
+    lane: str = "interactive",
+) -> requests.Response:
+    """Send an XML envelope to Tally through the pooled client for `url`."""
+    return get_client(url).post(xml, timeout=timeout, lane=lane)
+
+
+def get_async_client(url: Optional[str] = None) -> AsyncTallyClient:
+    """Return the shared async client for a Tally URL, creating it on first use."""
+    url = url or TALLY_URL
+    client = _async_clients.get(url)
+    if client is None:
+        client = AsyncTallyClient(url, stats=get_client(url).stats)
+        _async_clients[url] = client
+    return client
+
+
+async def post_xml_async(
+    xml: XmlBody,
+    url: Optional[str] = None,
+    timeout: Optional[Timeout] = None,
+    lane: str = "interactive",
+) -> httpx.Response:
+    """Async version of post_xml for code running on the event loop."""
+    return await get_async_client(url).post(xml, timeout=timeout, lane=lane)
+
+
+async def aclose_clients():
+    """Close the async clients; call on application shutdown."""
+    while _async_clients:
+        _, client = _async_clients.popitem()
+        await client.aclose()
+
+
+def client_stats() -> Dict[str, dict]:
+    """Counters and scheduler queue metrics for every Tally endpoint used by this process."""
+    return {
+        url: {**client.stats.snapshot(), "scheduler": client.scheduler.snapshot()}
+        for url, client in list(_clients.items())
+    }
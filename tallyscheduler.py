@@ -0,0 +1,176 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict
+
+# Tally's XML server works through requests one at a time, so by default only
+# one request per Tally instance is in flight and the rest wait here.
+TALLY_MAX_IN_FLIGHT = int(os.getenv("TALLY_MAX_IN_FLIGHT", "1"))
+
+# Lower value = served first. Interactive reads (company/ledger lists) jump
+# ahead of bulk voucher imports waiting for the same Tally.
+LANES = {"interactive": 0, "bulk": 1}
+
+
+class _LaneStats:
+    def __init__(self):
+        self.waiting = 0
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "queue_depth": self.waiting,
+            "granted": self.granted,
+            "avg_wait_ms": round(self.total_wait * 1000 / self.granted, 2) if self.granted else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+
+class _Waiter(ABC):
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self.cancelled = False
+
+    @abstractmethod
+    def wake(self):
+        """Tell the waiting thread or task that its slot was granted."""
+
+
+class _ThreadWaiter(_Waiter):
+    def __init__(self, lane: str):
+        super().__init__(lane)
+        self.event = threading.Event()
+
+    def wake(self):
+        self.event.set()
+
+
+class _AsyncWaiter(_Waiter):
+    def __init__(self, lane: str, loop: asyncio.AbstractEventLoop):
+        super().__init__(lane)
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def wake(self):
+        self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class TallyScheduler:
+    """Bounded, prioritised admission for requests to one Tally instance.
+
+    Usable from both worker threads (`slot`) and the event loop (`aslot`);
+    both kinds of caller wait in the same priority queue.
+    """
+
+    def __init__(self, max_in_flight: int = TALLY_MAX_IN_FLIGHT):
+        self.max_in_flight = max(1, max_in_flight)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._lanes = {lane: _LaneStats() for lane in LANES}
+
+    def _enqueue(self, waiter: _Waiter):
+        with self._lock:
+            self._lanes[waiter.lane].waiting += 1
+            heapq.heappush(self._queue, (LANES[waiter.lane], next(self._seq), waiter))
+            self._drain()
+
+    def _drain(self):
+        # Caller holds self._lock
+        while self._queue and self.in_flight < self.max_in_flight:
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            self._lanes[waiter.lane].waiting -= 1
+            self._grant(waiter)
+
+    def _grant(self, waiter: _Waiter):
+        # Caller holds self._lock
+        waited = time.perf_counter() - waiter.enqueued
+        stats = self._lanes[waiter.lane]
+        stats.granted += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        waiter.granted = True
+        self.in_flight += 1
+        waiter.wake()
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._drain()
+
+    def _cancel(self, waiter: _Waiter):
+        with self._lock:
+            if waiter.granted:
+                granted = True
+            else:
+                granted = False
+                waiter.cancelled = True
+                self._lanes[waiter.lane].waiting -= 1
+        if granted:
+            self._release()
+
+    @contextmanager
+    def slot(self, lane: str = "interactive"):
+        """Block the calling thread until a request slot is free."""
+        waiter = _ThreadWaiter(lane)
+        self._enqueue(waiter)
+        waiter.event.wait()
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self, lane: str = "interactive"):
+        """Wait on the event loop until a request slot is free."""
+        waiter = _AsyncWaiter(lane, asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self._cancel(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "lanes": {lane: stats.snapshot() for lane, stats in self._lanes.items()},
+            }
+
+
+_schedulers: Dict[str, TallyScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(url: str) -> TallyScheduler:
+    """Return the scheduler guarding a Tally URL, creating it on first use."""
+    scheduler = _schedulers.get(url)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(url)
+            if scheduler is None:
+                scheduler = TallyScheduler()
+                _schedulers[url] = scheduler
+    return scheduler
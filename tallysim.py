@@ -0,0 +1,917 @@
+import argparse
+import os
+import random
+import re
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, Optional
+
+from tallyxml import iter_records, sanitize_xml_chunks
+from voucherxml import escape
+
+# Local stand-in for Tally's XML server (localhost:9000), for load tests where
+# no Tally instance can run. It answers the Export collections our modules ask
+# for from seeded masters and applies Import Data requests, reporting
+# CREATED/ALTERED/ERRORS counts and one LINEERROR per rejected object as Tally
+# does. Like Tally it handles one request at a time unless --concurrent is set.
+#
+#   python tallysim.py --port 9000 --latency-ms 40 --record-ms 0.2 --failure-rate 0.01
+
+SIM_CHUNK_SIZE = 64 * 1024
+FAILURE_MODES = ("error", "drop", "http")
+# The ledger export shipped next to this file, whatever the working directory
+DEFAULT_SEED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "debug_tally_ledgers.xml")
+
+# Tally's predefined groups and their parents ("" is Primary)
+DEFAULT_GROUPS = {
+    "Bank Accounts": "Current Assets",
+    "Bank OD A/c": "Loans (Liability)",
+    "Branch / Divisions": "",
+    "Capital Account": "",
+    "Cash-in-Hand": "Current Assets",
+    "Current Assets": "",
+    "Current Liabilities": "",
+    "Deposits (Asset)": "Current Assets",
+    "Direct Expenses": "",
+    "Direct Incomes": "",
+    "Duties & Taxes": "Current Liabilities",
+    "Fixed Assets": "",
+    "Indirect Expenses": "",
+    "Indirect Incomes": "",
+    "Investments": "",
+    "Loans & Advances (Asset)": "Current Assets",
+    "Loans (Liability)": "",
+    "Misc. Expenses (ASSET)": "",
+    "Provisions": "Current Liabilities",
+    "Purchase Accounts": "",
+    "Reserves & Surplus": "Capital Account",
+    "Sales Accounts": "",
+    "Secured Loans": "Loans (Liability)",
+    "Stock-in-Hand": "Current Assets",
+    "Sundry Creditors": "Current Liabilities",
+    "Sundry Debtors": "Current Assets",
+    "Suspense A/c": "",
+    "Unsecured Loans": "Loans (Liability)",
+}
+DEFAULT_VOUCHER_TYPES = [
+    "Contra", "Credit Note", "Debit Note", "Delivery Note", "Journal", "Memorandum", "Payment",
+    "Physical Stock", "Purchase", "Purchase Order", "Receipt", "Receipt Note", "Rejections In",
+    "Rejections Out", "Reversing Journal", "Sales", "Sales Order", "Stock Journal",
+]
+# (name, original name, expanded symbol, decimal places)
+DEFAULT_CURRENCIES = [("₹", "INR", "Indian Rupees", 2)]
+
+# Collection TYPE (lower case) by the HEADER ID of requests that carry no TDL
+COLLECTION_IDS = {
+    "list of companies": "company",
+    "list of accounts": "ledger",
+    "all ledgers": "ledger",
+    "list of groups": "group",
+    "list of currencies": "currency",
+    "voucher types": "voucher type",
+    "all vouchers": "voucher",
+}
+# Only the formula shapes our requests use
+_ALTERID_FORMULA = re.compile(r"\$AlterID\s*>\s*(\d+)", re.IGNORECASE)
+_NAME_FORMULA = re.compile(r'\$Name\s*=\s*(?:"([^"]*)"|(##SVCurrentCompany))', re.IGNORECASE)
+
+_NAME_LIST = (
+    '<LANGUAGENAME.LIST><NAME.LIST TYPE="String"><NAME>%s</NAME></NAME.LIST>'
+    '<LANGUAGEID TYPE="Number"> 1033</LANGUAGEID></LANGUAGENAME.LIST>'
+)
+UNKNOWN_REQUEST = b"<RESPONSE>Unknown Request, cannot be processed</RESPONSE>\n"
+
+
+def load_seed_ledgers(seed_file: str) -> Dict[str, str]:
+    """{ledger name: parent group} from a saved All Ledgers export."""
+    with open(seed_file, "rb") as f:
+        data = f.read()
+    ledgers = {}
+    for ledger in iter_records(sanitize_xml_chunks([data]), "LEDGER"):
+        name = ledger.get("NAME")
+        if name:  # <CMPINFO> reuses the LEDGER tag for its object count
+            ledgers[name] = (ledger.findtext("PARENT") or "").strip()
+    return ledgers
+
+
+def tally_amount(value: float) -> str:
+    return f"{value:.2f}"
+
+
+class SimCompany:
+    """
+    One company's masters and vouchers. Names are matched case-insensitively,
+    as in Tally. Masters and vouchers share one AlterID sequence; ALTMSTID and
+    ALTVCHID are the last AlterID given to a master and a voucher.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.guid = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{name}.tallysim"))
+        self.alter_id = 0
+        self.master_alter_id = 0
+        self.voucher_alter_id = 0
+        self.last_master_id = 0
+        self.groups: Dict[str, dict] = {}
+        self.ledgers: Dict[str, dict] = {}
+        self.voucher_types: Dict[str, dict] = {}
+        self.currencies: Dict[str, dict] = {}
+        # Keyed by REMOTEID (or GUID), so a re-sent voucher alters the one already held
+        self.vouchers: Dict[str, dict] = {}
+
+    def stamp(self, record: dict, voucher: bool = False) -> dict:
+        self.alter_id += 1
+        record["alter_id"] = self.alter_id
+        if voucher:
+            self.voucher_alter_id = self.alter_id
+        else:
+            self.master_alter_id = self.alter_id
+        if "master_id" not in record:
+            self.last_master_id += 1
+            record["master_id"] = self.last_master_id
+        return record
+
+    def add_master(self, masters: Dict[str, dict], name: str, **fields) -> dict:
+        record = self.stamp({"name": name, **fields})
+        masters[name.lower()] = record
+        return record
+
+    def has_group(self, name: str) -> bool:
+        return not name or name.lower() == "primary" or name.lower() in self.groups
+
+
+class TallySimulator:
+    """
+    Tally's request handling, independent of HTTP. `latency` and `jitter` are
+    seconds added to every request; `record_time` is charged per imported or
+    exported object, which is where Tally spends its time on large requests.
+    `failure_rate` of requests fail as `failure_mode`; `reject_rate` of
+    imported vouchers are refused with a LINEERROR.
+    """
+
+    def __init__(
+        self,
+        companies: Iterable[str] = ("Test",),
+        seed_ledgers: Optional[Dict[str, str]] = None,
+        seed_vouchers: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        record_time: float = 0.0,
+        failure_rate: float = 0.0,
+        failure_mode: str = "error",
+        reject_rate: float = 0.0,
+        concurrent: bool = False,
+        random_seed: Optional[int] = None,
+        quiet: bool = False,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.record_time = record_time
+        self.failure_rate = failure_rate
+        self.failure_mode = failure_mode
+        self.reject_rate = reject_rate
+        self.quiet = quiet
+        self._random = random.Random(random_seed)
+        self._random_lock = threading.Lock()
+        self._data_lock = threading.RLock()
+        # Tally works through requests one at a time
+        self._request_lock = None if concurrent else threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "exports": 0, "imports": 0, "failures": 0,
+                      "records_exported": 0, "created": 0, "altered": 0, "errors": 0}
+
+        self.companies: Dict[str, SimCompany] = {}
+        for name in companies:
+            company = SimCompany(name)
+            self._seed_masters(company, seed_ledgers or {})
+            self._seed_vouchers(company, seed_vouchers)
+            self.companies[name.lower()] = company
+
+    # ---------- SEEDING ----------
+
+    def _seed_masters(self, company: SimCompany, ledgers: Dict[str, str]):
+        for name, parent in DEFAULT_GROUPS.items():
+            company.add_master(company.groups, name, parent=parent, reserved=True)
+        for parent in ledgers.values():
+            if not company.has_group(parent):
+                company.add_master(company.groups, parent, parent="", reserved=False)
+        for name, parent in ledgers.items():
+            company.add_master(company.ledgers, name, parent="" if parent.lower() == "primary" else parent,
+                               opening_balance=0.0, is_deemed_positive=False)
+        for name in DEFAULT_VOUCHER_TYPES:
+            company.add_master(company.voucher_types, name, parent=name)
+        for name, original_name, expanded, decimals in DEFAULT_CURRENCIES:
+            company.add_master(company.currencies, name, original_name=original_name,
+                               expanded_symbol=expanded, decimal_places=decimals)
+
+    def _seed_vouchers(self, company: SimCompany, count: int):
+        """Payments and receipts between bank and other ledgers over one financial year."""
+        banks = [l["name"] for l in company.ledgers.values() if l["parent"] in ("Bank Accounts", "Cash-in-Hand")]
+        # Primary-level ledgers are reserved ones like Profit & Loss A/c
+        parties = [l["name"] for l in company.ledgers.values() if l["name"] not in banks and l["parent"]]
+        if not banks or not parties:
+            return
+        start = date(2024, 4, 1)
+        for i in range(count):
+            amount = round(self._random.uniform(100, 50000), 2)
+            bank, party = self._random.choice(banks), self._random.choice(parties)
+            if self._random.random() < 0.5:
+                voucher_type, entries = "Payment", [(party, True, -amount), (bank, False, amount)]
+            else:
+                voucher_type, entries = "Receipt", [(bank, True, -amount), (party, False, amount)]
+            remote_id = str(uuid.uuid5(uuid.NAMESPACE_OID, f"{company.name}-{i}"))
+            company.vouchers[remote_id] = company.stamp({
+                "remote_id": remote_id,
+                "date": (start + timedelta(days=self._random.randrange(365))).strftime("%Y%m%d"),
+                "voucher_type": voucher_type,
+                "voucher_number": str(i + 1),
+                "narration": f"Seeded {voucher_type.lower()} {i + 1}",
+                "entries": entries,
+            }, voucher=True)
+
+    # ---------- REQUESTS ----------
+
+    def request_slot(self):
+        return self._request_lock if self._request_lock is not None else nullcontext()
+
+    def _chance(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < rate
+
+    def draw_failure(self) -> Optional[str]:
+        """The failure mode this request will show, or None."""
+        if not self._chance(self.failure_rate):
+            return None
+        self._count(failures=1)
+        return self.failure_mode
+
+    def wait(self):
+        """Sleep for the configured per-request latency."""
+        delay = self.latency
+        if self.jitter > 0:
+            with self._random_lock:
+                delay += self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _pace(self, owed: float) -> float:
+        """Charge record_time for one more object. Sleeps in whole milliseconds; shorter sleeps overshoot."""
+        owed += self.record_time
+        if owed >= 0.001:
+            time.sleep(owed)
+            return 0.0
+        return owed
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def _log(self, message: str):
+        if not self.quiet:
+            print(message)
+
+    def handle(self, chunks: Iterable[bytes], apply: bool = True) -> Iterator[bytes]:
+        """
+        Read one request envelope from `chunks` and return the response body as
+        byte chunks. The request is parsed as it arrives, so a large import is
+        applied message by message. With apply=False nothing is changed (the
+        request is about to fail anyway).
+        """
+        self._count(requests=1)
+        request = {"kind": "", "static": {}, "desc": None}
+        result = None
+        tags = ("HEADER", "DESC", "REQUESTDESC", "TALLYMESSAGE")
+        for elem in iter_records(sanitize_xml_chunks(chunks), tags):
+            if elem.tag == "HEADER":
+                request["kind"] = (elem.findtext("TALLYREQUEST") or "").strip().lower()
+                request["id"] = (elem.findtext("ID") or "").strip()
+            elif elem.tag in ("DESC", "REQUESTDESC"):
+                request["desc"] = _read_desc(elem)
+                request["static"] = request["desc"]["static"]
+            elif request["kind"].startswith("import"):
+                if result is None:
+                    result = self._import_result(request["static"].get("SVCURRENTCOMPANY"))
+                if apply and "company" in result:
+                    self._import_message(result, elem)
+
+        if not apply:
+            return iter(())
+        if request["kind"].startswith("import"):
+            if result is None:
+                result = self._import_result(request["static"].get("SVCURRENTCOMPANY"))
+            return iter([self._import_response(result)])
+        if request["kind"].startswith("export"):
+            return self._export(request)
+        return iter([UNKNOWN_REQUEST])
+
+    def _company(self, name: Optional[str]) -> Optional[SimCompany]:
+        # Without a company Tally uses whichever one is loaded: the first
+        if not name:
+            return next(iter(self.companies.values()), None)
+        return self.companies.get(name.strip().lower())
+
+    # ---------- EXPORT ----------
+
+    def _export(self, request: dict) -> Iterator[bytes]:
+        desc = request["desc"] or {"static": {}, "type": "", "methods": set(), "formulae": {}, "filters": []}
+        collection = desc["type"] or COLLECTION_IDS.get(request.get("id", "").lower(), "")
+        company_name = desc["static"].get("SVCURRENTCOMPANY")
+        company = self._company(company_name)
+        if company is None and collection != "company":
+            return iter([_error_envelope(f"Could not set 'SVCurrentCompany' to '{company_name}'")])
+        render = EXPORTS.get(collection)
+        if render is None:
+            return iter([UNKNOWN_REQUEST])
+        self._count(exports=1)
+        # Taken under the data lock, rendered outside it
+        with self._data_lock:
+            records = list(render.records(self, company, desc))
+            extra = render.context(company, desc["methods"]) if render.context else None
+            counts = _cmpinfo(company)
+        return self._stream_export(collection, company, records, render, desc["methods"], extra, counts)
+
+    def _stream_export(self, collection, company, records, render, methods, extra, counts) -> Iterator[bytes]:
+        started = time.perf_counter()
+        yield (
+            "<ENVELOPE>\n <HEADER>\n  <VERSION>1</VERSION>\n  <STATUS>1</STATUS>\n </HEADER>\n"
+            f" <BODY>\n  <DESC>\n   <CMPINFO>{counts}</CMPINFO>\n  </DESC>\n  <DATA>\n   <COLLECTION>\n"
+        ).encode("utf-8")
+        buffer = []
+        size = 0
+        owed = 0.0
+        for record in records:
+            text = render.record(record, methods, extra)
+            buffer.append(text)
+            size += len(text)
+            owed = self._pace(owed)
+            if size >= SIM_CHUNK_SIZE:
+                yield "".join(buffer).encode("utf-8")
+                buffer, size = [], 0
+        buffer.append("   </COLLECTION>\n  </DATA>\n </BODY>\n</ENVELOPE>\n")
+        yield "".join(buffer).encode("utf-8")
+        self._count(records_exported=len(records))
+        self._log(f"📤 Export {collection} ({company.name if company else '-'}): "
+                  f"{len(records)} records in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    # ---------- IMPORT ----------
+
+    def _import_result(self, company_name: Optional[str]) -> dict:
+        result = {"created": 0, "altered": 0, "deleted": 0, "ignored": 0, "errors": 0, "exceptions": 0,
+                  "last_vch_id": 0, "last_mid": 0, "line_errors": [], "started": time.perf_counter(), "owed": 0.0}
+        company = self._company(company_name)
+        if company is None:
+            result["errors"] = 1
+            result["line_errors"].append(f"Could not set 'SVCurrentCompany' to '{company_name}'")
+        else:
+            result["company"] = company
+        return result
+
+    def _import_message(self, result: dict, message: ET.Element):
+        company = result["company"]
+        for obj in message:
+            result["owed"] = self._pace(result["owed"])
+            handler = IMPORTS.get(obj.tag)
+            if handler is None:
+                result["ignored"] += 1
+                continue
+            with self._data_lock:
+                error = handler(self, company, obj, result)
+            if error:
+                result["errors"] += 1
+                result["line_errors"].append(error)
+
+    def _import_response(self, result: dict) -> bytes:
+        self._count(imports=1, created=result["created"], altered=result["altered"], errors=result["errors"])
+        company = result.get("company")
+        self._log(f"📥 Import ({company.name if company else '-'}): {result['created']} created, "
+                  f"{result['altered']} altered, {result['deleted']} deleted, {result['errors']} errors "
+                  f"in {(time.perf_counter() - result['started']) * 1000:.1f} ms")
+        errors = "".join(f"<LINEERROR>{escape(e)}</LINEERROR>\n" for e in result["line_errors"])
+        return (
+            f"<RESPONSE>\n{errors}"
+            f"<CREATED>{result['created']}</CREATED><ALTERED>{result['altered']}</ALTERED>"
+            f"<DELETED>{result['deleted']}</DELETED><LASTVCHID>{result['last_vch_id']}</LASTVCHID>"
+            f"<LASTMID>{result['last_mid']}</LASTMID><COMBINED>0</COMBINED>"
+            f"<IGNORED>{result['ignored']}</IGNORED><ERRORS>{result['errors']}</ERRORS>"
+            f"<CANCELLED>0</CANCELLED><EXCEPTIONS>{result['exceptions']}</EXCEPTIONS>\n</RESPONSE>\n"
+        ).encode("utf-8")
+
+    def failure_response(self) -> bytes:
+        """What a request failing in "error" mode gets back: nothing imported, one exception."""
+        return (
+            "<RESPONSE>\n<LINEERROR>Simulated failure: request could not be processed</LINEERROR>\n"
+            "<CREATED>0</CREATED><ALTERED>0</ALTERED><DELETED>0</DELETED><LASTVCHID>0</LASTVCHID>"
+            "<LASTMID>0</LASTMID><COMBINED>0</COMBINED><IGNORED>0</IGNORED><ERRORS>1</ERRORS>"
+            "<CANCELLED>0</CANCELLED><EXCEPTIONS>1</EXCEPTIONS>\n</RESPONSE>\n"
+        ).encode("utf-8")
+
+
+def _read_desc(desc: ET.Element) -> dict:
+    """What an export needs from DESC (or an import from REQUESTDESC), read before the element is cleared."""
+    static = {}
+    for variables in desc.iter("STATICVARIABLES"):
+        for var in variables:
+            static[var.tag.upper()] = (var.text or "").strip()
+    collection = desc.find(".//COLLECTION")
+    formulae = {f.get("NAME", ""): f.text or "" for f in desc.iter("SYSTEM") if f.get("TYPE") == "Formulae"}
+    return {
+        "static": static,
+        "type": (collection.findtext("TYPE") or "").strip().lower() if collection is not None else "",
+        "methods": {(m.text or "").strip().upper() for m in desc.iter("NATIVEMETHOD") if m.text},
+        "filters": [(f.text or "").strip() for f in collection.iter("FILTERS")] if collection is not None else [],
+        "formulae": formulae,
+    }
+
+
+def _error_envelope(message: str) -> bytes:
+    return (
+        "<ENVELOPE>\n <HEADER>\n  <VERSION>1</VERSION>\n  <STATUS>0</STATUS>\n </HEADER>\n"
+        f" <BODY>\n  <DATA>\n   <LINEERROR>{escape(message)}</LINEERROR>\n  </DATA>\n </BODY>\n</ENVELOPE>\n"
+    ).encode("utf-8")
+
+
+def _cmpinfo(company: Optional[SimCompany]) -> str:
+    if company is None:
+        return "<COMPANY>0</COMPANY>"
+    return (
+        f"<COMPANY>0</COMPANY><GROUP>{len(company.groups)}</GROUP><LEDGER>{len(company.ledgers)}</LEDGER>"
+        f"<VOUCHERTYPE>{len(company.voucher_types)}</VOUCHERTYPE><CURRENCY>{len(company.currencies)}</CURRENCY>"
+        f"<VOUCHER>{len(company.vouchers)}</VOUCHER>"
+    )
+
+
+def _filter_masters(masters: Iterable[dict], desc: dict) -> Iterator[dict]:
+    """Apply the FILTERS of a collection whose formulae we understand; others are ignored."""
+    alter_since = None
+    name = None
+    for filter_name in desc["filters"]:
+        formula = desc["formulae"].get(filter_name, "")
+        match = _ALTERID_FORMULA.search(formula)
+        if match:
+            alter_since = int(match.group(1))
+        match = _NAME_FORMULA.search(formula)
+        if match and match.group(1) is not None:
+            name = match.group(1).lower()
+    for record in masters:
+        if alter_since is not None and record["alter_id"] <= alter_since:
+            continue
+        if name is not None and record["name"].lower() != name:
+            continue
+        yield record
+
+
+def _field(tag: str, value, methods: set, kind: str = "String") -> str:
+    # Tally exports the methods the collection asks for; all of them if it names none
+    if methods and tag not in methods:
+        return ""
+    if kind == "Number":
+        return f'<{tag} TYPE="Number"> {value}</{tag}>'
+    if kind == "Amount":
+        return f'<{tag} TYPE="Amount">{tally_amount(value)}</{tag}>'
+    return f'<{tag} TYPE="{kind}">{escape(value)}</{tag}>'
+
+
+class Export:
+    """How one collection TYPE is selected and rendered."""
+
+    def __init__(self, records, record, context=None):
+        self.records = records
+        self.record = record
+        self.context = context
+
+
+def _company_records(sim, company, desc):
+    companies = list(sim.companies.values())
+    for filter_name in desc["filters"]:
+        match = _NAME_FORMULA.search(desc["formulae"].get(filter_name, ""))
+        if match:
+            wanted = (desc["static"].get("SVCURRENTCOMPANY") if match.group(2) else match.group(1)) or ""
+            companies = [c for c in companies if c.name.lower() == wanted.lower()]
+    return companies
+
+
+def _render_company(company: SimCompany, methods: set, _) -> str:
+    name = escape(company.name)
+    return (
+        f'    <COMPANY NAME="{name}" RESERVEDNAME=""><NAME TYPE="String">{name}</NAME>'
+        + _field("GUID", company.guid, methods)
+        + _field("STARTINGFROM", "20240401", methods, "Date")
+        + _field("ALTMSTID", company.master_alter_id, methods, "Number")
+        + _field("ALTVCHID", company.voucher_alter_id, methods, "Number")
+        + "</COMPANY>\n"
+    )
+
+
+def _ledger_balances(company: SimCompany, methods: set) -> Optional[Dict[str, float]]:
+    if methods and "CLOSINGBALANCE" not in methods:
+        return None
+    balances: Dict[str, float] = {}
+    for voucher in company.vouchers.values():
+        for ledger, _, amount in voucher["entries"]:
+            balances[ledger.lower()] = balances.get(ledger.lower(), 0.0) + amount
+    return balances
+
+
+def _render_ledger(ledger: dict, methods: set, balances: Optional[Dict[str, float]]) -> str:
+    name = escape(ledger["name"])
+    closing = ledger["opening_balance"] + (balances or {}).get(ledger["name"].lower(), 0.0)
+    return (
+        f'    <LEDGER NAME="{name}" RESERVEDNAME="">'
+        + _field("PARENT", ledger["parent"], methods)
+        + _field("OPENINGBALANCE", ledger["opening_balance"], methods, "Amount")
+        + (_field("CLOSINGBALANCE", closing, methods, "Amount") if balances is not None else "")
+        + _field("ISDEEMEDPOSITIVE", "Yes" if ledger["is_deemed_positive"] else "No", methods, "Logical")
+        + _field("CURRENCYNAME", "₹", methods)
+        + _field("MASTERID", ledger["master_id"], methods, "Number")
+        + _field("ALTERID", ledger["alter_id"], methods, "Number")
+        + _NAME_LIST % name
+        + "</LEDGER>\n"
+    )
+
+
+def _render_group(group: dict, methods: set, _) -> str:
+    name = escape(group["name"])
+    reserved = name if group["reserved"] else ""
+    return (
+        f'    <GROUP NAME="{name}" RESERVEDNAME="{reserved}">'
+        + _field("PARENT", group["parent"], methods)
+        + _field("MASTERID", group["master_id"], methods, "Number")
+        + _field("ALTERID", group["alter_id"], methods, "Number")
+        + _NAME_LIST % name
+        + "</GROUP>\n"
+    )
+
+
+def _render_currency(currency: dict, methods: set, _) -> str:
+    name = escape(currency["name"])
+    return (
+        f'    <CURRENCY NAME="{name}" RESERVEDNAME=""><NAME TYPE="String">{name}</NAME>'
+        + _field("SYMBOL", currency["name"], methods)
+        + _field("ORIGINALNAME", currency["original_name"], methods)
+        + _field("EXPANDEDSYMBOL", currency["expanded_symbol"], methods)
+        + _field("DECIMALPLACES", currency["decimal_places"], methods, "Number")
+        + _field("ALTERID", currency["alter_id"], methods, "Number")
+        + "</CURRENCY>\n"
+    )
+
+
+def _render_voucher_type(voucher_type: dict, methods: set, _) -> str:
+    name = escape(voucher_type["name"])
+    return (
+        f'    <VOUCHERTYPE NAME="{name}" RESERVEDNAME="{name}">'
+        + _field("PARENT", voucher_type["parent"], methods)
+        + _field("NUMBERINGMETHOD", "Automatic", methods)
+        + _field("MASTERID", voucher_type["master_id"], methods, "Number")
+        + _field("ALTERID", voucher_type["alter_id"], methods, "Number")
+        + _NAME_LIST % name
+        + "</VOUCHERTYPE>\n"
+    )
+
+
+def _voucher_records(sim, company, desc):
+    static = desc["static"]
+    from_date, to_date = static.get("SVFROMDATE"), static.get("SVTODATE")
+    voucher_type = (static.get("VOUCHERTYPENAME") or "").lower()
+    for voucher in _filter_masters(company.vouchers.values(), desc):
+        if from_date and voucher["date"] < from_date:
+            continue
+        if to_date and voucher["date"] > to_date:
+            continue
+        if voucher_type and voucher["voucher_type"].lower() != voucher_type:
+            continue
+        yield voucher
+
+
+def _render_voucher(voucher: dict, methods: set, _) -> str:
+    entries = voucher["entries"]
+    entry_xml = "".join(
+        f"<ALLLEDGERENTRIES.LIST><LEDGERNAME>{escape(ledger)}</LEDGERNAME>"
+        f"<ISDEEMEDPOSITIVE>{'Yes' if deemed_positive else 'No'}</ISDEEMEDPOSITIVE>"
+        f"<AMOUNT>{tally_amount(amount)}</AMOUNT></ALLLEDGERENTRIES.LIST>"
+        for ledger, deemed_positive, amount in entries
+    ) if not methods or "ALLLEDGERENTRIES.LIST" in methods else ""
+    vch_type = escape(voucher["voucher_type"])
+    return (
+        f'    <VOUCHER REMOTEID="{escape(voucher["remote_id"])}" VCHTYPE="{vch_type}" ACTION="Create" '
+        f'OBJVIEW="Accounting Voucher View">'
+        + _field("DATE", voucher["date"], methods, "Date")
+        + _field("GUID", voucher["remote_id"], methods)
+        + _field("NARRATION", voucher["narration"], methods)
+        + _field("VOUCHERTYPENAME", voucher["voucher_type"], methods)
+        + _field("VOUCHERNUMBER", voucher["voucher_number"], methods)
+        + _field("PARTYLEDGERNAME", entries[-1][0] if entries else "", methods)
+        + (_field("AMOUNT", entries[0][2], methods, "Amount") if entries else "")
+        + _field("MASTERID", voucher["master_id"], methods, "Number")
+        + _field("ALTERID", voucher["alter_id"], methods, "Number")
+        + entry_xml
+        + "</VOUCHER>\n"
+    )
+
+
+EXPORTS = {
+    "company": Export(_company_records, _render_company),
+    "ledger": Export(lambda sim, c, desc: _filter_masters(c.ledgers.values(), desc), _render_ledger, _ledger_balances),
+    "group": Export(lambda sim, c, desc: _filter_masters(c.groups.values(), desc), _render_group),
+    "currency": Export(lambda sim, c, desc: _filter_masters(c.currencies.values(), desc), _render_currency),
+    "voucher type": Export(lambda sim, c, desc: _filter_masters(c.voucher_types.values(), desc),
+                           _render_voucher_type),
+    "voucher": Export(_voucher_records, _render_voucher),
+}
+
+
+# ---------- IMPORT HANDLERS ----------
+# Each applies one object of a TALLYMESSAGE and returns a LINEERROR, or None.
+
+def _master_name(obj: ET.Element) -> str:
+    return (obj.get("NAME") or obj.findtext("NAME") or obj.findtext(".//NAME") or "").strip()
+
+
+def _import_master(company: SimCompany, masters: Dict[str, dict], kind: str, obj: ET.Element,
+                   result: dict, fields: dict) -> Optional[str]:
+    """Create, alter or delete a master as its ACTION says; no ACTION creates or alters."""
+    name = _master_name(obj)
+    if not name:
+        return f"{kind} has no name"
+    action = (obj.get("ACTION") or "").lower()
+    existing = masters.get(name.lower())
+    if action == "delete":
+        if existing is None:
+            return f"{kind} '{name}' does not exist!"
+        del masters[name.lower()]
+        company.alter_id += 1
+        company.master_alter_id = company.alter_id
+        result["deleted"] += 1
+        return None
+    if existing is not None and action == "create":
+        return f"{kind} '{name}' already exists!"
+    if existing is None and action == "alter":
+        return f"{kind} '{name}' does not exist!"
+    if existing is None:
+        record = company.add_master(masters, name, **fields)
+        result["created"] += 1
+    else:
+        existing.update(fields)  # only the fields the message carries
+        record = company.stamp(existing)
+        result["altered"] += 1
+    result["last_mid"] = record["master_id"]
+    return None
+
+
+def _import_ledger(sim: TallySimulator, company: SimCompany, obj: ET.Element, result: dict) -> Optional[str]:
+    name = _master_name(obj)
+    existing = company.ledgers.get(name.lower())
+    fields = {} if existing is not None else {"parent": None, "opening_balance": 0.0, "is_deemed_positive": False}
+    parent = obj.findtext("PARENT")
+    if parent is not None:
+        parent = parent.strip()
+        if not company.has_group(parent):
+            return f"Group '{parent}' does not exist!"
+        fields["parent"] = "" if parent.lower() == "primary" else parent
+    opening = (obj.findtext("OPENINGBALANCE") or "").strip()
+    if opening:
+        try:
+            fields["opening_balance"] = float(opening)
+        except ValueError:
+            return f"Ledger '{name}': invalid opening balance '{opening}'"
+    deemed = obj.findtext("ISDEEMEDPOSITIVE")
+    if deemed:
+        fields["is_deemed_positive"] = deemed.strip().lower() == "yes"
+    if fields.get("parent", "") is None and (obj.get("ACTION") or "").lower() != "delete":
+        return f"Ledger '{name}' has no group (PARENT)"
+    return _import_master(company, company.ledgers, "Ledger", obj, result, fields)
+
+
+def _import_group(sim: TallySimulator, company: SimCompany, obj: ET.Element, result: dict) -> Optional[str]:
+    parent = (obj.findtext("PARENT") or "").strip()
+    if not company.has_group(parent):
+        return f"Group '{parent}' does not exist!"
+    name = _master_name(obj)
+    fields = {"parent": "" if parent.lower() == "primary" else parent}
+    if name.lower() not in company.groups:
+        fields["reserved"] = False
+    return _import_master(company, company.groups, "Group", obj, result, fields)
+
+
+def _import_voucher(sim: TallySimulator, company: SimCompany, obj: ET.Element, result: dict) -> Optional[str]:
+    number = (obj.findtext("VOUCHERNUMBER") or "").strip()
+    remote_id = obj.get("REMOTEID") or (obj.findtext("GUID") or "").strip() or None
+    action = (obj.get("ACTION") or "Create").lower()
+    existing = company.vouchers.get(remote_id) if remote_id else None
+
+    if action in ("delete", "cancel"):
+        if existing is None:
+            return f"Voucher '{number or remote_id}' does not exist!"
+        del company.vouchers[remote_id]
+        result["deleted"] += 1
+        return None
+
+    voucher_type = (obj.findtext("VOUCHERTYPENAME") or obj.get("VCHTYPE") or "").strip()
+    if voucher_type.lower() not in company.voucher_types:
+        return f"Voucher Type '{voucher_type}' does not exist!"
+    voucher_date = (obj.findtext("DATE") or "").strip()
+    try:
+        datetime.strptime(voucher_date, "%Y%m%d")
+    except ValueError:
+        return f"Voucher '{number}': invalid date '{voucher_date}'"
+
+    entries = []
+    for entry in list(obj.iter("ALLLEDGERENTRIES.LIST")) + list(obj.iter("LEDGERENTRIES.LIST")):
+        ledger = (entry.findtext("LEDGERNAME") or "").strip()
+        if ledger.lower() not in company.ledgers:
+            return f"Ledger '{ledger}' does not exist!"
+        amount_text = (entry.findtext("AMOUNT") or "0").strip()
+        try:
+            amount = float(amount_text)
+        except ValueError:
+            return f"Voucher '{number}': invalid amount '{amount_text}' for ledger '{ledger}'"
+        deemed = (entry.findtext("ISDEEMEDPOSITIVE") or "").strip().lower() == "yes"
+        entries.append((company.ledgers[ledger.lower()]["name"], deemed, amount))
+    if not entries:
+        return "No Entries in Voucher!"
+    debit = -sum(a for _, _, a in entries if a < 0)
+    credit = sum(a for _, _, a in entries if a > 0)
+    if abs(debit - credit) >= 0.005:
+        return (f"Voucher totals do not match! Dr: {tally_amount(debit)} Dr Cr: {tally_amount(credit)} Cr "
+                f"Diff: {tally_amount(abs(debit - credit))}")
+    if sim._chance(sim.reject_rate):
+        return f"Voucher '{number}' could not be saved (simulated rejection)"
+
+    voucher = {
+        "remote_id": remote_id or str(uuid.uuid4()),
+        "date": voucher_date,
+        "voucher_type": company.voucher_types[voucher_type.lower()]["name"],
+        "voucher_number": number,
+        "narration": obj.findtext("NARRATION") or "",
+        "entries": entries,
+    }
+    if existing is not None:
+        voucher["master_id"] = existing["master_id"]
+        result["altered"] += 1
+    else:
+        result["created"] += 1
+    company.vouchers[voucher["remote_id"]] = company.stamp(voucher, voucher=True)
+    result["last_vch_id"] = voucher["master_id"]
+    return None
+
+
+IMPORTS = {
+    "LEDGER": _import_ledger,
+    "GROUP": _import_group,
+    "VOUCHER": _import_voucher,
+}
+
+
+# ---------- HTTP ----------
+
+class TallyRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests, as Tally does
+    protocol_version = "HTTP/1.1"
+    server_version = "TallySimulator/1.0"
+    # Headers and body are separate writes; without TCP_NODELAY each kept-alive response waits on a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # the simulator prints one line per request itself
+
+    def do_GET(self):
+        self._send(200, b"<RESPONSE>TallyPrime Server is Running</RESPONSE>\n")
+
+    def do_POST(self):
+        sim = self.server.simulator
+        body = self._body_chunks()
+        with sim.request_slot():
+            failure = sim.draw_failure()
+            if failure == "drop":
+                for _ in body:
+                    pass
+                self.close_connection = True
+                return
+            try:
+                response = sim.handle(body, apply=failure is None)
+                sim.wait()
+                if failure == "http":
+                    self._send(503, b"")
+                elif failure == "error":
+                    self._send(200, sim.failure_response())
+                else:
+                    self._send_chunked(response)
+            except ET.ParseError as e:
+                print(f"⚠️ Could not parse request: {e}")
+                self.close_connection = True  # the rest of the body is still unread
+                self._send(200, UNKNOWN_REQUEST)
+
+    def _body_chunks(self) -> Iterator[bytes]:
+        """The request body, read as it is parsed; chunked transfer encoding or Content-Length."""
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass  # trailers
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        remaining = int(self.headers.get("Content-Length") or 0)
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, SIM_CHUNK_SIZE))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+    def _send(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunked(self, chunks: Iterator[bytes]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            if chunk:
+                self.wfile.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class TallySimulatorServer(ThreadingHTTPServer):
+    allow_reuse_address = True
+    # Load tests open many connections at once
+    request_queue_size = 128
+
+    def __init__(self, address, simulator: TallySimulator):
+        super().__init__(address, TallyRequestHandler)
+        self.simulator = simulator
+
+
+def start(simulator: TallySimulator, host: str = "127.0.0.1", port: int = 0) -> TallySimulatorServer:
+    """Serve `simulator` from a background thread; port 0 picks a free one (see server.server_address)."""
+    server = TallySimulatorServer((host, port), simulator)
+    threading.Thread(target=server.serve_forever, name="tallysim", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Tally XML server simulator for offline load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--company", action="append", help="Company to serve; repeat for several (default: Test)")
+    parser.add_argument("--seed-file", default=DEFAULT_SEED_FILE,
+                        help="Saved ledger export every company's ledgers are seeded from")
+    parser.add_argument("--vouchers", type=int, default=0, help="Random vouchers to seed per company")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random extra latency, up to this much")
+    parser.add_argument("--record-ms", type=float, default=0,
+                        help="Time spent per imported or exported object (Tally's serialization cost)")
+    parser.add_argument("--failure-rate", type=float, default=0, help="Fraction of requests that fail")
+    parser.add_argument("--failure-mode", choices=FAILURE_MODES, default="error",
+                        help="error: Tally error response; drop: close the connection; http: 503")
+    parser.add_argument("--reject-rate", type=float, default=0,
+                        help="Fraction of imported vouchers rejected with a LINEERROR")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="Handle requests in parallel (Tally itself handles one at a time)")
+    parser.add_argument("--random-seed", type=int, help="Makes failures, rejections and seeded vouchers repeatable")
+    parser.add_argument("--quiet", action="store_true", help="No line per request")
+    args = parser.parse_args()
+
+    simulator = TallySimulator(
+        companies=args.company or ["Test"],
+        seed_ledgers=load_seed_ledgers(args.seed_file) if args.seed_file else {},
+        seed_vouchers=args.vouchers,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        record_time=args.record_ms / 1000,
+        failure_rate=args.failure_rate,
+        failure_mode=args.failure_mode,
+        reject_rate=args.reject_rate,
+        concurrent=args.concurrent,
+        random_seed=args.random_seed,
+        quiet=args.quiet,
+    )
+    server = TallySimulatorServer((args.host, args.port), simulator)
+    companies = ", ".join(c.name for c in simulator.companies.values())
+    first = next(iter(simulator.companies.values()))
+    print(f"🧪 Tally simulator on http://{args.host}:{args.port} serving {companies} "
+          f"({len(first.ledgers)} ledgers, {len(first.vouchers)} vouchers each)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📊 {simulator.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import re
+import xml.etree.ElementTree as ET
+from typing import Iterable, Iterator, Optional, Union
+
+from tallyclient import get_client
+
+# Numeric character refs for control characters (decimal 0–31), e.g. &#4;, &#0;
+_CONTROL_CHAR_REF = re.compile(r'&#([0-8]|1[0-9]|2[0-9]|3[01]);')
+# Invalid literal unicode chars
+_INVALID_CHARS = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F\uFFFE\uFFFF]')
+# The same rules applied directly to UTF-8 bytes. Single-byte controls are
+# dropped with bytes.translate; C1 controls are encoded as \xC2\x80-\xC2\x9F
+# and U+FFFE/U+FFFF as \xEF\xBF\xBE/\xBF.
+_CONTROL_CHAR_REF_BYTES = re.compile(rb'&#(?:[0-8]|1[0-9]|2[0-9]|3[01]);')
+_CONTROL_BYTES = bytes(range(0x00, 0x09)) + b'\x0B\x0C' + bytes(range(0x0E, 0x20)) + b'\x7F'
+_INVALID_MULTIBYTE = re.compile(rb'\xC2[\x80-\x9F]|\xEF\xBF[\xBE\xBF]')
+
+
+def clean_xml(xml: str) -> str:
+    """Strip the control characters Tally emits that XML parsers reject."""
+    xml = _CONTROL_CHAR_REF.sub('', xml)
+    xml = _INVALID_CHARS.sub('', xml)
+    return xml
+
+
+def sanitize_xml(data: bytes) -> bytes:
+    """Byte-level equivalent of clean_xml for UTF-8 encoded XML."""
+    # Each pass is a C-level scan and the regex passes only run when needed
+    if b"&#" in data:
+        data = _CONTROL_CHAR_REF_BYTES.sub(b'', data)
+    data = data.translate(None, _CONTROL_BYTES)
+    if b"\xC2" in data or b"\xEF\xBF" in data:
+        data = _INVALID_MULTIBYTE.sub(b'', data)
+    return data
+
+
+def _utf8_split(buf: bytes) -> int:
+    """Index before a UTF-8 sequence left incomplete at the end of `buf` (len(buf) if none)."""
+    n = len(buf)
+    # The last lead byte within reach; continuation bytes are 0b10xxxxxx
+    for i in range(n - 1, max(-1, n - 4), -1):
+        byte = buf[i]
+        if byte < 0x80:
+            return n
+        if byte >= 0xC0:
+            needed = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return i if n - i < needed else n
+    return n
+
+
+def repair_utf8(data: bytes) -> bytes:
+    """Replace invalid UTF-8 sequences with U+FFFD, as decoding with errors="replace" does."""
+    if data.isascii():
+        return data
+    try:
+        data.decode("utf-8")
+        return data
+    except UnicodeDecodeError:
+        return data.decode("utf-8", "replace").encode("utf-8")
+
+
+def repair_utf8_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """repair_utf8 over a byte stream; a sequence split across chunks is carried over whole."""
+    tail = b""
+    for chunk in chunks:
+        buf = tail + chunk if tail else chunk
+        cut = _utf8_split(buf)
+        tail = buf[cut:]
+        if cut:
+            yield repair_utf8(buf[:cut] if cut < len(buf) else buf)
+    if tail:
+        yield repair_utf8(tail)
+
+
+def _safe_split(buf: bytes) -> int:
+    """Index up to which `buf` can be sanitized without cutting a pattern in half."""
+    n = len(buf)
+    cut = _utf8_split(buf)
+    # An unterminated "&#NN" at the end may still become a control char ref
+    amp = buf.rfind(b"&", max(0, n - 4))
+    if amp != -1 and b";" not in buf[amp:]:
+        cut = amp
+    if buf.endswith(b"\xEF\xBF"):
+        cut = min(cut, n - 2)
+    elif buf.endswith(b"\xC2") or buf.endswith(b"\xEF"):
+        cut = min(cut, n - 1)
+    return cut
+
+
+def sanitize_xml_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Sanitize a UTF-8 XML byte stream chunk by chunk as it arrives.
+
+    Works on the raw bytes; only a chunk that isn't valid UTF-8 is decoded
+    with errors="replace" and re-encoded, so the output always equals
+    clean_xml(data.decode("utf-8", "replace")). The few bytes at the end of
+    a chunk that could start an invalid or incomplete sequence are carried
+    over to the next chunk.
+    """
+    tail = b""
+    for chunk in chunks:
+        buf = tail + chunk if tail else chunk
+        cut = _safe_split(buf)
+        tail = buf[cut:]
+        if cut:
+            yield sanitize_xml(repair_utf8(buf[:cut] if cut < len(buf) else buf))
+    if tail:
+        yield sanitize_xml(repair_utf8(tail))
+
+
+def iter_records(chunks: Iterable[bytes], tags: Union[str, Iterable[str]]) -> Iterator[ET.Element]:
+    """
+    Incrementally parse an XML byte stream and yield each complete record
+    element whose tag is in `tags` (e.g. LEDGER, VOUCHER, GROUP).
+
+    Records are cleared and detached once the caller moves on, so read what
+    you need from the element inside the loop body. Records nested inside
+    another record are not yielded separately. Invalid UTF-8 is replaced
+    with U+FFFD rather than failing the whole export.
+    """
+    tags = {tags} if isinstance(tags, str) else set(tags)
+    parser = ET.XMLPullParser(events=("start", "end"))
+    stack = []
+    depth_in_record = 0
+
+    def drain():
+        nonlocal depth_in_record
+        for event, elem in parser.read_events():
+            if event == "start":
+                stack.append(elem)
+                if elem.tag in tags:
+                    depth_in_record += 1
+                continue
+            stack.pop()
+            if elem.tag not in tags:
+                continue
+            depth_in_record -= 1
+            if depth_in_record:
+                continue
+            yield elem
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+
+    for chunk in repair_utf8_chunks(chunks):
+        parser.feed(chunk)
+        yield from drain()
+    parser.close()
+    yield from drain()
+
+
+def iter_tally_records(
+    xml: str,
+    tags: Union[str, Iterable[str]],
+    url: Optional[str] = None,
+    lane: str = "interactive",
+    clean: bool = False,
+    timeout=None,
+) -> Iterator[ET.Element]:
+    """Send an Export request to Tally and stream the matching records back."""
+    with get_client(url).stream(xml, timeout=timeout, lane=lane) as chunks:
+        if clean:
+            chunks = sanitize_xml_chunks(chunks)
+        yield from iter_records(chunks, tags)
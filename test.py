@@ -1,13 +1,16 @@
-from fastapi import FastAPI, UploadFile, HTTPException
+from fastapi import FastAPI, UploadFile, HTTPException, Form
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
-import pandas as pd
-import io
 from datetime import datetime
 import xml.etree.ElementTree as ET
 import logging
 import requests
-import html
+
+from tallyclient import post_xml
+from statements import ledger_for_bank, parse_statement
+from tallyxml import iter_tally_records
+from voucherxml import XML_DECLARATION, import_envelope, iter_import_section, ledger_message, voucher_message
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -15,9 +18,6 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
-# Tally URL for HTTP POST requests
-TALLY_URL = "http://localhost:9000"
-
 # In-memory storage for the JSON data (simulating a backend)
 stored_data: Dict[str, Any] = {}
 
@@ -27,12 +27,6 @@ class TransactionUpdate(BaseModel):
     narration: Optional[str] = None
     amount: Optional[float] = None
 
-# Function to escape special characters in XML
-def escape_xml(text: str) -> str:
-    if not text:
-        return ""
-    return html.escape(str(text), quote=False)
-
 # Function to extract counterparty name from narration (for UPI transactions)
 def extract_counterparty_name(narration: str) -> str:
     if "UPI" in narration:
@@ -69,17 +63,18 @@ def fetch_all_ledgers(selected_company: str) -> List[str]:
       </BODY>
     </ENVELOPE>
     """
-    result = send_to_tally(xml)
-    logger.info(f"Fetch ledgers response:\n{result}")
     ledgers = []
     try:
-        root = ET.fromstring(result)
-        for ledger in root.findall(".//LEDGER"):
+        for ledger in iter_tally_records(xml, "LEDGER"):
             name = ledger.find(".//LANGUAGENAME.LIST/NAME.LIST/NAME")
             if name is not None and name.text:
                 ledgers.append(name.text)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error fetching ledgers from Tally: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error sending data to Tally: {str(e)}")
     except Exception as e:
         logger.error(f"Could not parse ledgers: {str(e)}")
+    logger.info(f"Fetched {len(ledgers)} ledgers")
     return ledgers
 
 # Function to check if a ledger exists
@@ -115,140 +110,78 @@ def fetch_voucher_types(selected_company: str) -> List[str]:
       </BODY>
     </ENVELOPE>
     """
-    result = send_to_tally(xml)
-    logger.info(f"Fetch voucher types response:\n{result}")
     voucher_types = []
     try:
-        root = ET.fromstring(result)
-        for vtype in root.findall(".//VOUCHERTYPE"):
+        for vtype in iter_tally_records(xml, "VOUCHERTYPE"):
             name = vtype.find(".//NAME")
             if name is not None and name.text:
                 voucher_types.append(name.text)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error fetching voucher types from Tally: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error sending data to Tally: {str(e)}")
     except Exception as e:
         logger.error(f"Could not parse voucher types: {str(e)}")
+    logger.info(f"Fetched voucher types: {voucher_types}")
     return voucher_types
 
 # Function to generate Tally XML for ledger creation
 def generate_ledger_xml(ledger_name: str, parent_group: str) -> str:
-    root = ET.Element("ENVELOPE")
-    
-    header = ET.SubElement(root, "HEADER")
-    ET.SubElement(header, "TALLYREQUEST").text = "Import Data"
-    
-    body = ET.SubElement(root, "BODY")
-    import_data = ET.SubElement(body, "IMPORTDATA")
-    
-    request_desc = ET.SubElement(import_data, "REQUESTDESC")
-    ET.SubElement(request_desc, "REPORTNAME").text = "All Masters"
-    
-    request_data = ET.SubElement(import_data, "REQUESTDATA")
-    
-    tally_message = ET.SubElement(request_data, "TALLYMESSAGE")
-    ledger = ET.SubElement(tally_message, "LEDGER", NAME=ledger_name, RESERVEDNAME="")
-    ET.SubElement(ledger, "NAME").text = ledger_name
-    ET.SubElement(ledger, "PARENT").text = parent_group
-    ET.SubElement(ledger, "ISDEEMEDPOSITIVE").text = "No"
-    ET.SubElement(ledger, "OPENINGBALANCE").text = "0"
-    
-    xml_str = ET.tostring(root, encoding="unicode", method="xml")
-    return '<?xml version="1.0" encoding="UTF-8"?>\n' + xml_str
+    return import_envelope([ledger_message(ledger_name, parent_group)], report="All Masters").decode("utf-8")
 
 # Function to generate Tally XML for a batch of transactions
 def generate_tally_xml(json_data: Dict[str, Any], selected_company: str = "Test", batch_transactions: List[Dict] = None) -> str:
-    root = ET.Element("ENVELOPE")
-    
+    chunks = [XML_DECLARATION, b"<ENVELOPE>\n"]
+
     # Only include ledger creation for counterparties if this is the first batch
     if batch_transactions is None or batch_transactions == json_data["transactions"][:len(batch_transactions)]:
-        header_ledger = ET.SubElement(root, "HEADER")
-        ET.SubElement(header_ledger, "TALLYREQUEST").text = "Import Data"
-        
-        body_ledger = ET.SubElement(root, "BODY")
-        import_data_ledger = ET.SubElement(body_ledger, "IMPORTDATA")
-        
-        request_desc_ledger = ET.SubElement(import_data_ledger, "REQUESTDESC")
-        ET.SubElement(request_desc_ledger, "REPORTNAME").text = "All Masters"
-        
-        request_data_ledger = ET.SubElement(import_data_ledger, "REQUESTDATA")
-        
         counterparties = set()
         for transaction in json_data["transactions"]:
             if transaction["transaction_type"] == "debit":
                 counterparty = extract_counterparty_name(transaction["narration"])
                 counterparties.add(counterparty)
-        
-        for counterparty in counterparties:
-            if counterparty == "Unknown Counterparty":
-                continue
-            tally_message = ET.SubElement(request_data_ledger, "TALLYMESSAGE")
-            ledger = ET.SubElement(tally_message, "LEDGER", NAME=counterparty, RESERVEDNAME="")
-            ET.SubElement(ledger, "NAME").text = counterparty
-            ET.SubElement(ledger, "PARENT").text = "Sundry Creditors"
-            ET.SubElement(ledger, "ISDEEMEDPOSITIVE").text = "No"
-            ET.SubElement(ledger, "OPENINGBALANCE").text = "0"
-    
+        chunks.extend(iter_import_section(
+            (ledger_message(c, "Sundry Creditors") for c in counterparties if c != "Unknown Counterparty"),
+            report="All Masters",
+        ))
+
     # Voucher Creation Section
-    header_voucher = ET.SubElement(root, "HEADER")
-    ET.SubElement(header_voucher, "TALLYREQUEST").text = "Import Data"
-    
-    body_voucher = ET.SubElement(root, "BODY")
-    import_data_voucher = ET.SubElement(body_voucher, "IMPORTDATA")
-    
-    request_desc_voucher = ET.SubElement(import_data_voucher, "REQUESTDESC")
-    ET.SubElement(request_desc_voucher, "REPORTNAME").text = "Vouchers"
-    static_vars = ET.SubElement(request_desc_voucher, "STATICVARIABLES")
-    ET.SubElement(static_vars, "SVCURRENTCOMPANY").text = selected_company
-    
-    request_data_voucher = ET.SubElement(import_data_voucher, "REQUESTDATA")
-    
-    bank_ledger = "ICICI Bank"
+    bank_ledger = ledger_for_bank(json_data.get("bank"))
     cash_ledger = "Cash"
     fallback_ledger = "Miscellaneous Expenses"
     
     logger.info(f"Using ledgers: Bank={bank_ledger}, Cash={cash_ledger}, Fallback={fallback_ledger}")
     
     transactions_to_process = batch_transactions if batch_transactions is not None else json_data["transactions"]
-    
-    for transaction in transactions_to_process:
-        tally_message = ET.SubElement(request_data_voucher, "TALLYMESSAGE")
-        
-        voucher_type = "Payment" if transaction["transaction_type"] == "debit" else "Receipt"
-        amount = transaction["withdrawal_amount"] if transaction["transaction_type"] == "debit" else transaction["deposit_amount"]
-        
-        if transaction["transaction_type"] == "debit":
-            from_ledger = bank_ledger
-            to_ledger = extract_counterparty_name(transaction["narration"])
-            if to_ledger == "Unknown Counterparty":
-                to_ledger = fallback_ledger
-        else:
-            from_ledger = cash_ledger
-            to_ledger = bank_ledger
-        
-        logger.info(f"Transaction ref_no={transaction['ref_no']}: from_ledger={from_ledger}, to_ledger={to_ledger}")
-        
-        guid = f"VCH-{transaction['ref_no']}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        voucher_number = f"VCH-{transaction['ref_no']}"
-        
-        voucher = ET.SubElement(tally_message, "VOUCHER", VCHTYPE=voucher_type, ACTION="Create", OBJVIEW="Accounting Voucher View")
-        ET.SubElement(voucher, "GUID").text = guid
-        ET.SubElement(voucher, "VOUCHERNUMBER").text = voucher_number
-        ET.SubElement(voucher, "DATE").text = datetime.strptime(transaction["date"], "%Y-%m-%d").strftime("%Y%m%d")
-        ET.SubElement(voucher, "NARRATION").text = escape_xml(transaction["narration"])
-        ET.SubElement(voucher, "VOUCHERTYPENAME").text = voucher_type
-        
-        ledger_entry1 = ET.SubElement(voucher, "ALLLEDGERENTRIES.LIST")
-        ET.SubElement(ledger_entry1, "LEDGERNAME").text = from_ledger
-        ET.SubElement(ledger_entry1, "ISDEEMEDPOSITIVE").text = "Yes" if transaction["transaction_type"] == "debit" else "No"
-        amount1 = -amount if transaction["transaction_type"] == "debit" else amount
-        ET.SubElement(ledger_entry1, "AMOUNT").text = str(amount1)
-        
-        ledger_entry2 = ET.SubElement(voucher, "ALLLEDGERENTRIES.LIST")
-        ET.SubElement(ledger_entry2, "LEDGERNAME").text = to_ledger
-        ET.SubElement(ledger_entry2, "ISDEEMEDPOSITIVE").text = "No" if transaction["transaction_type"] == "debit" else "Yes"
-        amount2 = amount if transaction["transaction_type"] == "debit" else -amount
-        ET.SubElement(ledger_entry2, "AMOUNT").text = str(amount2)
-    
-    xml_str = ET.tostring(root, encoding="unicode", method="xml")
-    return '<?xml version="1.0" encoding="UTF-8"?>\n' + xml_str
+
+    def vouchers():
+        for transaction in transactions_to_process:
+            voucher_type = "Payment" if transaction["transaction_type"] == "debit" else "Receipt"
+            amount = transaction["withdrawal_amount"] if transaction["transaction_type"] == "debit" else transaction["deposit_amount"]
+
+            if transaction["transaction_type"] == "debit":
+                from_ledger = bank_ledger
+                to_ledger = extract_counterparty_name(transaction["narration"])
+                if to_ledger == "Unknown Counterparty":
+                    to_ledger = fallback_ledger
+            else:
+                from_ledger = cash_ledger
+                to_ledger = bank_ledger
+
+            logger.info(f"Transaction ref_no={transaction['ref_no']}: from_ledger={from_ledger}, to_ledger={to_ledger}")
+
+            debit = transaction["transaction_type"] == "debit"
+            yield voucher_message(
+                voucher_type,
+                datetime.strptime(transaction["date"], "%Y-%m-%d").strftime("%Y%m%d"),
+                transaction["narration"],
+                [(from_ledger, debit, -amount if debit else amount), (to_ledger, not debit, amount if debit else -amount)],
+                voucher_number=f"VCH-{transaction['ref_no']}",
+                guid=f"VCH-{transaction['ref_no']}-{datetime.now().strftime('%Y%m%d%H%M%S')}",
+            )
+
+    chunks.extend(iter_import_section(vouchers(), company=selected_company))
+    chunks.append(b"</ENVELOPE>\n")
+    return b"".join(chunks).decode("utf-8")
 
 # Function to send XML to Tally via HTTP POST
 def send_to_tally(xml_data: str) -> str:
@@ -261,7 +194,7 @@ def send_to_tally(xml_data: str) -> str:
     logger.debug(f"XML content:\n{xml_data}")
     
     try:
-        response = requests.post(TALLY_URL, data=xml_data.encode("utf-8"))
+        response = post_xml(xml_data)
         response.raise_for_status()
         logger.info(f"Tally response: {response.text}")
         return response.text
@@ -271,109 +204,18 @@ def send_to_tally(xml_data: str) -> str:
 
 # Endpoint to upload and parse the Excel file
 @app.post("/upload-statement/")
-async def upload_statement(file: UploadFile):
+async def upload_statement(file: UploadFile, bank: Optional[str] = Form(None)):
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Only Excel files (.xlsx, .xls) are allowed")
 
-    # Read the Excel file
+    # Bank layout comes from the `bank` field or is detected from the header row
     try:
-        contents = await file.read()
-        df = pd.read_excel(io.BytesIO(contents), sheet_name="Sheet 1", engine="xlrd", header=None)
+        parsed = await run_in_threadpool(parse_statement, file.file, file.filename, bank)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error parsing Excel file: {str(e)}")
-
-    # Debug: Log the entire DataFrame to inspect its structure
-    logger.info("DataFrame shape: %s", df.shape)
-    logger.info("DataFrame:\n%s", df.to_string())
-
-    # Parse the Excel data into JSON
-    try:
-        account_info = {}
-        transaction_start_row = None
-        for idx, row in df.iterrows():
-            row_values = str(row.values)
-            if "Date" in row_values and "Narration" in row_values:
-                transaction_start_row = idx
-                break
-
-        if transaction_start_row is None:
-            logger.warning("Could not find transaction header row in Excel file")
-            transactions = []
-        else:
-            df_transactions = pd.read_excel(
-                io.BytesIO(contents),
-                sheet_name="Sheet 1",
-                skiprows=transaction_start_row,
-                header=0,
-                engine="xlrd"
-            )
+        raise HTTPException(status_code=400, detail=f"Error parsing Excel file: {str(e)}")
 
-            logger.info("Transaction DataFrame head:\n%s", df_transactions.head().to_string())
-            logger.info("Transaction DataFrame columns: %s", df_transactions.columns.tolist())
-
-            transactions = []
-            for idx, row in df_transactions.iterrows():
-                if pd.isna(row.get('Date')) or "STATEMENT SUMMARY" in str(row.get('Date', '')):
-                    break
-
-                try:
-                    date_str = str(row['Date']).strip()
-                    if not date_str or date_str.lower() == "nan":
-                        continue
-
-                    date = pd.to_datetime(date_str, format="%d/%m/%y").strftime("%Y-%m-%d")
-                    narration = str(row['Narration']).strip()
-                    ref_no = str(row['Chq./Ref.No.']).strip()
-                    value_date = pd.to_datetime(str(row['Value Dt']).strip(), format="%d/%m/%y").strftime("%Y-%m-%d")
-
-                    withdrawal_amt = 0.0
-                    deposit_amt = 0.0
-                    closing_balance = 0.0
-
-                    withdrawal_str = str(row['Withdrawal Amt.']).strip()
-                    if withdrawal_str and withdrawal_str.lower() != "nan":
-                        try:
-                            withdrawal_amt = float(withdrawal_str.replace(',', ''))
-                        except ValueError:
-                            logger.warning(f"Invalid Withdrawal Amt. in row {idx}: {withdrawal_str}")
-
-                    deposit_str = str(row['Deposit Amt.']).strip()
-                    if deposit_str and deposit_str.lower() != "nan":
-                        try:
-                            deposit_amt = float(deposit_str.replace(',', ''))
-                        except ValueError:
-                            logger.warning(f"Invalid Deposit Amt. in row {idx}: {deposit_str}")
-
-                    closing_balance_str = str(row['Closing Balance']).strip()
-                    if closing_balance_str and closing_balance_str.lower() != "nan":
-                        try:
-                            closing_balance = float(closing_balance_str.replace(',', ''))
-                        except ValueError:
-                            logger.warning(f"Invalid Closing Balance in row {idx}: {closing_balance_str}")
-
-                    transaction_type = "debit" if withdrawal_amt > 0 else "credit"
-                    category = "UPI Payment" if "UPI" in narration else "Other"
-
-                    transaction = {
-                        "date": date,
-                        "narration": narration,
-                        "ref_no": ref_no,
-                        "value_date": value_date,
-                        "withdrawal_amount": withdrawal_amt,
-                        "deposit_amount": deposit_amt,
-                        "closing_balance": closing_balance,
-                        "transaction_type": transaction_type,
-                        "category": category
-                    }
-                    transactions.append(transaction)
-                except Exception as e:
-                    logger.error(f"Error parsing transaction row {idx}: {row.to_dict()}, Error: {str(e)}")
-                    continue
-
-        json_data = {"account_info": account_info, "transactions": transactions}
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing Excel data: {str(e)}")
+    logger.info("Parsed %d %s transactions from %s", len(parsed["transactions"]), parsed["bank"], file.filename)
+    json_data = {"account_info": {}, "bank": parsed["bank"], "transactions": parsed["transactions"]}
 
     statement_id = "statement_1"
     stored_data[statement_id] = json_data
@@ -442,8 +284,12 @@ async def send_to_tally_endpoint(statement_id: str, selected_company: str = "Tes
             logger.warning(f"Transaction date {tx['date']} (ref_no={tx['ref_no']}) is outside the financial year 2025-2026")
 
     # Step 2: Validate ledgers
+    try:
+        bank_ledger = ledger_for_bank(json_data.get("bank"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     required_ledgers = [
-        ("ICICI Bank", "Bank Accounts"),
+        (bank_ledger, "Bank Accounts"),
         ("Cash", "Cash-in-hand"),
         ("Miscellaneous Expenses", "Indirect Expenses")
     ]
@@ -0,0 +1,173 @@
+import uuid
+from datetime import date, datetime
+from typing import Iterable, Iterator, Optional, Tuple
+
+from tallyxml import clean_xml
+
+# Voucher and master XML for Tally imports, written as UTF-8 bytes from fixed
+# templates. Only the values change per voucher, so there is no element tree to
+# build and nothing is held beyond the message being written.
+
+XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+
+_SECTION_OPEN = (
+    "<HEADER><TALLYREQUEST>Import Data</TALLYREQUEST></HEADER>\n"
+    "<BODY><IMPORTDATA><REQUESTDESC><REPORTNAME>%s</REPORTNAME>%s</REQUESTDESC><REQUESTDATA>\n"
+)
+_STATIC_COMPANY = "<STATICVARIABLES><SVCURRENTCOMPANY>%s</SVCURRENTCOMPANY></STATICVARIABLES>"
+_SECTION_CLOSE = b"</REQUESTDATA></IMPORTDATA></BODY>\n"
+
+_VOUCHER_OPEN = '<TALLYMESSAGE><VOUCHER%s VCHTYPE="%s" ACTION="Create" OBJVIEW="Accounting Voucher View">'
+_REMOTE_ID = ' REMOTEID="%s"'
+_GUID = "<GUID>%s</GUID>"
+_VOUCHER_HEAD = (
+    "<VOUCHERNUMBER>%s</VOUCHERNUMBER><DATE>%s</DATE>"
+    "<NARRATION>%s</NARRATION><VOUCHERTYPENAME>%s</VOUCHERTYPENAME>"
+)
+_LEDGER_ENTRY = (
+    "<ALLLEDGERENTRIES.LIST><LEDGERNAME>%s</LEDGERNAME>"
+    "<ISDEEMEDPOSITIVE>%s</ISDEEMEDPOSITIVE><AMOUNT>%s</AMOUNT></ALLLEDGERENTRIES.LIST>"
+)
+_VOUCHER_CLOSE = "</VOUCHER></TALLYMESSAGE>\n"
+
+_LEDGER = (
+    '<TALLYMESSAGE><LEDGER NAME="%s" RESERVEDNAME=""><NAME>%s</NAME><PARENT>%s</PARENT>'
+    "<ISDEEMEDPOSITIVE>No</ISDEEMEDPOSITIVE><OPENINGBALANCE>%s</OPENINGBALANCE></LEDGER></TALLYMESSAGE>\n"
+)
+
+# Fixed namespace so a transaction id always yields the same voucher GUID
+VOUCHER_GUID_NAMESPACE = uuid.UUID("6f1c2b0e-3d4a-5e8f-9a7b-2c1d0e9f8a7b")
+
+# (ledger name, is deemed positive, amount)
+LedgerEntry = Tuple[str, bool, object]
+
+
+def escape(value) -> str:
+    """Text or attribute value safe to put between our template's tags and quotes."""
+    if value is None:
+        return ""
+    text = value if isinstance(value, str) else str(value)
+    # Control characters aren't allowed in XML at all; the check is cheap for ordinary text
+    if not text.isprintable():
+        text = clean_xml(text)
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if '"' in text:
+        text = text.replace('"', "&quot;")
+    return text
+
+
+def tally_date(val) -> str:
+    """
+    Accepts string (YYYY-MM-DD), datetime.date, or datetime.datetime.
+    Returns date in Tally format (YYYYMMDD). Falls back to today.
+    """
+    if val is None:
+        return datetime.now().strftime("%Y%m%d")
+    if isinstance(val, (datetime, date)):
+        return val.strftime("%Y%m%d")
+    try:
+        return datetime.strptime(str(val), "%Y-%m-%d").strftime("%Y%m%d")
+    except Exception:
+        try:
+            import pandas as pd
+            return pd.to_datetime(str(val)).strftime("%Y%m%d")
+        except Exception:
+            return datetime.now().strftime("%Y%m%d")
+
+
+def voucher_guid(transaction_id) -> str:
+    """Stable Tally voucher GUID for a DB transaction, identical on every retry."""
+    return str(uuid.uuid5(VOUCHER_GUID_NAMESPACE, str(transaction_id)))
+
+
+def voucher_message(
+    voucher_type: str,
+    date_xml: str,
+    narration: Optional[str],
+    entries: Iterable[LedgerEntry],
+    voucher_number: Optional[str] = "",
+    guid: Optional[str] = None,
+    remote_id: Optional[str] = None,
+) -> bytes:
+    """One <TALLYMESSAGE> holding an accounting voucher; `date_xml` is YYYYMMDD."""
+    vch_type = escape(voucher_type)
+    parts = [_VOUCHER_OPEN % (_REMOTE_ID % escape(remote_id) if remote_id else "", vch_type)]
+    if guid:
+        parts.append(_GUID % escape(guid))
+    parts.append(_VOUCHER_HEAD % (escape(voucher_number), escape(date_xml), escape(narration), vch_type))
+    for ledger, deemed_positive, amount in entries:
+        parts.append(_LEDGER_ENTRY % (escape(ledger), "Yes" if deemed_positive else "No", escape(amount)))
+    parts.append(_VOUCHER_CLOSE)
+    return "".join(parts).encode("utf-8")
+
+
+def ledger_message(name: str, parent: str, opening_balance="0") -> bytes:
+    """One <TALLYMESSAGE> creating a ledger master."""
+    name = escape(name)
+    return (_LEDGER % (name, name, escape(parent), escape(opening_balance))).encode("utf-8")
+
+
+def fields_message(fields: dict) -> bytes:
+    """A <TALLYMESSAGE><VOUCHER> with one child element per field, named after the upper-cased key."""
+    parts = ["<TALLYMESSAGE><VOUCHER>"]
+    for key, value in fields.items():
+        tag = key.upper()
+        parts.append(f"<{tag}>{escape(value)}</{tag}>")
+    parts.append("</VOUCHER></TALLYMESSAGE>\n")
+    return "".join(parts).encode("utf-8")
+
+
+def transaction_voucher(tx: dict) -> bytes:
+    """Voucher message for a transactions row: bank leg first, Dr/Cr from which amount is set."""
+    voucher_type = (tx.get("voucher") or "Payment").capitalize()
+    if (tx.get("withdrawal_amount") or 0) > 0:
+        amount = float(tx["withdrawal_amount"])
+        entries = [(tx.get("from_ledger", ""), True, -amount), (tx.get("to_ledger", ""), False, amount)]
+    else:
+        amount = float(tx.get("deposit_amount") or 0)
+        entries = [(tx.get("from_ledger", ""), False, amount), (tx.get("to_ledger", ""), True, -amount)]
+
+    voucher_number = tx.get("ref_no") or f"VCH-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    guid = voucher_guid(tx["id"]) if tx.get("id") else str(uuid.uuid4())
+    # REMOTEID makes Tally match a re-sent voucher to the one it already holds
+    return voucher_message(
+        voucher_type,
+        tally_date(tx.get("date") or tx.get("value_date")),
+        tx.get("narration", ""),
+        entries,
+        voucher_number=voucher_number,
+        guid=guid,
+        remote_id=guid,
+    )
+
+
+def iter_import_section(
+    messages: Iterable[bytes], report: str = "Vouchers", company: Optional[str] = None
+) -> Iterator[bytes]:
+    """HEADER and BODY of one Import Data request around already serialized messages."""
+    static = _STATIC_COMPANY % escape(company) if company else ""
+    yield (_SECTION_OPEN % (escape(report), static)).encode("utf-8")
+    yield from messages
+    yield _SECTION_CLOSE
+
+
+def iter_import_envelope(
+    messages: Iterable[bytes], company: Optional[str] = None, report: str = "Vouchers"
+) -> Iterator[bytes]:
+    """
+    A complete Import Data envelope as byte chunks, one per message. Messages
+    are pulled from `messages` only as the envelope is consumed, so a lazy
+    source (a generator over DB rows) is never held in memory as a whole.
+    """
+    yield XML_DECLARATION + b"<ENVELOPE>\n"
+    yield from iter_import_section(messages, report, company)
+    yield b"</ENVELOPE>\n"
+
+
+def import_envelope(messages: Iterable[bytes], company: Optional[str] = None, report: str = "Vouchers") -> bytes:
+    return b"".join(iter_import_envelope(messages, company, report))